@@ -0,0 +1,134 @@
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict
+
+# Вес нового замера в скользящей оценке длительности вызова
+LATENCY_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """Очередь к LLM переполнена: запрос отклоняется сразу (429 с Retry-After)."""
+
+    def __init__(self, retry_after: int, reason: str):
+        super().__init__(reason)
+        self.retry_after = retry_after
+
+
+class FairScheduler:
+    """Допуск к вызовам LLM: не больше max_concurrency одновременно, остальные в очереди.
+
+    Очередь ограничена (всего max_queue, на клиента max_queue_per_client) и
+    обслуживается по кругу между клиентами, поэтому один активный клиент не
+    задерживает остальных. Переполнение и ожидание дольше max_wait отклоняются
+    с оценкой Retry-After. Работает в одном event loop, блокировки не нужны.
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_queue: int = 100, max_queue_per_client: int = 10, max_wait: float = 10):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_queue_per_client = max_queue_per_client
+        self.max_wait = max_wait
+        self.active = 0
+        self._queues: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()
+        self._queued = 0
+        self._latency = 5.0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def retry_after(self) -> int:
+        """Оценка, через сколько секунд освободится место в очереди."""
+        waves = (self._queued + 1) / self.max_concurrency
+        return max(1, math.ceil(waves * self._latency))
+
+    def check(self, client_id: str) -> None:
+        """Быстрая проверка до начала работы (например, до открытия SSE-потока)."""
+        if self.active < self.max_concurrency and not self._queued:
+            return
+        if self._queued >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(self.retry_after(), "Очередь к LLM переполнена")
+        if len(self._queues.get(client_id, ())) >= self.max_queue_per_client:
+            self.rejected += 1
+            raise AdmissionRejected(self.retry_after(), "Слишком много запросов от клиента")
+
+    def has_spare_capacity(self, reserve: int = 1) -> bool:
+        """Есть ли свободные места сверх reserve, оставленных пользователям (для фоновых задач)."""
+        reserve = min(reserve, self.max_concurrency - 1)
+        return not self._queued and self.active < self.max_concurrency - reserve
+
+    async def acquire(self, client_id: str) -> None:
+        if self.active < self.max_concurrency and not self._queued:
+            self.active += 1
+            self.admitted += 1
+            return
+        self.check(client_id)
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(client_id, deque()).append(waiter)
+        self._queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if self._discard(client_id, waiter):
+                self.timed_out += 1
+                raise AdmissionRejected(self.retry_after(), "Превышено время ожидания в очереди к LLM")
+            # Место выдали одновременно с таймаутом — пользуемся им
+        except BaseException:
+            if not self._discard(client_id, waiter):
+                # Место уже передано этому запросу, но он отменён — возвращаем его
+                self.release()
+            raise
+        self.admitted += 1
+
+    def _discard(self, client_id: str, waiter: asyncio.Future) -> bool:
+        """Убирает ожидающего из очереди; False, если место ему уже выдано."""
+        queue = self._queues.get(client_id)
+        if queue is None or waiter not in queue:
+            return False
+        queue.remove(waiter)
+        self._queued -= 1
+        if not queue:
+            del self._queues[client_id]
+        waiter.cancel()
+        return True
+
+    def release(self) -> None:
+        if not self._queues:
+            self.active -= 1
+            return
+        # Место переходит следующему клиенту по кругу, счётчик active не меняется
+        client_id, queue = next(iter(self._queues.items()))
+        waiter = queue.popleft()
+        self._queued -= 1
+        if queue:
+            self._queues.move_to_end(client_id)
+        else:
+            del self._queues[client_id]
+        waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, client_id: str) -> AsyncIterator[None]:
+        await self.acquire(client_id)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._latency += LATENCY_SMOOTHING * (elapsed - self._latency)
+            self.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "active": self.active,
+            "queued": self._queued,
+            "queued_clients": len(self._queues),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "avg_llm_seconds": round(self._latency, 3),
+        }
@@ -0,0 +1,82 @@
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+from context_builder import Context
+
+BATCH_ANSWER_HEADER_RE = re.compile(r"^\s*#{2,4}\s*(\d+)\s*[.):]?\s*$", re.MULTILINE)
+
+
+class BatchItem(NamedTuple):
+    """Вопрос пакета, не найденный в кеше: уточнённый вопрос, его контекст и ключ кеша.
+
+    context — полный контекст, как в /api/ask (по нему строится ключ кеша),
+    share — его начало в пределах доли бюджета, которая идёт в общий промпт группы.
+    """
+    position: int
+    question: str
+    processed_query: str
+    context: Context
+    cache_key: str
+    share: Context
+
+
+def group_items(items: List[BatchItem], token_budget: int, max_per_group: int) -> List[List[BatchItem]]:
+    """Жадно объединяет вопросы в группы с общим контекстом.
+
+    Контекст группы — объединение долей контекста её вопросов; вопрос
+    добавляется, пока объединение укладывается в token_budget и в группе
+    меньше max_per_group вопросов (ограничение на длину ответа модели).
+    Вопросы с одинаковым лучшим фрагментом идут подряд, чтобы делить фрагменты.
+    """
+    groups: List[List[BatchItem]] = []
+    current: List[BatchItem] = []
+    seen: set = set()
+    tokens = 0
+    for item in sorted(items, key=lambda item: item.share.passages[0].id if item.share.passages else ""):
+        new_passages = [p for p in item.share.passages if p.id not in seen]
+        new_tokens = sum(p.tokens for p in new_passages)
+        if current and (len(current) >= max_per_group or tokens + new_tokens > token_budget):
+            groups.append(current)
+            current, seen, tokens = [], set(), 0
+            new_passages = item.share.passages
+            new_tokens = sum(p.tokens for p in new_passages)
+        current.append(item)
+        seen.update(p.id for p in new_passages)
+        tokens += new_tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def group_context(group: List[BatchItem]) -> str:
+    """Текст общего контекста группы без повторов фрагментов."""
+    seen: set = set()
+    texts = []
+    for item in group:
+        if not item.share.passages:
+            # Пустая/недоступная база: у контекста нет фрагментов, только сообщение
+            if item.share.text not in texts:
+                texts.append(item.share.text)
+            continue
+        for passage in item.share.passages:
+            if passage.id not in seen:
+                seen.add(passage.id)
+                texts.append(passage.text)
+    return "\n\n".join(texts)
+
+
+def format_questions(questions: List[str]) -> str:
+    return "\n".join(f"{n}. {question}" for n, question in enumerate(questions, 1))
+
+
+def split_batch_answer(text: str, count: int) -> List[Optional[str]]:
+    """Делит ответ модели по заголовкам «### N»; отсутствующие ответы — None."""
+    answers: Dict[int, str] = {}
+    headers = list(BATCH_ANSWER_HEADER_RE.finditer(text))
+    for i, header in enumerate(headers):
+        number = int(header.group(1))
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        answer = text[header.end():end].strip()
+        if 1 <= number <= count and answer and number not in answers:
+            answers[number] = answer
+    return [answers.get(n) for n in range(1, count + 1)]
@@ -0,0 +1,4 @@
+"""Воспроизводимые бенчмарки бэкенда: нагрузка на приложение в процессе и микробенчмарки.
+
+Запуск из каталога backend: python -m benchmarks.run --help
+"""
@@ -0,0 +1,235 @@
+import asyncio
+import copy
+import random
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterator, List, Mapping, NamedTuple, Optional
+
+from pymongo.errors import OperationFailure
+
+# Словарь для синтетических документов: похож на тексты базы знаний университета
+VOCABULARY = (
+    "университет студент абитуриент факультет кафедра ректор декан общежитие приём документы "
+    "стоимость обучения грант поступление кампус стипендия экзамен сессия расписание библиотека "
+    "магистратура бакалавриат докторантура специальность программа лаборатория практика диплом "
+    "аудитория корпус договор оплата скидка льгота заявление справка медицинская комиссия "
+    "тестирование балл порог конкурс квота иностранный язык физика математика информатика "
+    "экономика право педагогика энергетика машиностроение химия биология история философия"
+).split()
+
+UNIVERSITY_TEMPLATES = (
+    "Какая {0} на факультете {1}?",
+    "Где найти {0} для студента {1}?",
+    "Сколько стоит {0} в университете, если {1}?",
+    "Как абитуриенту оформить {0} на {1}?",
+    "Когда {0} у студентов кафедры {1}?",
+)
+
+UNIVERSAL_TEMPLATES = (
+    "Как приготовить {0} дома?",
+    "Что такое {0} простыми словами?",
+    "Посоветуй книгу про {0}",
+    "Почему небо {0}?",
+)
+
+UNIVERSAL_TOPICS = ("плов", "квантовая механика", "фотосинтез", "синее", "рекурсия", "бешбармак", "блокчейн", "вулканы")
+
+
+class FakeMessage(NamedTuple):
+    """Ответ в форме LLMMessage GeminiClient: вызывающему коду нужен только .content."""
+    content: str
+
+
+class FakeRateLimitError(Exception):
+    """Аналог ResourceExhausted от Gemini (429)."""
+    code = 429
+
+
+class FakeLLM:
+    """Заменитель GeminiClient с настраиваемой задержкой и долей ошибок 429.
+
+    Задержка — latency ± jitter секунд; поток отдаёт ответ chunks фрагментами
+    с равными паузами, первый фрагмент — через first_token_ratio * latency.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        chunks: int = 8,
+        first_token_ratio: float = 0.3,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self.first_token_ratio = first_token_ratio
+        self._random = random.Random(seed)
+        self.calls = 0
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+
+    def _answer(self, prompt: Any) -> str:
+        questions = str(prompt).count("\n") + 1
+        return f"Синтетический ответ модели (строк промпта: {questions}). " + " ".join(self._random.sample(VOCABULARY, 12))
+
+    def _maybe_fail(self) -> None:
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise FakeRateLimitError("429 Resource has been exhausted (fake)")
+
+    async def ainvoke(self, prompt: Any) -> FakeMessage:
+        self.calls += 1
+        await asyncio.sleep(self._delay())
+        self._maybe_fail()
+        return FakeMessage(self._answer(prompt))
+
+    async def astream(self, prompt: Any) -> AsyncIterator[FakeMessage]:
+        self.calls += 1
+        delay = self._delay()
+        await asyncio.sleep(delay * self.first_token_ratio)
+        self._maybe_fail()
+        words = self._answer(prompt).split(" ")
+        step = max(1, len(words) // self.chunks)
+        rest = delay * (1 - self.first_token_ratio) / max(1, self.chunks - 1)
+        for i in range(0, len(words), step):
+            if i:
+                await asyncio.sleep(rest)
+            yield FakeMessage(" ".join(words[i:i + step]) + " ")
+
+    def invoke(self, prompt: Any) -> FakeMessage:
+        return asyncio.run(self.ainvoke(prompt))
+
+
+SYLLABLES = ("ка", "ра", "то", "ли", "ме", "но", "су", "да", "ви", "ол", "ен", "ар", "ис", "ут", "ба", "ге")
+
+
+def synthetic_vocabulary(size: int, seed: int = 0) -> List[str]:
+    """Словарь: общие слова предметной области, затем редкие псевдослова."""
+    rng = random.Random(seed)
+    words = list(VOCABULARY)
+    seen = set(words)
+    while len(words) < size:
+        word = "".join(rng.choices(SYLLABLES, k=rng.randint(3, 5)))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def synthetic_documents(
+    count: int,
+    paragraphs: int = 3,
+    words_per_paragraph: int = 60,
+    vocabulary_size: int = 20000,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    """Документы в форме коллекции storage: _id, строковые поля и updated_at.
+
+    Частоты слов распределены по Ципфу, как в естественном тексте: общие слова
+    встречаются почти везде, большинство остальных — в немногих документах.
+    """
+    rng = random.Random(seed)
+    words = synthetic_vocabulary(vocabulary_size, seed)
+    weights = [1 / rank for rank in range(1, len(words) + 1)]
+    base_time = datetime(2024, 1, 1)
+    docs = []
+    for n in range(count):
+        topic = rng.sample(VOCABULARY, 3)
+        content = "\n\n".join(
+            " ".join(rng.choices(words, weights=weights, k=words_per_paragraph)).capitalize() + "."
+            for _ in range(paragraphs)
+        )
+        docs.append({
+            "_id": n,
+            "title": f"Раздел {n}: {' '.join(topic)}",
+            "content": content,
+            "updated_at": base_time + timedelta(seconds=n),
+        })
+    return docs
+
+
+# Операторы сравнения фильтров find, которые поддерживает FakeCollection
+COMPARISONS = {
+    "$eq": lambda value, operand: value == operand,
+    "$ne": lambda value, operand: value != operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$lte": lambda value, operand: value is not None and value <= operand,
+    "$in": lambda value, operand: value in operand,
+}
+
+
+def matches(doc: Mapping[str, Any], filter: Optional[Mapping[str, Any]]) -> bool:
+    """Подходит ли документ под фильтр: равенство полей, операторы сравнения, $or и $and."""
+    for key, condition in (filter or {}).items():
+        if key == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, branch) for branch in condition):
+                return False
+        elif key.startswith("$"):
+            raise NotImplementedError(f"FakeCollection не поддерживает {key}")
+        elif isinstance(condition, Mapping) and condition and all(op.startswith("$") for op in condition):
+            for op, operand in condition.items():
+                if op not in COMPARISONS:
+                    raise NotImplementedError(f"FakeCollection не поддерживает {op}")
+                try:
+                    if not COMPARISONS[op](doc.get(key), operand):
+                        return False
+                except TypeError:
+                    # Как в MongoDB: значения несравнимых типов под условие не подходят
+                    return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+
+class FakeDatabase:
+    """База standalone-сервера: ping без operationTime (нет времени кластера)."""
+
+    def command(self, name: str, *args: Any, **kwargs: Any) -> Dict[str, Any]:
+        return {"ok": 1.0}
+
+
+class FakeCollection:
+    """Коллекция MongoDB в памяти (в духе mongomock) — ровно то, что использует бэкенд.
+
+    find поддерживает равенство полей, операторы сравнения ($gt, $in, ...),
+    $or/$and и проекции исключения; неподдерживаемый оператор — ошибка, а не
+    молча пустой результат. watch отвечает как standalone-сервер без change
+    streams, так что KnowledgeRefresher переходит на опрос.
+    """
+
+    def __init__(self, docs: List[Dict[str, Any]]):
+        self._docs = docs
+        self.database = FakeDatabase()
+
+    def find(self, filter: Optional[Mapping[str, Any]] = None, projection: Optional[Mapping[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        for doc in self._docs:
+            if not matches(doc, filter):
+                continue
+            result = copy.copy(doc)
+            for field, include in (projection or {}).items():
+                if not include:
+                    result.pop(field, None)
+            yield result
+
+    def count_documents(self, filter: Optional[Mapping[str, Any]] = None) -> int:
+        return sum(1 for _ in self.find(filter))
+
+    def watch(self, *args: Any, **kwargs: Any):
+        raise OperationFailure("The $changeStream stage is only supported on replica sets", code=40573)
+
+
+def university_questions(count: int, seed: int = 1) -> List[str]:
+    rng = random.Random(seed)
+    return [rng.choice(UNIVERSITY_TEMPLATES).format(*rng.sample(VOCABULARY, 2)) for _ in range(count)]
+
+
+def universal_questions(count: int, seed: int = 2) -> List[str]:
+    rng = random.Random(seed)
+    return [f"{rng.choice(UNIVERSAL_TEMPLATES).format(rng.choice(UNIVERSAL_TOPICS))} ({n})" for n in range(count)]
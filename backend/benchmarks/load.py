@@ -0,0 +1,94 @@
+import asyncio
+import os
+import resource
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import httpx
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Перцентиль методом ближайшего ранга (значения отсортированы)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса (Linux), иначе пиковый."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS отдаёт байты, Linux — килобайты
+        return peak / 2**20 if peak > 2**32 else peak / 1024
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    values = sorted(latencies)
+    return {
+        "p50": round(percentile(values, 50) * 1000, 3),
+        "p95": round(percentile(values, 95) * 1000, 3),
+        "p99": round(percentile(values, 99) * 1000, 3),
+        "mean": round(sum(values) / len(values) * 1000, 3) if values else 0.0,
+        "max": round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+async def run_scenario(
+    app: Any,
+    mode: str,
+    questions: Sequence[str],
+    concurrency: int,
+    requests: int,
+    endpoint: str = "/api/ask",
+    clients: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Замкнутая нагрузка: concurrency воркеров шлют requests запросов по кругу из questions.
+
+    Каждый воркер представляется отдельным клиентом (свой X-Forwarded-For),
+    чтобы честная очередь допуска видела реалистичное число клиентов.
+    """
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    cached = 0
+    next_request = 0
+    clients = clients or concurrency
+    rss_before = rss_mb()
+
+    async def worker(n: int, client: httpx.AsyncClient) -> None:
+        nonlocal next_request, cached
+        headers = {"X-Forwarded-For": f"10.{n % clients // 65536}.{n % clients // 256 % 256}.{n % clients % 256}"}
+        while next_request < requests:
+            question = questions[next_request % len(questions)]
+            next_request += 1
+            start = time.perf_counter()
+            response = await client.post(endpoint, json={"question": question}, headers=headers)
+            if endpoint.endswith("/stream"):
+                body = response.text
+                is_cached = '"cached": true' in body
+            else:
+                is_cached = bool(response.json().get("cached")) if response.status_code == 200 else False
+            latencies.append(time.perf_counter() - start)
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+            cached += is_cached
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*[worker(n, client) for n in range(concurrency)])
+        elapsed = time.perf_counter() - started
+    return {
+        "mode": mode,
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": latency_summary(latencies),
+        "status": statuses,
+        "cache_hit_ratio": round(cached / len(latencies), 4) if latencies else 0.0,
+        "rss_mb": round(rss_mb(), 1),
+        "rss_delta_mb": round(rss_mb() - rss_before, 1),
+    }
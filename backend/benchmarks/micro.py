@@ -0,0 +1,63 @@
+import os
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Sequence
+
+from context_builder import ContextBuilder
+from knowledge_snapshot import KnowledgeSnapshot
+from response_cache import ResponseCache, SQLiteResponseCache
+from semantic_cache import SemanticCache
+
+
+def measure(func: Callable[[int], Any], operations: int, repeat: int = 3) -> Dict[str, float]:
+    """Лучший из repeat прогонов func(i) для i в range(operations)."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for i in range(operations):
+            func(i)
+        best = min(best, time.perf_counter() - start)
+    return {
+        "operations": operations,
+        "us_per_op": round(best / operations * 1e6, 3),
+        "ops_per_sec": round(operations / best, 1) if best else 0.0,
+    }
+
+
+def retrieval_benchmarks(snapshot: KnowledgeSnapshot, builder: ContextBuilder, questions: Sequence[str], operations: int) -> Dict[str, Dict[str, float]]:
+    return {
+        "index_search": measure(lambda i: snapshot.index.search(questions[i % len(questions)], builder.max_candidates), operations),
+        "build_context": measure(lambda i: builder.build(snapshot, questions[i % len(questions)]), operations),
+    }
+
+
+def request_path_benchmarks(main: Any, questions: Sequence[str], operations: int) -> Dict[str, Dict[str, float]]:
+    """Этапы /api/ask до вызова LLM — на функциях приложения, без HTTP."""
+    return {
+        "preprocess_query": measure(lambda i: main.preprocess_query(questions[i % len(questions)]), operations),
+        "classify_question": measure(lambda i: main.classify_question(questions[i % len(questions)]), operations),
+        "retrieve_context": measure(lambda i: main.retrieve_context(questions[i % len(questions)]), operations),
+    }
+
+
+def cache_benchmarks(questions: Sequence[str], operations: int, answer_bytes: int = 2000) -> Dict[str, Dict[str, float]]:
+    answer = ("Ответ ассистента по базе знаний. " * (answer_bytes // 60 + 1))[:answer_bytes // 2]
+    keys: List[str] = [f"key-{n}" for n in range(operations)]
+    results: Dict[str, Dict[str, float]] = {}
+
+    memory = ResponseCache(max_bytes=256 * 1024 * 1024)
+    results["memory_put"] = measure(lambda i: memory.put(keys[i], answer), operations, repeat=1)
+    results["memory_get_hit"] = measure(lambda i: memory.get(keys[i]), operations)
+    results["memory_get_miss"] = measure(lambda i: memory.get("missing"), operations)
+
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite = SQLiteResponseCache(os.path.join(directory, "bench.sqlite3"), max_bytes=256 * 1024 * 1024)
+        results["sqlite_put"] = measure(lambda i: sqlite.put(keys[i], answer), operations, repeat=1)
+        results["sqlite_get_hit"] = measure(lambda i: sqlite.get(keys[i]), operations)
+        results["sqlite_get_miss"] = measure(lambda i: sqlite.get("missing"), operations)
+
+    semantic = SemanticCache(capacity=max(operations, len(questions)))
+    # Все вопросы — к одной версии базы знаний, как между обновлениями снимка
+    results["semantic_put"] = measure(lambda i: semantic.put(questions[i % len(questions)], "version", answer), len(questions), repeat=1)
+    results["semantic_get"] = measure(lambda i: semantic.get(questions[i % len(questions)] + " ?", "version"), operations)
+    return results
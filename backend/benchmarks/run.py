@@ -0,0 +1,232 @@
+"""Бенчмарк бэкенда: приложение FastAPI в процессе, фейковая LLM и синтетическая база знаний.
+
+Для каждого размера базы знаний (--docs) измеряются:
+  * загрузка снимка (время и прирост памяти);
+  * микробенчмарки поиска, этапов запроса и кешей;
+  * нагрузка на /api/ask (и /api/ask/stream) по режимам predefined, university,
+    universal при разных уровнях параллельности: пропускная способность,
+    p50/p95/p99, доля попаданий в кеш, коды ответов, память.
+
+Результат пишется в JSON (--output). С --baseline сравнивается с прошлым
+прогоном и завершается с кодом 1, если что-то ухудшилось больше чем на --tolerance.
+
+Пример (из каталога backend):
+    python -m benchmarks.run --docs 100,10000 --concurrency 1,16,64 --requests 300
+    python -m benchmarks.run --baseline .cache/benchmarks-release.json
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.fakes import FakeCollection, FakeLLM, synthetic_documents, universal_questions, university_questions
+from benchmarks.load import rss_mb, run_scenario
+from benchmarks.micro import cache_benchmarks, request_path_benchmarks, retrieval_benchmarks
+
+
+def int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def str_list(value: str) -> List[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Бенчмарк бэкенда ToU AI Assistant")
+    parser.add_argument("--docs", type=int_list, default=[100, 1000, 10000], help="размеры базы знаний, через запятую (до 100000)")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 8, 32], help="уровни параллельности, через запятую")
+    parser.add_argument("--requests", type=int, default=200, help="запросов на сценарий")
+    parser.add_argument("--modes", type=str_list, default=["predefined", "university", "universal"])
+    parser.add_argument("--endpoints", type=str_list, default=["ask"], help="ask и/или stream")
+    parser.add_argument("--question-pool", type=int, default=100, help="различных вопросов в сценарии (меньше — больше попаданий в кеш)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="задержка фейковой LLM, секунды")
+    parser.add_argument("--llm-jitter", type=float, default=0.0)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="доля ответов 429 от фейковой LLM")
+    parser.add_argument("--micro-ops", type=int, default=2000, help="операций на микробенчмарк")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", default=".cache/benchmarks.json")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для поиска регрессий")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="допустимое ухудшение, доля")
+    parser.add_argument("--verbose", action="store_true", help="не глушить логи приложения")
+    return parser.parse_args()
+
+
+def configure_environment() -> None:
+    """Окружение до импорта main: без MongoDB, без лимитов пула LLM и без записи в
+    постоянные файлы приложения (снимок, журнал вопросов, кеш ответов), чтобы
+    синтетические вопросы не попали в прогрев кеша настоящего сервиса."""
+    os.environ.pop("MONGODB_URI", None)
+    os.environ["KNOWLEDGE_SNAPSHOT_PATH"] = ""
+    os.environ["QUERY_LOG_PATH"] = ""
+    os.environ["PREWARM_TOP_N"] = "0"
+    # Кеш SQLite (RESPONSE_CACHE_BACKEND=sqlite) — во временном каталоге, удаляется при выходе
+    os.environ["RESPONSE_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="tougpt-bench-"), "responses.sqlite3")
+    atexit.register(shutil.rmtree, os.path.dirname(os.environ["RESPONSE_CACHE_PATH"]), True)
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark-key")
+    os.environ.setdefault("LLM_RATE_LIMIT_RPM", "1000000000")
+    os.environ.setdefault("RESPONSE_CACHE_BACKEND", "memory")
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def load_knowledge(main: Any, count: int) -> Dict[str, Any]:
+    """Подменяет коллекцию на синтетическую и загружает снимок, как при старте из MongoDB."""
+    docs = synthetic_documents(count)
+    manager = main.knowledge_manager
+    manager.collection = FakeCollection(docs)
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    manager.reload()
+    load_seconds = time.perf_counter() - start
+    manager.ready.set()
+    snapshot = manager.snapshot
+    return {
+        "documents": len(snapshot.docs),
+        "passages": len(snapshot.passages),
+        "load_seconds": round(load_seconds, 3),
+        "rss_delta_mb": round(rss_mb() - rss_before, 1),
+    }
+
+
+def scenario_questions(main: Any, mode: str, pool: int) -> List[str]:
+    if mode == "predefined":
+        return list(main.PREDEFINED_ANSWERS)
+    if mode == "university":
+        return university_questions(pool)
+    if mode == "universal":
+        return universal_questions(pool)
+    raise ValueError(f"Неизвестный режим: {mode}")
+
+
+async def run_load(main: Any, args: argparse.Namespace) -> List[Dict[str, Any]]:
+    results = []
+    for endpoint in args.endpoints:
+        path = "/api/ask/stream" if endpoint == "stream" else "/api/ask"
+        for mode in args.modes:
+            questions = scenario_questions(main, mode, args.question_pool)
+            for concurrency in args.concurrency:
+                # Каждый сценарий начинается с холодного кеша
+                main.response_cache.clear()
+                main.semantic_cache.clear()
+                result = await run_scenario(main.app, mode, questions, concurrency, args.requests, path)
+                latency = result["latency_ms"]
+                print(
+                    f"  {endpoint:6} {mode:10} c={concurrency:<4} {result['throughput_rps']:>9.1f} rps  "
+                    f"p50={latency['p50']:.1f} p95={latency['p95']:.1f} p99={latency['p99']:.1f} ms  "
+                    f"hit={result['cache_hit_ratio']:.2f} status={result['status']}"
+                )
+                results.append(result)
+    return results
+
+
+def run_micro(main: Any, args: argparse.Namespace) -> Dict[str, Dict[str, Dict[str, float]]]:
+    questions = [main.clarify_university_context(q) for q in university_questions(args.question_pool)]
+    micro = {
+        "retrieval": retrieval_benchmarks(main.knowledge_manager.snapshot, main.knowledge_manager.context_builder, questions, args.micro_ops),
+        "request_path": request_path_benchmarks(main, questions, args.micro_ops),
+        "cache": cache_benchmarks(questions, args.micro_ops),
+    }
+    for group, benchmarks in micro.items():
+        for name, result in benchmarks.items():
+            print(f"  {group}.{name:20} {result['us_per_op']:>10.1f} us/op")
+    return micro
+
+
+def flatten(results: List[Dict[str, Any]]) -> Dict[Tuple, Tuple[float, bool]]:
+    """Сравниваемые показатели: ключ -> (значение, больше ли — лучше)."""
+    metrics: Dict[Tuple, Tuple[float, bool]] = {}
+    for entry in results:
+        docs = entry["docs"]
+        for group, benchmarks in entry.get("micro", {}).items():
+            for name, result in benchmarks.items():
+                metrics[(docs, "micro", group, name, "us_per_op")] = (result["us_per_op"], False)
+        for scenario in entry.get("load", []):
+            key = (docs, "load", scenario["endpoint"], scenario["mode"], scenario["concurrency"])
+            metrics[key + ("throughput_rps",)] = (scenario["throughput_rps"], True)
+            metrics[key + ("p95_ms",)] = (scenario["latency_ms"]["p95"], False)
+    return metrics
+
+
+def find_regressions(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    previous = flatten(baseline["results"])
+    regressions = []
+    for key, (value, higher_is_better) in flatten(current["results"]).items():
+        if key not in previous:
+            continue
+        old = previous[key][0]
+        if old <= 0:
+            continue
+        change = (old - value) / old if higher_is_better else (value - old) / old
+        if change > tolerance:
+            regressions.append(f"{' / '.join(map(str, key))}: {old} -> {value} ({change:+.0%})")
+    return regressions
+
+
+def main() -> int:
+    args = parse_args()
+    configure_environment()
+    import main as app_main
+
+    if not args.verbose:
+        logging.getLogger("tougpt").setLevel(logging.WARNING)
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+    fake_llm = FakeLLM(latency=args.llm_latency, jitter=args.llm_jitter, error_rate=args.llm_error_rate, seed=0)
+    app_main.llm_manager = app_main.OptimizedLLMManager(client_factory=lambda api_key, model: fake_llm)
+
+    report: Dict[str, Any] = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": git_revision(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+        },
+        "results": [],
+    }
+    for count in args.docs:
+        print(f"База знаний: {count} документов")
+        entry: Dict[str, Any] = {"docs": count, "snapshot": load_knowledge(app_main, count)}
+        print(f"  снимок: {entry['snapshot']}")
+        if not args.skip_micro:
+            entry["micro"] = run_micro(app_main, args)
+        if not args.skip_load:
+            entry["load"] = asyncio.run(run_load(app_main, args))
+        report["results"].append(entry)
+
+    directory = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(directory, exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = find_regressions(report, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Регрессии (хуже более чем на {args.tolerance:.0%}):")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("Регрессий нет")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
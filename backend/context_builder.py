@@ -0,0 +1,70 @@
+import hashlib
+import itertools
+from typing import List, NamedTuple, Optional, Sequence
+
+from knowledge_snapshot import KnowledgeSnapshot, Passage
+
+
+class Context(NamedTuple):
+    """Собранный контекст: текст для промпта, использованные фрагменты и ключ для кеша."""
+    text: str
+    passages: List[Passage]
+    key: str
+
+
+def context_key(snapshot: KnowledgeSnapshot, passages: List[Passage]) -> str:
+    """Ключ контекста: версия снимка и идентификаторы фрагментов (без хеширования самого текста)."""
+    ids_hash = hashlib.md5("|".join(passage.id for passage in passages).encode()).hexdigest()
+    return f"{snapshot.version}:{ids_hash}"
+
+
+def knowledge_version(key: str) -> str:
+    """Версия снимка базы знаний, для которого собран контекст с ключом key."""
+    return key.split(":", 1)[0]
+
+
+class ContextBuilder:
+    """Сборка контекста для промпта из лучших фрагментов в пределах бюджета токенов."""
+
+    def __init__(self, token_budget: int = 3000, max_candidates: int = 50):
+        self.token_budget = token_budget
+        self.max_candidates = max_candidates
+
+    def rank(self, snapshot: KnowledgeSnapshot, query: str) -> List[Passage]:
+        ranked = [snapshot.passages[passage_id] for passage_id, _ in snapshot.index.search(query, self.max_candidates)]
+        # Без совпадений берём первые фрагменты базы знаний, а не всю базу целиком
+        return ranked or list(itertools.islice(snapshot.passages.values(), self.max_candidates))
+
+    def pack(self, passages: List[Passage], token_budget: int) -> List[Passage]:
+        """Жадно набирает фрагменты по порядку, пропуская не помещающиеся в остаток бюджета."""
+        selected: List[Passage] = []
+        remaining = token_budget
+        for passage in passages:
+            if remaining <= 0:
+                break
+            if passage.tokens <= remaining:
+                selected.append(passage)
+                remaining -= passage.tokens
+        return selected
+
+    def build(self, snapshot: KnowledgeSnapshot, query: str, pinned_ids: Sequence[str] = ()) -> Context:
+        """Текст контекста, список использованных фрагментов и ключ контекста.
+
+        pinned_ids — фрагменты, которые стоит сохранить (например, из прошлых
+        ответов в сессии): им отводится до четверти бюджета, если они ещё есть в снимке.
+        """
+        return self.from_ranked(snapshot, self.rank(snapshot, query), pinned_ids)
+
+    def from_ranked(self, snapshot: KnowledgeSnapshot, ranked: List[Passage], pinned_ids: Sequence[str] = (), token_budget: Optional[int] = None) -> Context:
+        """Контекст из уже ранжированных фрагментов (по умолчанию в пределах self.token_budget)."""
+        if not snapshot.passages:
+            # Пустая или недоступная база: отдаём сообщение снимка как есть
+            return Context(snapshot.content, [], context_key(snapshot, []))
+        token_budget = self.token_budget if token_budget is None else token_budget
+        pinned = self.pack([snapshot.passages[i] for i in pinned_ids if i in snapshot.passages], token_budget // 4)
+        if pinned:
+            pinned_set = {passage.id for passage in pinned}
+            ranked = [passage for passage in ranked if passage.id not in pinned_set]
+        # Даже если лучший фрагмент больше бюджета, контекст не должен остаться пустым
+        selected = (self.pack(ranked, token_budget - sum(p.tokens for p in pinned)) or ranked[:1]) + pinned
+        return Context("\n\n".join(passage.text for passage in selected), selected, context_key(snapshot, selected))
@@ -0,0 +1,68 @@
+import asyncio
+from typing import Any, AsyncIterator, NamedTuple, Optional, Tuple
+
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+
+
+class LLMMessage(NamedTuple):
+    """Ответ модели: вызывающему коду нужен только .content."""
+    content: str
+
+
+class GeminiClient:
+    """Клиент Gemini для одной пары (ключ, модель) без собственных повторов.
+
+    ChatGoogleGenerativeAI повторяет запрос при 429/503 до 10 раз с паузами
+    до минуты, а клиент google.generativeai берёт ключ из глобального
+    genai.configure(). Здесь у каждого клиента свой ключ, а запрос уходит
+    в GenerativeService с retry=None: ошибка сразу возвращается в LLMPool,
+    который переключается на другой ключ или модель.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        top_k: Optional[int] = None,
+        max_output_tokens: Optional[int] = None,
+    ):
+        self.api_key = api_key
+        self.model = model if "/" in model else f"models/{model}"
+        self.generation_config = glm.GenerationConfig(**{
+            name: value
+            for name, value in {"temperature": temperature, "top_p": top_p, "top_k": top_k, "max_output_tokens": max_output_tokens}.items()
+            if value is not None
+        })
+        # Асинхронный канал gRPC привязан к event loop, в котором создан
+        self._client: Optional[Tuple[Any, glm.GenerativeServiceAsyncClient]] = None
+
+    def _async_client(self) -> glm.GenerativeServiceAsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client[0] is not loop:
+            self._client = (loop, glm.GenerativeServiceAsyncClient(client_options={"api_key": self.api_key}))
+        return self._client[1]
+
+    def _request(self, prompt: Any) -> glm.GenerateContentRequest:
+        return glm.GenerateContentRequest(
+            model=self.model,
+            contents=[glm.Content(role="user", parts=[glm.Part(text=str(prompt))])],
+            generation_config=self.generation_config,
+        )
+
+    async def ainvoke(self, prompt: Any) -> LLMMessage:
+        response = await self._async_client().generate_content(self._request(prompt), retry=None)
+        # .text бросает ValueError, если ответ заблокирован или пуст
+        return LLMMessage(genai.types.AsyncGenerateContentResponse.from_response(response).text)
+
+    async def astream(self, prompt: Any) -> AsyncIterator[LLMMessage]:
+        stream = await self._async_client().stream_generate_content(self._request(prompt), retry=None)
+        async for chunk in stream:
+            text = "".join(part.text for candidate in chunk.candidates[:1] for part in candidate.content.parts)
+            if text:
+                yield LLMMessage(text)
+
+    def invoke(self, prompt: Any) -> LLMMessage:
+        return asyncio.run(self.ainvoke(prompt))
@@ -0,0 +1,156 @@
+import copy
+import heapq
+import math
+import re
+from typing import Dict, Hashable, Iterable, List, Mapping, Optional, Set, Tuple
+
+# Токены: кириллица (включая казахские буквы), латиница и цифры
+TOKEN_RE = re.compile(r"[0-9a-zа-яёәғқңөұүһі]+", re.IGNORECASE)
+
+STOP_WORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только
+ее её мне было вот от меня еще ещё нет о из ему теперь когда даже ну вдруг ли если уже
+или ни быть был него до вас нибудь опять уж вам ведь там потом себя ничего ей может они
+тут где есть надо ней для мы тебя их чем была сам чтоб без будто чего раз тоже себе под
+будет ж тогда кто этот того потому этого какой совсем ним здесь этом один почти мой тем
+чтобы нее сейчас были куда зачем всех никогда можно при наконец два об другой хоть после
+над больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо
+свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно всю между
+это какие каков какова каково сколько
+және мен бен пен бұл сол ол не да де та те ма ме ба бе па пе үшін туралы қандай қалай
+қайда қашан неше кім
+""".split())
+
+# Окончания отсортированы по убыванию длины: отрезается самое длинное подходящее
+RU_SUFFIXES = sorted("""
+иями ями ами ого его ему ому ыми ими ией ием иям иях ии ая яя ое ее ие ые ой ей ий ый ую юю
+ом ем ам ям ах ях ов ев ия ья ье ию ью ость ости остью остей остям остях ение ения ению
+ением ении ениям ениях ениями ться тся ешь ет ют ут ишь ит ят а я о е и ы у ю ь й
+""".split(), key=len, reverse=True)
+# Глагольные окончания отрезаются только после гласной («поступает», «стоит»):
+# у существительных перед ними согласная основы («университет», «институт»)
+RU_VERB_SUFFIXES = frozenset("ешь ет ют ут ишь ит ят".split())
+RU_VOWELS = set("аеиоуыэюяё")
+
+KZ_SUFFIXES = sorted("""
+лардың лердің дардың дердің тардың тердің лары лері дары дері тары тері лар лер дар дер
+тар тер ның нің дың дің тың тің ға ге қа ке на не нан нен дан ден тан тен да де та те
+ын ін сы сі ы і
+""".split(), key=len, reverse=True)
+
+KZ_LETTERS = set("әғқңөұүһі")
+MIN_STEM_LEN = 3
+
+
+def stem(token: str) -> str:
+    """Лёгкий стемминг: отрезает одно типичное окончание (русское или казахское)."""
+    suffixes = KZ_SUFFIXES if KZ_LETTERS.intersection(token) else RU_SUFFIXES
+    for suffix in suffixes:
+        if token.endswith(suffix) and len(token) - len(suffix) >= MIN_STEM_LEN:
+            if suffix in RU_VERB_SUFFIXES and token[-len(suffix) - 1] not in RU_VOWELS:
+                continue
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на нормализованные стеммированные термы без стоп-слов."""
+    terms = []
+    for token in TOKEN_RE.findall(text.lower().replace("ё", "е")):
+        if token in STOP_WORDS or (len(token) < 2 and not token.isdigit()):
+            continue
+        terms.append(stem(token))
+    return terms
+
+
+class InvertedIndex:
+    """Инвертированный индекс с ранжированием BM25 по секциям, адресуемым ключами.
+
+    Экземпляр не изменяется после построения: updated() возвращает новый индекс,
+    разделяющий со старым списки вхождений всех незатронутых термов.
+    """
+
+    def __init__(self, sections: Mapping[Hashable, str], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.sections: Dict[Hashable, str] = {}
+        self._postings: Dict[str, Dict[Hashable, int]] = {}
+        self._terms: Dict[Hashable, Tuple[str, ...]] = {}
+        self._doc_len: Dict[Hashable, int] = {}
+        self._total_len = 0
+        for key, section in sections.items():
+            self._add(key, section, None)
+
+    def _add(self, key: Hashable, section: str, copied: Optional[Set[str]]) -> None:
+        terms = tokenize(section)
+        tf: Dict[str, int] = {}
+        for term in terms:
+            tf[term] = tf.get(term, 0) + 1
+        self.sections[key] = section
+        self._terms[key] = tuple(tf)
+        self._doc_len[key] = len(terms)
+        self._total_len += len(terms)
+        for term, freq in tf.items():
+            self._writable_postings(term, copied)[key] = freq
+
+    def _remove(self, key: Hashable, copied: Set[str]) -> None:
+        del self.sections[key]
+        self._total_len -= self._doc_len.pop(key)
+        for term in self._terms.pop(key):
+            postings = self._writable_postings(term, copied)
+            del postings[key]
+            if not postings:
+                del self._postings[term]
+
+    def _writable_postings(self, term: str, copied: Optional[Set[str]]) -> Dict[Hashable, int]:
+        # copied is None при первичном построении: копировать нечего
+        postings = self._postings.get(term)
+        if postings is None:
+            postings = self._postings[term] = {}
+            if copied is not None:
+                copied.add(term)
+        elif copied is not None and term not in copied:
+            postings = self._postings[term] = dict(postings)
+            copied.add(term)
+        return postings
+
+    def updated(self, upserts: Mapping[Hashable, str], removed: Iterable[Hashable] = ()) -> "InvertedIndex":
+        """Новый индекс с добавленными/заменёнными и удалёнными секциями."""
+        new = copy.copy(self)
+        new.sections = dict(self.sections)
+        new._postings = dict(self._postings)
+        new._terms = dict(self._terms)
+        new._doc_len = dict(self._doc_len)
+        copied: Set[str] = set()
+        for key in set(removed) | set(upserts):
+            if key in new.sections:
+                new._remove(key, copied)
+        for key, section in upserts.items():
+            new._add(key, section, copied)
+        return new
+
+    def __len__(self) -> int:
+        return len(self.sections)
+
+    def _idf(self, df: int) -> float:
+        n = len(self.sections)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[Hashable, float]]:
+        """Возвращает top_k пар (ключ секции, BM25-скор) по убыванию релевантности."""
+        if not self.sections:
+            return []
+        avgdl = self._total_len / len(self.sections) or 1.0
+        scores: Dict[Hashable, float] = {}
+        for term in set(tokenize(query)):
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(len(postings))
+            for key, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self._doc_len[key] / avgdl)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def top_sections(self, query: str, top_k: int = 5) -> List[str]:
+        return [self.sections[key] for key, _ in self.search(query, top_k)]
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger("tougpt")
+
+# «The $changeStream stage is only supported on replica sets» — standalone mongod
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+
+def cluster_time(collection: Any) -> Optional[Any]:
+    """Текущее время кластера (operationTime); None, если сервер его не сообщает (standalone)."""
+    try:
+        return collection.database.command("ping").get("operationTime")
+    except PyMongoError:
+        return None
+
+
+class KnowledgeRefresher:
+    """Фоновое инкрементальное обновление базы знаний.
+
+    Использует change stream MongoDB, если он доступен (replica set / Atlas),
+    иначе опрашивает коллекцию по водяным знакам updated_at и _id. Изменения
+    применяются к снимку менеджера через manager.apply_changes(), полная
+    перезагрузка (для учёта удалений при опросе) выполняется раз в
+    full_reload_interval секунд — тоже в фоне, не блокируя читателей.
+    """
+
+    def __init__(self, manager: Any, poll_interval: float = 30, full_reload_interval: float = 3600, start_at_operation_time: Optional[Any] = None):
+        self.manager = manager
+        # Время кластера до полной загрузки снимка: изменения во время загрузки не теряются
+        self._start_at = start_at_operation_time
+        self._resume_token: Optional[Any] = None
+        self.poll_interval = poll_interval
+        self.full_reload_interval = full_reload_interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._use_change_stream = True
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="knowledge-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                if self._use_change_stream:
+                    self._watch()
+                else:
+                    self._poll_loop()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                    # Standalone mongod не поддерживает change streams — переходим на опрос
+                    logger.info(f"Change stream недоступен ({e}), база знаний обновляется опросом")
+                    self._use_change_stream = False
+                    continue
+                # Например, история изменений уже вытеснена из oplog: продолжить с токена
+                # нельзя, поэтому перечитываем коллекцию и следим с момента перед загрузкой
+                logger.error(f"Ошибка change stream: {e}")
+                if self._stop.wait(self.poll_interval):
+                    break
+                self._resync()
+            except PyMongoError as e:
+                logger.error(f"Ошибка фонового обновления базы знаний: {e}")
+                self._stop.wait(self.poll_interval)
+
+    def _resync(self) -> None:
+        self._resume_token = None
+        self._start_at = cluster_time(self.manager.collection)
+        self.manager.reload()
+
+    def _watch(self) -> None:
+        collection = self.manager.collection
+        last_full_reload = time.time()
+        # После переподключения продолжаем с последнего обработанного события
+        options: Dict[str, Any] = {}
+        if self._resume_token is not None:
+            options["resume_after"] = self._resume_token
+        elif self._start_at is not None:
+            options["start_at_operation_time"] = self._start_at
+        with collection.watch(full_document="updateLookup", max_await_time_ms=1000, **options) as stream:
+            while not self._stop.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    self.apply_change_event(change)
+                self._resume_token = stream.resume_token
+                if time.time() - last_full_reload >= self.full_reload_interval:
+                    self.manager.reload()
+                    last_full_reload = time.time()
+
+    def apply_change_event(self, change: Dict[str, Any]) -> None:
+        """Применяет одно событие change stream к снимку базы знаний."""
+        operation = change.get("operationType")
+        doc_id = change.get("documentKey", {}).get("_id")
+        if operation in ("insert", "update", "replace"):
+            doc = change.get("fullDocument")
+            if doc is not None:
+                self.manager.apply_changes(upserts=[doc])
+            else:
+                # Документ успели удалить до updateLookup
+                self.manager.apply_changes(deleted_ids=[doc_id])
+        elif operation == "delete":
+            self.manager.apply_changes(deleted_ids=[doc_id])
+        elif operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            self.manager.reload()
+
+    def _poll_loop(self) -> None:
+        last_full_reload = time.time()
+        while not self._stop.wait(self.poll_interval):
+            if time.time() - last_full_reload >= self.full_reload_interval:
+                self.manager.reload()
+                last_full_reload = time.time()
+            else:
+                self.poll_once()
+
+    def poll_once(self) -> int:
+        """Загружает документы новее водяных знаков текущего снимка; возвращает их число."""
+        snapshot = self.manager.snapshot
+        conditions: List[Dict[str, Any]] = []
+        if snapshot.last_updated_at is not None:
+            conditions.append({"updated_at": {"$gt": snapshot.last_updated_at}})
+        if snapshot.last_id is not None:
+            conditions.append({"_id": {"$gt": snapshot.last_id}})
+        query = {"$or": conditions} if conditions else {}
+        changed = list(self.manager.collection.find(query))
+        if changed:
+            self.manager.apply_changes(upserts=changed)
+        return len(changed)
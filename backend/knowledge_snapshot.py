@@ -0,0 +1,186 @@
+import hashlib
+import re
+import time
+from typing import Any, Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+from knowledge_index import InvertedIndex
+
+UNAVAILABLE_MESSAGE = "База знаний недоступна. Обратитесь к администратору."
+EMPTY_MESSAGE = "База знаний пуста."
+
+# Целевой размер фрагмента базы знаний, символов
+PASSAGE_MAX_CHARS = 800
+
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s+")
+
+# Версия снимка — сумма дайджестов фрагментов по модулю 2^128: не зависит от порядка
+# и пересчитывается инкрементально, поэтому совпадает при полной и частичной загрузке
+VERSION_MODULUS = 1 << 128
+
+
+class Passage(NamedTuple):
+    """Фрагмент документа: единица ранжирования и сборки контекста."""
+    id: str
+    text: str
+    tokens: int
+    digest: str
+
+
+def passage_digest(passage_id: str, text: str) -> str:
+    return hashlib.md5(f"{passage_id}\0{text}".encode()).hexdigest()
+
+
+def estimate_tokens(text: str) -> int:
+    """Оценка числа токенов LLM (для кириллицы в среднем ~3 символа на токен)."""
+    return max(1, len(text) // 3)
+
+
+def extract_texts(doc: Mapping[str, Any]) -> Dict[str, str]:
+    """Непустые строковые поля документа (кроме _id) — они и составляют базу знаний."""
+    return {
+        field: value.strip()
+        for field, value in doc.items()
+        if field != "_id" and isinstance(value, str) and value.strip()
+    }
+
+
+def split_passages(text: str, max_chars: int = PASSAGE_MAX_CHARS) -> List[str]:
+    """Делит текст на фрагменты по абзацам, длинные абзацы — по предложениям."""
+    pieces: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+        else:
+            pieces.extend(s.strip() for s in SENTENCE_END_RE.split(paragraph) if s.strip())
+    # Соседние короткие куски склеиваются, чтобы фрагменты были сопоставимого размера
+    passages: List[str] = []
+    current = ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 1 > max_chars:
+            passages.append(current)
+            current = ""
+        current = f"{current}\n{piece}" if current else piece
+    if current:
+        passages.append(current)
+    return passages
+
+
+def document_passages(doc_id: Any, fields: Dict[str, str]) -> List[Passage]:
+    passages = []
+    for field, field_text in fields.items():
+        for n, text in enumerate(split_passages(field_text)):
+            passage_id = f"{doc_id}:{field}:{n}"
+            passages.append(Passage(passage_id, text, estimate_tokens(text), passage_digest(passage_id, text)))
+    return passages
+
+
+def _digest_sum(passages: Iterable[Passage]) -> int:
+    return sum(int(passage.digest, 16) for passage in passages)
+
+
+class KnowledgeSnapshot:
+    """Неизменяемый снимок базы знаний: тексты документов, фрагменты, конкатенация и индекс.
+
+    version однозначно определяется набором фрагментов и их текстом; вместе с
+    дайджестами фрагментов она вычисляется один раз при загрузке. Читатели
+    берут ссылку на текущий снимок без блокировок; обновления создают новый
+    снимок через with_changes() и подменяют ссылку целиком.
+    """
+
+    def __init__(
+        self,
+        docs: Dict[Any, Dict[str, str]],
+        doc_passages: Optional[Dict[Any, List[Passage]]] = None,
+        index: Optional[InvertedIndex] = None,
+        last_id: Any = None,
+        last_updated_at: Any = None,
+        fallback: str = EMPTY_MESSAGE,
+        version_sum: Optional[int] = None,
+        faq: Optional[Dict[str, str]] = None,
+    ):
+        self.docs = docs
+        # Заготовленные ответы из коллекции FAQ: вопрос или его вариант -> ответ
+        self.faq = faq if faq is not None else {}
+        if doc_passages is None:
+            doc_passages = {doc_id: document_passages(doc_id, fields) for doc_id, fields in docs.items()}
+        self.doc_passages = doc_passages
+        self.passages: Dict[str, Passage] = {
+            passage.id: passage for passages in doc_passages.values() for passage in passages
+        }
+        if index is None:
+            index = InvertedIndex({passage_id: passage.text for passage_id, passage in self.passages.items()})
+        self.index = index
+        if version_sum is None:
+            version_sum = _digest_sum(self.passages.values())
+        self._version_sum = version_sum % VERSION_MODULUS
+        self.version = f"{self._version_sum:032x}"
+        self.last_id = last_id
+        self.last_updated_at = last_updated_at
+        texts = [text for fields in docs.values() for text in fields.values()]
+        self.content = "\n\n".join(texts) if texts else fallback
+        self.loaded_at = time.time()
+
+    @classmethod
+    def unavailable(cls) -> "KnowledgeSnapshot":
+        return cls({}, fallback=UNAVAILABLE_MESSAGE)
+
+    @classmethod
+    def from_documents(
+        cls, raw_docs: Iterable[Mapping[str, Any]], faq: Optional[Dict[str, str]] = None
+    ) -> "KnowledgeSnapshot":
+        docs: Dict[Any, Dict[str, str]] = {}
+        last_id = last_updated_at = None
+        for doc in raw_docs:
+            docs[doc["_id"]] = extract_texts(doc)
+            last_id, last_updated_at = _advance(last_id, last_updated_at, doc)
+        return cls(docs, last_id=last_id, last_updated_at=last_updated_at, faq=faq)
+
+    def with_changes(
+        self, upserts: Iterable[Mapping[str, Any]] = (), deleted_ids: Iterable[Any] = ()
+    ) -> "KnowledgeSnapshot":
+        """Новый снимок с применёнными изменениями; перестраивается только затронутая часть индекса."""
+        docs = dict(self.docs)
+        doc_passages = dict(self.doc_passages)
+        last_id, last_updated_at = self.last_id, self.last_updated_at
+        version_sum = self._version_sum
+        removed: List[str] = []
+        added: Dict[str, str] = {}
+        for doc_id in deleted_ids:
+            docs.pop(doc_id, None)
+            old_passages = doc_passages.pop(doc_id, ())
+            removed.extend(passage.id for passage in old_passages)
+            version_sum -= _digest_sum(old_passages)
+        for doc in upserts:
+            doc_id = doc["_id"]
+            old_passages = doc_passages.get(doc_id, ())
+            removed.extend(passage.id for passage in old_passages)
+            version_sum -= _digest_sum(old_passages)
+            docs[doc_id] = extract_texts(doc)
+            doc_passages[doc_id] = document_passages(doc_id, docs[doc_id])
+            added.update((passage.id, passage.text) for passage in doc_passages[doc_id])
+            version_sum += _digest_sum(doc_passages[doc_id])
+            last_id, last_updated_at = _advance(last_id, last_updated_at, doc)
+        index = self.index.updated(added, removed)
+        return KnowledgeSnapshot(
+            docs, doc_passages, index, last_id, last_updated_at, version_sum=version_sum, faq=self.faq
+        )
+
+
+def _advance(last_id: Any, last_updated_at: Any, doc: Mapping[str, Any]) -> Tuple[Any, Any]:
+    """Сдвигает водяные знаки (_id и updated_at) для инкрементального опроса."""
+    doc_id = doc.get("_id")
+    updated_at = doc.get("updated_at")
+    try:
+        if doc_id is not None and (last_id is None or doc_id > last_id):
+            last_id = doc_id
+    except TypeError:
+        pass
+    try:
+        if updated_at is not None and (last_updated_at is None or updated_at > last_updated_at):
+            last_updated_at = updated_at
+    except TypeError:
+        pass
+    return last_id, last_updated_at
@@ -0,0 +1,372 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger("tougpt")
+
+
+class LLMUnavailableError(Exception):
+    """Ни один ключ/модель пула не смог ответить (лимиты, открытые предохранители, ошибки)."""
+
+
+class TokenBucket:
+    """Ограничитель частоты запросов: rate токенов в секунду, не больше capacity подряд."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            self._refill()
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+    def wait_time(self) -> float:
+        """Через сколько секунд появится токен."""
+        with self._lock:
+            self._refill()
+            return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def drain(self) -> None:
+        """Сервер ответил 429: считаем, что лимит исчерпан до следующего пополнения."""
+        with self._lock:
+            self._tokens = 0.0
+            self._updated = time.monotonic()
+
+
+class CircuitBreaker:
+    """Предохранитель: после failure_threshold ошибок подряд слот выключается на reset_timeout,
+    затем пропускает один пробный запрос (half-open).
+
+    Пробный запрос завершается record_success(), record_failure() или — если
+    он отменён либо упал по вине самого запроса — release_trial(): тогда
+    исход неизвестен, и пробным станет следующий запрос.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def available(self) -> bool:
+        """Можно ли сейчас отправить запрос (без захвата пробного запроса)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                return time.monotonic() - self._opened_at >= self.reset_timeout
+            return not self._trial_in_flight
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release_trial(self) -> None:
+        """Освобождает пробный запрос, не считая его ни успехом, ни ошибкой."""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self._trial_in_flight = False
+
+
+# Исключения google.api_core и HTTP-клиентов по имени класса — если кода в полях нет
+ERROR_TYPE_STATUS = {
+    "TooManyRequests": 429,
+    "ResourceExhausted": 429,
+    "Unauthorized": 401,
+    "Unauthenticated": 401,
+    "Forbidden": 403,
+    "PermissionDenied": 403,
+    "InternalServerError": 500,
+    "BadGateway": 502,
+    "ServiceUnavailable": 503,
+    "GatewayTimeout": 504,
+    "DeadlineExceeded": 504,
+}
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """HTTP-код ошибки клиента LLM по полям и типу исключения (и его причины), если он есть.
+
+    Текст сообщения не разбирается: «5000 токенов» — не ошибка 500.
+    """
+    seen: Set[int] = set()
+    current: Optional[BaseException] = error
+    while current is not None and id(current) not in seen:
+        seen.add(id(current))
+        for value in (getattr(current, "code", None), getattr(current, "status_code", None), getattr(getattr(current, "response", None), "status_code", None)):
+            if isinstance(value, int) and not isinstance(value, bool):
+                return value
+        for cls in type(current).__mro__:
+            if cls.__name__ in ERROR_TYPE_STATUS:
+                return ERROR_TYPE_STATUS[cls.__name__]
+        # Обёртки клиентов хранят исходное исключение в __cause__
+        current = current.__cause__ or current.__context__
+    return None
+
+
+def is_failover_error(error: BaseException) -> bool:
+    """Ошибки слота (лимиты, сбои сервера, таймауты, ключ): имеет смысл повторить на другом слоте."""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    status = error_status(error)
+    return status is not None and (status in (401, 403, 429) or status >= 500)
+
+
+class LLMSlot:
+    """Клиент LLM для пары (ключ, модель) со своим лимитом, предохранителем и статистикой."""
+
+    def __init__(self, api_key: str, model: str, client: Any, rate_per_minute: float, failure_threshold: int, reset_timeout: float):
+        self.api_key = api_key
+        self.model = model
+        self.client = client
+        self.bucket = TokenBucket(rate_per_minute / 60.0, max(1.0, rate_per_minute / 6.0))
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "key": f"...{self.api_key[-4:]}",
+            "model": self.model,
+            "state": self.breaker.state,
+            "in_flight": self.in_flight,
+            "successes": self.successes,
+            "failures": self.failures,
+        }
+
+
+class LLMPool:
+    """Планировщик вызовов LLM по пулу ключей и моделей.
+
+    Выбирает наименее загруженный слот основной модели, у которого есть токен
+    лимита и закрыт предохранитель; при 429/5xx/таймауте повторяет запрос на
+    другом слоте, а затем на резервной модели. Клиенты для ключей пользователей
+    (x-api-key) создаются по требованию и хранятся в ограниченном LRU.
+    """
+
+    def __init__(
+        self,
+        api_keys: Sequence[str],
+        models: Sequence[str],
+        client_factory: Callable[[str, str], Any],
+        rate_per_minute: float = 60,
+        max_attempts: int = 3,
+        attempt_timeout: float = 60,
+        max_queue_wait: float = 5,
+        failure_threshold: int = 3,
+        reset_timeout: float = 30,
+        user_clients: int = 64,
+    ):
+        self.models = list(models)
+        self.client_factory = client_factory
+        self.rate_per_minute = rate_per_minute
+        self.max_attempts = max_attempts
+        self.attempt_timeout = attempt_timeout
+        self.max_queue_wait = max_queue_wait
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.user_clients = user_clients
+        self._api_keys = list(dict.fromkeys(api_keys))
+        self._slots: Optional[List[LLMSlot]] = None
+        self._user_slots: "OrderedDict[str, List[LLMSlot]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def has_keys(self) -> bool:
+        return bool(self._api_keys)
+
+    def _make_slots(self, api_key: str) -> List[LLMSlot]:
+        return [
+            LLMSlot(api_key, model, self.client_factory(api_key, model), self.rate_per_minute, self.failure_threshold, self.reset_timeout)
+            for model in self.models
+        ]
+
+    def slots_for(self, api_key: Optional[str] = None) -> List[LLMSlot]:
+        """Слоты общего пула или (для чужого ключа) слоты пользователя из LRU."""
+        with self._lock:
+            if api_key is None or api_key in self._api_keys:
+                if self._slots is None:
+                    # Клиенты создаются лениво, при первом запросе
+                    self._slots = [slot for key in self._api_keys for slot in self._make_slots(key)]
+                return self._slots
+            slots = self._user_slots.get(api_key)
+            if slots is None:
+                slots = self._user_slots[api_key] = self._make_slots(api_key)
+                while len(self._user_slots) > self.user_clients:
+                    self._user_slots.popitem(last=False)
+            else:
+                self._user_slots.move_to_end(api_key)
+            return slots
+
+    def _pick(self, slots: List[LLMSlot], tried: Set[int]) -> Optional[Tuple[LLMSlot, bool]]:
+        """Свободный слот и признак того, что запрос на нём — пробный (half-open)."""
+        # Модели идут по приоритету: резервная используется, только если основная недоступна
+        for model in self.models:
+            candidates = [slot for slot in slots if slot.model == model and id(slot) not in tried]
+            for slot in sorted(candidates, key=lambda s: s.in_flight):
+                if slot.breaker.available() and slot.bucket.try_acquire() and slot.breaker.allow():
+                    return slot, slot.breaker.state == CircuitBreaker.HALF_OPEN
+        return None
+
+    async def _acquire(self, slots: List[LLMSlot], tried: Set[int], deadline: float) -> Tuple[LLMSlot, bool]:
+        while True:
+            picked = self._pick(slots, tried)
+            if picked is not None:
+                return picked
+            waits = [s.bucket.wait_time() for s in slots if id(s) not in tried and s.breaker.available()]
+            if not waits or time.monotonic() + min(waits) > deadline:
+                raise LLMUnavailableError("Все ключи и модели LLM заняты или недоступны")
+            await asyncio.sleep(min(waits))
+
+    def _record_failure(self, slot: LLMSlot, error: BaseException) -> bool:
+        """Учёт ошибки слота; True, если стоит повторить на другом слоте.
+
+        Предохранитель считает только ошибки самого слота (лимиты, сбои,
+        таймауты, ключ): неверный запрос не должен закрывать слот для всех.
+        """
+        slot.failures += 1
+        failover = is_failover_error(error)
+        if failover:
+            slot.breaker.record_failure()
+            if error_status(error) == 429:
+                slot.bucket.drain()
+        logger.warning(f"LLM {slot.model} (ключ ...{slot.api_key[-4:]}) ошибка: {error}")
+        return failover
+
+    async def ainvoke(self, prompt: Any, api_key: Optional[str] = None) -> Any:
+        slots = self.slots_for(api_key)
+        tried: Set[int] = set()
+        deadline = time.monotonic() + self.max_queue_wait
+        last_error: Optional[BaseException] = None
+        for _ in range(self.max_attempts):
+            try:
+                slot, trial = await self._acquire(slots, tried, deadline)
+            except LLMUnavailableError:
+                break
+            tried.add(id(slot))
+            slot.in_flight += 1
+            try:
+                result = await asyncio.wait_for(slot.client.ainvoke(prompt), timeout=self.attempt_timeout)
+            except Exception as e:
+                if not self._record_failure(slot, e):
+                    raise
+                last_error = e
+                continue
+            else:
+                slot.successes += 1
+                slot.breaker.record_success()
+                return result
+            finally:
+                slot.in_flight -= 1
+                # Отмена или ошибка самого запроса не должны навсегда занять пробный запрос слота
+                if trial:
+                    slot.breaker.release_trial()
+        raise LLMUnavailableError(f"LLM недоступна: {last_error}") from last_error
+
+    async def astream(self, prompt: Any, api_key: Optional[str] = None) -> AsyncIterator[Any]:
+        """Потоковый ответ; переключение на другой слот возможно только до первого фрагмента."""
+        slots = self.slots_for(api_key)
+        tried: Set[int] = set()
+        deadline = time.monotonic() + self.max_queue_wait
+        last_error: Optional[BaseException] = None
+        for _ in range(self.max_attempts):
+            try:
+                slot, trial = await self._acquire(slots, tried, deadline)
+            except LLMUnavailableError:
+                break
+            tried.add(id(slot))
+            slot.in_flight += 1
+            started = False
+            try:
+                stream = slot.client.astream(prompt).__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(stream.__anext__(), timeout=self.attempt_timeout)
+                    except StopAsyncIteration:
+                        break
+                    started = True
+                    yield chunk
+            except Exception as e:
+                if not self._record_failure(slot, e) or started:
+                    raise
+                last_error = e
+                continue
+            else:
+                slot.successes += 1
+                slot.breaker.record_success()
+                return
+            finally:
+                slot.in_flight -= 1
+                # В том числе когда клиент закрыл поток, не дочитав ответ
+                if trial:
+                    slot.breaker.release_trial()
+        raise LLMUnavailableError(f"LLM недоступна: {last_error}") from last_error
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            slots = list(self._slots or [])
+            user_clients = len(self._user_slots)
+        return {"slots": [slot.stats() for slot in slots], "user_clients": user_clients}
+
+
+class PooledLLM:
+    """Обёртка с интерфейсом клиента LLM (ainvoke/astream/invoke) поверх пула."""
+
+    def __init__(self, pool: LLMPool, api_key: Optional[str] = None):
+        self.pool = pool
+        self.api_key = api_key
+
+    async def ainvoke(self, prompt: Any) -> Any:
+        return await self.pool.ainvoke(prompt, self.api_key)
+
+    def astream(self, prompt: Any) -> AsyncIterator[Any]:
+        return self.pool.astream(prompt, self.api_key)
+
+    def invoke(self, prompt: Any) -> Any:
+        """Синхронный вызов для скриптов (вне работающего event loop)."""
+        return asyncio.run(self.ainvoke(prompt))
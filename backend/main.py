@@ -5,14 +5,14 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import asyncio
-from fastapi import FastAPI, HTTPException, Header
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from pydantic import BaseModel
-from langchain_google_genai import ChatGoogleGenerativeAI
-from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 import threading
-from typing import Optional, Dict, Tuple, Any
+from typing import Optional, Dict, List, NamedTuple, Sequence, Tuple, Any, AsyncIterator, Callable
 import hashlib
 import time
 from concurrent.futures import ThreadPoolExecutor
@@ -20,7 +20,23 @@ import logging
 import re
 from pymongo import MongoClient
 import json
-from script_ai_demo import PROMPT
+from script_ai_demo import PROMPT, BATCH_PROMPT
+from knowledge_refresher import KnowledgeRefresher, cluster_time
+from knowledge_snapshot import KnowledgeSnapshot, estimate_tokens
+from snapshot_store import SnapshotStore
+from context_builder import Context, ContextBuilder, knowledge_version
+from semantic_cache import SemanticCache
+from single_flight import SingleFlight
+from response_cache import create_response_cache
+from query_matcher import Classification, QueryMatcher
+from admission import AdmissionRejected, FairScheduler
+from metrics import TOKEN_BUCKETS, Counter, Gauge, Histogram, Registry
+from query_log import QueryLog
+from prewarm import PrewarmJob
+from sessions import SessionHistory, SessionStore, is_follow_up
+from llm_pool import LLMPool, LLMUnavailableError, PooledLLM
+from gemini_client import GeminiClient
+from batch_answers import BatchItem, format_questions, group_context, group_items, split_batch_answer
 
 # Настройка логирования
 logging.basicConfig(
@@ -33,8 +49,51 @@ logger = logging.getLogger("tougpt")
 # Получение порта для запуска (используется на Render)
 PORT = int(os.environ.get("PORT", 8000))
 
-# Пул потоков для ускорения AI-запросов
-executor = ThreadPoolExecutor(max_workers=16)
+# Пул потоков для поиска по базе знаний вне event loop (LLM вызывается асинхронно)
+executor = ThreadPoolExecutor(max_workers=int(os.getenv("RETRIEVAL_WORKERS", 16)))
+
+# Таймаут ответа LLM, секунды
+LLM_TIMEOUT = 60
+
+# Служебные ответы (ошибки, таймауты): не кешируются и не попадают в историю сессии
+TIMEOUT_ANSWER = "Извините, ответ занял слишком много времени. Попробуйте ещё раз позже."
+ERROR_ANSWER = "Произошла ошибка при обработке запроса. Повторите попытку позже."
+EMPTY_KNOWLEDGE_ANSWER = "База знаний пуста или недоступна. Обратитесь к администратору."
+NO_ANSWER = "Извините, я не смог сформировать ответ на основе имеющейся информации."
+OVERLOADED_ANSWER = "Сервер перегружен запросами. Повторите попытку чуть позже."
+SERVICE_ANSWERS = frozenset({TIMEOUT_ANSWER, ERROR_ANSWER, EMPTY_KNOWLEDGE_ANSWER, NO_ANSWER, OVERLOADED_ANSWER})
+
+# Метрики по этапам обработки запроса (Prometheus, /api/metrics)
+metrics_registry = Registry()
+STAGE_SECONDS = metrics_registry.register(Histogram(
+    "tougpt_stage_seconds", "Длительность этапов обработки запроса", ["stage"]))
+REQUEST_SECONDS = metrics_registry.register(Histogram(
+    "tougpt_request_seconds", "Полное время ответа", ["endpoint", "mode"]))
+REQUESTS = metrics_registry.register(Counter(
+    "tougpt_requests_total", "Ответы по эндпоинту, режиму и попаданию в кеш", ["endpoint", "mode", "cached"]))
+CACHE_LOOKUPS = metrics_registry.register(Counter(
+    "tougpt_cache_lookups_total", "Поиски в кеше ответов: exact, semantic или miss", ["result"]))
+LLM_CALLS = metrics_registry.register(Counter(
+    "tougpt_llm_calls_total", "Вызовы LLM по результату", ["outcome"]))
+PROMPT_TOKENS = metrics_registry.register(Histogram(
+    "tougpt_prompt_tokens", "Оценка размера промпта в токенах", ["kind"], buckets=TOKEN_BUCKETS))
+CONTEXT_TOKENS = metrics_registry.register(Histogram(
+    "tougpt_context_tokens", "Размер контекста из базы знаний в токенах", buckets=TOKEN_BUCKETS))
+
+def record_request(endpoint: str, mode: str, cached: bool, start_time: float) -> float:
+    """Учёт ответа в метриках; возвращает время обработки в секундах."""
+    elapsed = time.perf_counter() - start_time
+    REQUEST_SECONDS.observe(endpoint, mode, value=elapsed)
+    REQUESTS.inc(endpoint, mode, "true" if cached else "false")
+    return round(elapsed, 3)
+
+async def run_in_executor(func: Callable, *args: Any) -> Any:
+    """Выполнение в пуле потоков с учётом времени ожидания в его очереди."""
+    submitted = time.perf_counter()
+    def timed() -> Any:
+        STAGE_SECONDS.observe("executor_wait", value=time.perf_counter() - submitted)
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, timed)
 
 # Предобработка пользовательского запроса для повышения релевантности
 def preprocess_query(query: str) -> str:
@@ -48,274 +107,592 @@ def preprocess_query(query: str) -> str:
     return query.strip()
 
 class MongoDBKnowledgeManager:
-    """Работа с базой знаний в MongoDB (NoSQL)."""
+    """Работа с базой знаний в MongoDB (NoSQL).
+
+    Конструктор ничего не загружает: start() поднимает последний сохранённый
+    снимок с диска и в фоне подключается к MongoDB и перезагружает базу.
+    Пока MongoDB недоступна, подключение и загрузка повторяются с
+    экспоненциальной задержкой; ready выставляется, только когда есть
+    настоящий снимок — с диска или из MongoDB.
+    """
     def __init__(self):
         self.mongo_uri = os.getenv("MONGODB_URI")
         self.mongo_db = os.getenv("MONGODB_DB", "toudb")
         # По умолчанию коллекция storage, если нет - tou
         self.mongo_collection = os.getenv("MONGODB_COLLECTION", "storage")
-        self._content_cache = ""
-        self._cache_timestamp = 0
-        self._cache_ttl = 3600  # 1 час кэширования
+        self._snapshot = KnowledgeSnapshot.unavailable()
+        self.context_builder = ContextBuilder(token_budget=int(os.getenv("KNOWLEDGE_TOKEN_BUDGET", 3000)))
+        self._cache_ttl = 3600  # полная перезагрузка раз в час (в фоне)
+        # Блокировка только для писателей: читатели берут текущий снимок без ожидания
         self._lock = threading.Lock()
+        self._listeners: List[Callable[[KnowledgeSnapshot], None]] = []
+        self.client = None
+        self.db = None
+        self.collection = None
+        self.faq_collection = None
+        self.refresher = None
+        # Снимок на диске для быстрого холодного старта
+        snapshot_path = os.getenv("KNOWLEDGE_SNAPSHOT_PATH", ".cache/knowledge_snapshot.pkl")
+        self.store = SnapshotStore(snapshot_path) if snapshot_path else None
+        self._persist_interval = float(os.getenv("KNOWLEDGE_SNAPSHOT_INTERVAL", 60))
+        self._persisted_at = 0.0
+        self.source = "none"
+        self.ready = threading.Event()
+        self._warmup_thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._retry_delay = float(os.getenv("KNOWLEDGE_RETRY_DELAY", 1))
+        self._retry_max_delay = float(os.getenv("KNOWLEDGE_RETRY_MAX_DELAY", 60))
+
+    def start(self) -> None:
+        """Быстрый старт со снимка на диске и фоновый прогрев из MongoDB."""
+        snapshot = self.store.load() if self.store else None
+        if snapshot is not None:
+            with self._lock:
+                self._set_snapshot(snapshot)
+            self.source = "disk"
+            self.ready.set()
+            logger.info(f"База знаний загружена с диска, документов: {len(snapshot.docs)}")
+        self._warmup_thread = threading.Thread(target=self._warm_up, name="knowledge-warmup", daemon=True)
+        self._warmup_thread.start()
+
+    def wait_until_loaded(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание окончания прогрева из MongoDB (для скриптов вне приложения).
+
+        Пока MongoDB недоступна, прогрев повторяется: без timeout ожидание может не закончиться.
+        """
+        if self._warmup_thread is not None:
+            self._warmup_thread.join(timeout)
+        return self.ready.is_set()
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self._warmup_thread is not None:
+            self._warmup_thread.join(timeout=2)
+        if self.refresher is not None:
+            self.refresher.stop(timeout=2)
+        if self.client is not None:
+            self.client.close()
+
+    def _warm_up(self) -> None:
         if not self.mongo_uri:
             logger.warning("MONGODB_URI не задан. База знаний будет пуста.")
-        self.client = MongoClient(self.mongo_uri) if self.mongo_uri else None
-        self.db = self.client[self.mongo_db] if self.client else None
+            if not self._snapshot.docs:
+                self._set_snapshot(KnowledgeSnapshot.unavailable())
+            # Ждать нечего: база знаний не настроена
+            self.ready.set()
+            return
+        delay = self._retry_delay
+        while not self._stopping.is_set():
+            try:
+                self._connect()
+                # Время кластера до загрузки: с него change stream подхватит правки, сделанные во время загрузки
+                start_at = cluster_time(self.collection)
+                # Предзагрузка базы знаний ("обучение")
+                if self._preload_knowledge():
+                    break
+            except Exception as e:
+                logger.error(f"Ошибка подключения к MongoDB: {e}")
+            self._disconnect()
+            logger.info(f"Повторное подключение к MongoDB через {delay:g}с")
+            if self._stopping.wait(delay):
+                return
+            delay = min(delay * 2, self._retry_max_delay)
+        if not self._stopping.is_set():
+            self.refresher = KnowledgeRefresher(
+                self,
+                poll_interval=float(os.getenv("KNOWLEDGE_POLL_INTERVAL", 30)),
+                full_reload_interval=self._cache_ttl,
+                start_at_operation_time=start_at,
+            )
+            self.refresher.start()
+
+    def _connect(self) -> None:
+        self.client = MongoClient(self.mongo_uri)
+        self.db = self.client[self.mongo_db]
+        collection_names = self.db.list_collection_names()
         # Попытка выбрать storage, если нет - tou
-        if self.db is not None:
-            if "storage" in self.db.list_collection_names():
-                self.collection = self.db["storage"]
-                logger.info("Используется коллекция 'storage' для базы знаний.")
-            elif "tou" in self.db.list_collection_names():
-                self.collection = self.db["tou"]
-                logger.info("Используется коллекция 'tou' для базы знаний.")
-            else:
-                self.collection = None
-                logger.error("В базе нет коллекций 'storage' или 'tou'.")
+        if "storage" in collection_names:
+            self.collection = self.db["storage"]
+            logger.info("Используется коллекция 'storage' для базы знаний.")
+        elif "tou" in collection_names:
+            self.collection = self.db["tou"]
+            logger.info("Используется коллекция 'tou' для базы знаний.")
         else:
-            self.collection = None
-        # Предзагрузка базы знаний ("обучение")
-        self._preload_knowledge()
+            raise RuntimeError("В базе нет коллекций 'storage' или 'tou'")
+        # Необязательная коллекция заготовленных ответов: {question, answer, aliases}
+        faq_name = os.getenv("MONGODB_FAQ_COLLECTION", "faq")
+        if faq_name in collection_names:
+            self.faq_collection = self.db[faq_name]
+            logger.info(f"Используется коллекция '{faq_name}' для заготовленных ответов.")
+
+    def _disconnect(self) -> None:
+        if self.client is not None:
+            self.client.close()
+        self.client = self.db = self.collection = self.faq_collection = None
+
+    @property
+    def snapshot(self) -> KnowledgeSnapshot:
+        """Текущий неизменяемый снимок базы знаний."""
+        return self._snapshot
 
-    def _preload_knowledge(self):
-        """Загружает всю коллекцию в кэш при старте (эмулирует обучение)."""
+    def add_listener(self, callback: Callable[[KnowledgeSnapshot], None]) -> None:
+        """Подписка на смену снимка (вызывается из потока, который его подменил)."""
+        self._listeners.append(callback)
+
+    def _set_snapshot(self, snapshot: KnowledgeSnapshot) -> None:
+        self._snapshot = snapshot
+        for callback in self._listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                logger.error(f"Ошибка обработчика обновления базы знаний: {e}")
+
+    def _load_faq(self) -> Dict[str, str]:
+        """Заготовленные ответы из коллекции FAQ: вопрос и его варианты -> ответ."""
+        if self.faq_collection is None:
+            return {}
+        faq = {}
+        for doc in self.faq_collection.find({}, {"_id": 0}):
+            answer = doc.get("answer")
+            if not isinstance(answer, str) or not answer.strip():
+                continue
+            for question in [doc.get("question"), *doc.get("aliases", [])]:
+                if isinstance(question, str) and question.strip():
+                    faq[question] = answer.strip()
+        return faq
+
+    def _persist(self, snapshot: KnowledgeSnapshot, force: bool = False) -> None:
+        """Сохраняет снимок на диск (инкрементальные обновления — не чаще раза в интервал)."""
+        if self.store is None or not snapshot.docs:
+            return
+        now = time.time()
+        if not force and now - self._persisted_at < self._persist_interval:
+            return
+        self._persisted_at = now
+        self.store.save(snapshot)
+
+    def _preload_knowledge(self) -> bool:
+        """Загружает всю коллекцию в новый снимок и атомарно подменяет текущий; False — не удалось."""
         with self._lock:
             if self.collection is None:
-                self._content_cache = "База знаний недоступна. Обратитесь к администратору."
-                return
+                # Снимок с диска лучше, чем никакой
+                if not self._snapshot.docs:
+                    self._set_snapshot(KnowledgeSnapshot.unavailable())
+                return False
             try:
-                docs = list(self.collection.find({}, {"_id": 0}))
-                texts = []
-                for doc in docs:
-                    for v in doc.values():
-                        if isinstance(v, str) and v.strip():
-                            texts.append(v.strip())
-                content = "\n\n".join(texts) if texts else "База знаний пуста."
-                self._content_cache = content
-                self._cache_timestamp = time.time()
-                logger.info(f"База знаний загружена в кэш, размер: {len(content)} символов")
+                snapshot = KnowledgeSnapshot.from_documents(self.collection.find({}), self._load_faq())
+                self._set_snapshot(snapshot)
+                self.source = "mongodb"
+                self.ready.set()
+                self._persist(snapshot, force=True)
+                logger.info(f"База знаний загружена в кэш, размер: {len(snapshot.content)} символов, секций в индексе: {len(snapshot.index)}")
+                return True
             except Exception as e:
+                # Если снимок уже был загружен — продолжаем отдавать его
                 logger.error(f"Ошибка при загрузке базы знаний: {e}")
-                self._content_cache = "База знаний недоступна. Обратитесь к администратору."
+                if not self._snapshot.docs:
+                    self._set_snapshot(KnowledgeSnapshot.unavailable())
+                return False
+
+    def reload(self) -> None:
+        """Полная перезагрузка снимка (вызывается фоновым обновлением)."""
+        self._preload_knowledge()
+
+    def apply_changes(self, upserts=(), deleted_ids=()) -> None:
+        """Применяет изменённые/удалённые документы к новому снимку и подменяет текущий."""
+        with self._lock:
+            self._set_snapshot(self._snapshot.with_changes(upserts, deleted_ids))
+            self._persist(self._snapshot)
+            logger.info(f"База знаний обновлена инкрементально, документов: {len(self._snapshot.docs)}")
 
     def get_knowledge_content(self) -> str:
         """Получить все тексты из коллекции (конкатенация)."""
-        with self._lock:
-            current_time = time.time()
-            if self._content_cache and current_time - self._cache_timestamp < self._cache_ttl:
-                return self._content_cache
-            # Если кэш устарел, перезагружаем
-            self._preload_knowledge()
-            return self._content_cache
+        return self._snapshot.content
+
+    def build_context(self, query: str, pinned_ids: Sequence[str] = ()) -> Context:
+        """Лучшие по BM25 фрагменты в пределах бюджета токенов, список фрагментов и ключ контекста."""
+        return self.context_builder.build(self._snapshot, query, pinned_ids)
 
     def get_relevant_sections(self, query: str) -> str:
-        """Ищет документы, где хотя бы одно ключевое слово встречается в любом строковом поле."""
-        if self.collection is None:
-            return "База знаний недоступна. Обратитесь к администратору."
-        keywords = set(re.findall(r'\b\w+\b', query.lower()))
-        try:
-            docs = list(self.collection.find({}, {"_id": 0}))
-            relevant = []
-            for doc in docs:
-                for v in doc.values():
-                    if isinstance(v, str):
-                        text = v.lower()
-                        if any(kw for kw in keywords if len(kw) > 3 and kw in text):
-                            relevant.append(v.strip())
-                            break
-            return "\n\n".join(relevant) if relevant else self.get_knowledge_content()
-        except Exception as e:
-            logger.error(f"Ошибка поиска по MongoDB: {e}")
-            return self.get_knowledge_content()
+        """Релевантный контекст из индекса в памяти (без обращения к MongoDB)."""
+        return self.build_context(query).text
 
 knowledge_manager = MongoDBKnowledgeManager()
 
 # Промпт для LLM с инструкциями
 
 
+# Параметры клиентов по моделям; первая модель — основная, остальные — резервные
+LLM_MODEL_PARAMS = {
+    "gemini-1.5-flash": {"temperature": 0.1, "top_p": 0.95, "top_k": 40},
+    "gemini-1.5-pro": {"temperature": 0.2},
+}
+
+def env_list(name: str, default: str = "") -> List[str]:
+    return [item.strip() for item in os.getenv(name, default).split(",") if item.strip()]
+
 class OptimizedLLMManager:
-    """Менеджер для работы с LLM (Google Gemini), с кешированием по ключу."""
-    def __init__(self):
-        self.default_api_key = os.getenv("GOOGLE_API_KEY")
-        self._llm_cache = {}
-        self._lock = threading.Lock()
-        if self.default_api_key:
-            self._create_llm(self.default_api_key)
-    def _create_llm(self, api_key: str) -> Any:
-        try:
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-1.5-flash",
-                temperature=0.1,
-                max_tokens=1000,
-                google_api_key=api_key,
-                request_timeout=60,
-                top_p=0.95,
-                top_k=40,
-            )
-            return llm
-        except Exception as e:
-            logger.warning(f"Не удалось создать экземпляр gemini-1.5-flash: {e}, пробую резервную модель")
-            llm = ChatGoogleGenerativeAI(
-                model="gemini-1.5-pro",
-                temperature=0.2,
-                max_tokens=1000,
-                google_api_key=api_key,
-                request_timeout=45,
-            )
-            return llm
+    """Менеджер для работы с LLM (Google Gemini) через пул ключей и моделей.
+
+    Ключи — GOOGLE_API_KEYS (через запятую) и GOOGLE_API_KEY; модели — LLM_MODELS
+    в порядке приоритета. Лимиты, предохранители и переключение на резервную
+    модель при 429/5xx/таймаутах — в LLMPool. client_factory можно подменить
+    (например, фейковым клиентом для тестов и нагрузочных прогонов).
+    """
+    def __init__(self, client_factory: Optional[Callable[[str, str], Any]] = None):
+        api_keys = env_list("GOOGLE_API_KEYS") + env_list("GOOGLE_API_KEY")
+        self.default_api_key = api_keys[0] if api_keys else None
+        self.pool = LLMPool(
+            api_keys,
+            env_list("LLM_MODELS", "gemini-1.5-flash,gemini-1.5-pro"),
+            client_factory or self._create_llm,
+            rate_per_minute=float(os.getenv("LLM_RATE_LIMIT_RPM", 60)),
+            max_attempts=int(os.getenv("LLM_MAX_ATTEMPTS", 3)),
+            attempt_timeout=float(os.getenv("LLM_ATTEMPT_TIMEOUT", 30)),
+            user_clients=int(os.getenv("LLM_USER_CLIENTS", 64)),
+        )
+    def _create_llm(self, api_key: str, model: str) -> Any:
+        # Без повторов внутри клиента: 429/503 сразу уходят в пул и переключают слот
+        return GeminiClient(api_key, model, max_output_tokens=1000, **LLM_MODEL_PARAMS.get(model, {}))
     def get_llm(self, api_key: Optional[str] = None) -> Any:
-        key = api_key or self.default_api_key
-        if not key:
+        """Клиент LLM (ainvoke/astream): вызовы распределяются по пулу (или по ключу пользователя)."""
+        if not api_key and not self.pool.has_keys:
             raise ValueError("API ключ не предоставлен")
-        with self._lock:
-            if key not in self._llm_cache:
-                self._llm_cache[key] = self._create_llm(key)
-            return self._llm_cache[key]
+        return PooledLLM(self.pool, api_key or None)
 
 llm_manager = OptimizedLLMManager()
 
-# 2. Заглушка для базы знаний
-document_content = """
-Документы принимаются с 20 июня по 25 августа.
-Стоимость обучения — 497 000 тенге в год.
-Общежитие находится по адресу: Павлодар, ул. Ломова, 64/1.
-"""
-
-# 3. Ввод пользователя
-user_query = """
-Когда начнётся приём документов?
-Какова стоимость обучения в университете?
-Где находится общежитие?
-"""
-
-# 4. Генерация промпта
-final_prompt = PROMPT.format(
-    document_content=document_content,
-    user_query=user_query
+# Допуск к вызовам LLM: ограничение параллельности и честная очередь по клиентам.
+# Заготовки и попадания в кеш отвечают до планировщика и в очереди не ждут
+ADMISSION_MAX_QUEUE_PER_CLIENT = int(os.getenv("ADMISSION_MAX_QUEUE_PER_CLIENT", 10))
+llm_scheduler = FairScheduler(
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 8)),
+    max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 100)),
+    max_queue_per_client=ADMISSION_MAX_QUEUE_PER_CLIENT,
+    max_wait=float(os.getenv("ADMISSION_MAX_WAIT", 10)),
 )
 
-print(final_prompt)
+def client_identity(request: Request, api_key: Optional[str]) -> str:
+    """Ключ честной очереди: хеш API-ключа клиента или его IP."""
+    if api_key:
+        return "key:" + hashlib.md5(api_key.encode()).hexdigest()[:12]
+    # За прокси Render адрес клиента — последний в X-Forwarded-For (его добавляет сам прокси)
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return "ip:" + forwarded.split(",")[-1].strip()
+    return "ip:" + (request.client.host if request.client else "unknown")
 
-# 5. Отправка в модель
-if __name__ == "__main__":
-    api_key = os.getenv("GOOGLE_API_KEY")
-    if not api_key:
-        print("Нет API-ключа, пропускаем ручной запуск")
-    else:
-        document_content = """
-        Документы принимаются с 20 июня по 25 августа.
-        Стоимость обучения — 497 000 тенге в год.
-        Общежитие находится по адресу: Павлодар, ул. Ломова, 64/1.
-        """
-        user_query = """
-        Когда начнётся приём документов?
-        Какова стоимость обучения в университете?
-        Где находится общежитие?
-        """
-        final_prompt = PROMPT.format(
-            document_content=document_content,
-            user_query=user_query
-        )
-        model = llm_manager.get_llm(api_key)
-        response = model.invoke(final_prompt)
-        print(response.content.strip() if hasattr(response, "content") else str(response).strip())
+def overloaded_response(e: AdmissionRejected) -> JSONResponse:
+    logger.warning(f"Запрос отклонён планировщиком: {e} (Retry-After {e.retry_after}с)")
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(e.retry_after)},
+        content={
+            "answer": OVERLOADED_ANSWER,
+            "retry_after": e.retry_after,
+            "error": True
+        }
+    )
+
+# Журнал частых вопросов для прогрева кеша после перезапуска и обновления базы знаний
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", ".cache/query_log.tsv")
+query_log = QueryLog(QUERY_LOG_PATH) if QUERY_LOG_PATH else None
+# Прогретые ответы живут дольше: ключ кеша включает версию снимка и устаревает вместе с ним
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", 200))
+PREWARM_TTL = float(os.getenv("PREWARM_TTL", 24 * 3600))
+PREWARM_CLIENT_ID = "prewarm"
+
+# Сессии: история разговора для уточняющих вопросов, сжатая до SESSION_HISTORY_TOKENS.
+# Хранятся в памяти процесса — при нескольких воркерах запросы сессии должны
+# попадать в один и тот же (sticky-сессии по session_id)
+session_store = SessionStore(
+    max_sessions=int(os.getenv("SESSION_MAX", 5000)),
+    idle_ttl=float(os.getenv("SESSION_IDLE_TTL", 1800)),
+    token_budget=int(os.getenv("SESSION_HISTORY_TOKENS", 500)),
+)
 
-# Кеш ответов AI
-response_cache: Dict[str, Tuple[str, float]] = {}
+def session_history(session_id: Optional[str], question: str, classification: Classification) -> Optional[SessionHistory]:
+    """История сессии, если вопрос её продолжает; None — вопрос самостоятельный.
+
+    Самостоятельные вопросы (в том числе заготовленные) идут прежним путём
+    с прежними ключами кеша, даже если заданы внутри сессии.
+    """
+    if not session_id or classification.predefined:
+        return None
+    has_topic = classification.is_university or classification.mentions_tou or classification.mentions_other_university
+    if not is_follow_up(question, has_topic):
+        return None
+    return session_store.history(session_id)
+
+def remember_turn(session_id: Optional[str], question: str, answer: str, mode: str, passage_ids: Sequence[str] = ()) -> None:
+    # Сообщения об ошибках — не реплики ассистента
+    if session_id and answer not in SERVICE_ANSWERS:
+        session_store.append(session_id, question, answer, mode, passage_ids)
+
+async def invoke_llm(prompt: str, api_key: Optional[str], client_id: str, kind: str = "single") -> str:
+    """Вызов LLM через планировщик допуска (в очередь ставится только этот этап)."""
+    llm = llm_manager.get_llm(api_key)
+    PROMPT_TOKENS.observe(kind, value=estimate_tokens(prompt))
+    queued_at = time.perf_counter()
+    try:
+        async with llm_scheduler.slot(client_id):
+            STAGE_SECONDS.observe("admission_wait", value=time.perf_counter() - queued_at)
+            with STAGE_SECONDS.time("llm"):
+                response = await llm.ainvoke(prompt)
+    except AdmissionRejected:
+        LLM_CALLS.inc("rejected")
+        raise
+    except Exception:
+        LLM_CALLS.inc("error")
+        raise
+    LLM_CALLS.inc("ok")
+    return response.content.strip() if hasattr(response, "content") else str(response).strip()
+
+# Кеш ответов AI (LRU с TTL, ограничен по объёму в байтах).
+# memory — в процессе; sqlite — общий для всех воркеров на хосте и переживает перезапуск
 CACHE_TTL = 300
-MAX_CACHE_SIZE = 200
+response_cache = create_response_cache(
+    os.getenv("RESPONSE_CACHE_BACKEND", "memory"),
+    os.getenv("RESPONSE_CACHE_PATH", ".cache/responses.sqlite3"),
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 16 * 1024 * 1024)),
+    ttl=CACHE_TTL,
+)
+
+# Второй уровень кеша: ответы на перефразированные вопросы к той же версии базы знаний.
+# Название университета подразумевается в каждом вопросе и на близость не влияет
+semantic_cache = SemanticCache(
+    threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.9)),
+    capacity=int(os.getenv("SEMANTIC_CACHE_SIZE", 10000)),
+    ttl=CACHE_TTL,
+    ignore_terms=("университет", "универ", "тоу", "tou", "торайгырова", "toraigyrov"),
+)
+
+# Поколение общего кеша, с которым согласован семантический кеш этого процесса
+_semantic_cache_generation = response_cache.generation
+
+# Объединение одинаковых одновременных запросов к LLM
+llm_single_flight = SingleFlight()
 
 def get_cache_key(query: str, content_hash: str) -> str:
     """Генерация ключа для кеша ответа."""
     normalized_query = re.sub(r'\s+', ' ', query.lower().strip())
     return hashlib.md5(f"{normalized_query}:{content_hash}".encode()).hexdigest()
 
-def is_cache_valid(timestamp: float) -> bool:
-    """Проверка актуальности кеша."""
-    return time.time() - timestamp < CACHE_TTL
-
-def cleanup_cache() -> None:
-    """Удаление устаревших и лишних записей из кеша."""
-    global response_cache
-    current_time = time.time()
-    expired_keys = [k for k, (_, ts) in response_cache.items() if current_time - ts > CACHE_TTL]
-    for k in expired_keys:
-        del response_cache[k]
-    if len(response_cache) > MAX_CACHE_SIZE:
-        sorted_items = sorted(response_cache.items(), key=lambda x: x[1][1])
-        to_remove = len(response_cache) - MAX_CACHE_SIZE
-        for i in range(to_remove):
-            del response_cache[sorted_items[i][0]]
-
-def cached_ai_answer(document_content: str, content_hash: str, user_query: str, api_key: Optional[str] = None) -> str:
-    """Ответ AI с кешированием (по базе знаний и запросу)."""
-    processed_query = preprocess_query(user_query)
-    cache_key = get_cache_key(processed_query, content_hash)
-    if cache_key in response_cache:
-        cached_response, timestamp = response_cache[cache_key]
-        if is_cache_valid(timestamp):
-            logger.info(f"Найден кеш для запроса: {user_query[:50]}...")
-            return cached_response
+def semantic_query(processed_query: str) -> str:
+    """Вопрос для семантического кеша: без общего для всех уточнения про университет."""
+    return processed_query.replace(UNIVERSITY_CLARIFICATION.lower(), "")
+
+def sync_semantic_cache() -> None:
+    """Сброс локального семантического кеша, если общий кеш очистил другой воркер."""
+    global _semantic_cache_generation
+    generation = response_cache.generation
+    if generation != _semantic_cache_generation:
+        semantic_cache.clear()
+        _semantic_cache_generation = generation
+
+def lookup_cached_answer(cache_key: str, processed_query: Optional[str] = None, context_key: Optional[str] = None) -> Optional[str]:
+    """Актуальный ответ из кеша или None; при промахе по ключу — поиск похожего вопроса
+    к той же версии базы знаний (если переданы вопрос и ключ контекста)."""
+    with STAGE_SECONDS.time("cache"):
+        cached_response = response_cache.get(cache_key)
+        result = "exact"
+        if cached_response is None and processed_query is not None and context_key is not None:
+            sync_semantic_cache()
+            cached_response = semantic_cache.get(semantic_query(processed_query), knowledge_version(context_key))
+            result = "semantic"
+    CACHE_LOOKUPS.inc(result if cached_response is not None else "miss")
+    return cached_response
+
+def save_cached_answer(cache_key: str, content: str, processed_query: Optional[str] = None, ttl: Optional[float] = None, context_key: Optional[str] = None) -> None:
+    """Сохранение ответа в кеш (и в семантический кеш, если переданы вопрос и ключ контекста)."""
+    response_cache.put(cache_key, content, ttl)
+    if processed_query is not None and context_key is not None:
+        semantic_cache.put(semantic_query(processed_query), knowledge_version(context_key), content)
+
+async def in_cache_thread(func: Callable, *args: Any) -> Any:
+    """Операция с кешем ответов: SQLite — в пуле потоков, чтобы не блокировать event loop."""
+    if response_cache.blocking:
+        return await run_in_executor(func, *args)
+    return func(*args)
+
+async def get_cached_answer(cache_key: str, processed_query: Optional[str] = None, context_key: Optional[str] = None) -> Optional[str]:
+    return await in_cache_thread(lookup_cached_answer, cache_key, processed_query, context_key)
+
+async def store_cached_answer(cache_key: str, content: str, processed_query: Optional[str] = None, ttl: Optional[float] = None, context_key: Optional[str] = None) -> None:
+    await in_cache_thread(save_cached_answer, cache_key, content, processed_query, ttl, context_key)
+
+async def generate_ai_answer(document_content: str, content_hash: str, user_query: str, api_key: Optional[str], cache_key: str, processed_query: Optional[str], client_id: str, history: Optional[SessionHistory] = None) -> str:
+    """Вызов LLM и сохранение ответа в кеш."""
     start_time = time.time()
     try:
-        llm = llm_manager.get_llm(api_key)
-        prompt = PROMPT.format(document_content=document_content, user_query=user_query)
-        response = llm.invoke(prompt)
-        content = response.content.strip() if hasattr(response, "content") else str(response).strip()
+        prompt = PROMPT.format(document_content=document_content, user_query=history.prompt_query(user_query) if history else user_query)
+        content = await invoke_llm(prompt, api_key, client_id)
         if not content or len(content) < 10:
-            content = "Извините, я не смог сформировать ответ на основе имеющейся информации."
-        response_cache[cache_key] = (content, time.time())
-        cleanup_cache()
+            content = NO_ANSWER
+        await store_cached_answer(cache_key, content, processed_query, context_key=content_hash)
         response_time = time.time() - start_time
         logger.info(f"Ответ AI сгенерирован за {response_time:.2f}с для запроса: {user_query[:50]}...")
         return content
+    except AdmissionRejected:
+        raise
     except Exception as e:
         logger.error(f"Ошибка генерации ответа AI: {str(e)}")
-        return f"Произошла ошибка при обработке вашего запроса: {str(e)}"
+        return ERROR_ANSWER
+
+def knowledge_cache_key(processed_query: str, content_hash: str, history: Optional[SessionHistory] = None) -> str:
+    """Ключ кеша ответа по базе знаний; у продолжения разговора в него входит отпечаток истории."""
+    if history is None:
+        return get_cache_key(processed_query, content_hash)
+    return get_cache_key(processed_query, f"{content_hash}:{history.digest}")
+
+async def cached_ai_answer(document_content: str, content_hash: str, user_query: str, api_key: Optional[str] = None, client_id: str = "anonymous", history: Optional[SessionHistory] = None) -> Tuple[str, bool]:
+    """Ответ AI с кешированием (по базе знаний и запросу) и признак попадания в кеш.
+
+    Одинаковые одновременные промахи кеша ждут один общий вызов LLM.
+    Ответ на продолжение разговора зависит от истории, поэтому он не
+    попадает в семантический кеш и журнал частых вопросов.
+    """
+    processed_query = preprocess_query(user_query)
+    cache_key = knowledge_cache_key(processed_query, content_hash, history)
+    if history is not None:
+        processed_query = None
+    elif query_log is not None:
+        query_log.record(processed_query, user_query)
+    cached_response = await get_cached_answer(cache_key, processed_query, content_hash)
+    if cached_response is not None:
+        logger.info(f"Найден кеш для запроса: {user_query[:50]}...")
+        return cached_response, True
+    # Ключ учитывает api_key: ответы на разных ключах не смешиваются.
+    # Отказ в допуске касается квоты ведущего клиента: остальные повторяют вызов со своей
+    flight_key = f"{cache_key}:{api_key or ''}"
+    answer = await llm_single_flight.do(
+        flight_key,
+        lambda: generate_ai_answer(document_content, content_hash, user_query, api_key, cache_key, processed_query, client_id, history),
+        retry_on=(AdmissionRejected,),
+    )
+    return answer, False
+
+UNIVERSITY_CLARIFICATION = " (имеется в виду университет Торайгырова)"
 
-def is_university_question(question: str) -> bool:
-    q = question.lower()
-    return any(kw in q for kw in UNIVERSITY_KEYWORDS)
+def classify_question(question: str) -> Classification:
+    """Заготовленный ответ, признак университетского вопроса и упоминания вузов — за один проход."""
+    with STAGE_SECONDS.time("predefined"):
+        predefined = query_matcher.find_predefined(question)
+    with STAGE_SECONDS.time("classification"):
+        return query_matcher.classify_keywords(question, predefined)
 
-def clarify_university_context(question: str) -> str:
+def clarify_university_context(question: str, classification: Optional[Classification] = None) -> str:
     # Если вопрос университетский, но не указан конкретный вуз, явно уточняем про Торайгырова
-    q = question.lower()
-    # Если явно указан другой вуз — не добавляем уточнение
-    if any(x in q for x in ["казну", "enu", "аль-фараби", "аль фараби", "narxoz", "narhoz", "astana it", "astana international", "almaty", "агу", "агту", "агу имени", "агу им.", "karstu", "каргту", "каргу", "karstu", "karstu", "karstu", "karstu"]):
+    classification = classification or classify_question(question)
+    # Если явно указан другой вуз или Торайгырова — не добавляем уточнение
+    if classification.mentions_other_university or classification.mentions_tou:
         return question
-    # Если нет слова "торайгырова" и нет других вузов — уточняем
-    if not any(x in q for x in ["торайгырова", "tou", "toraigyrov"]):
-        return question.strip() + " (имеется в виду университет Торайгырова)"
-    return question
+    return question.strip() + UNIVERSITY_CLARIFICATION
+
+def retrieve_context(query: str, pinned_ids: Sequence[str] = ()) -> Context:
+    """Поиск релевантных фрагментов и ключ контекста (выполняется в пуле потоков).
+
+    Ключ строится из версии снимка и идентификаторов фрагментов, посчитанных
+    при загрузке, поэтому хешировать текст контекста на каждый запрос не нужно.
+    """
+    with STAGE_SECONDS.time("retrieval"):
+        context = knowledge_manager.build_context(query, pinned_ids)
+    passages = context.passages
+    CONTEXT_TOKENS.observe(value=sum(p.tokens for p in passages))
+    logger.info(f"Контекст: {len(passages)} фрагментов, ~{sum(p.tokens for p in passages)} токенов ({', '.join(p.id for p in passages[:5])})")
+    return context
+
+async def prepare_university_context(user_query: str, classification: Optional[Classification] = None, history: Optional[SessionHistory] = None) -> Tuple[str, Context]:
+    """Уточнённый вопрос и релевантный контекст.
 
-async def get_ai_answer_async(user_query: str, api_key: Optional[str] = None) -> str:
-    """Асинхронный AI-ответ с учетом базы знаний."""
+    Для продолжения разговора поиск идёт и по предыдущему вопросу, а фрагменты
+    из прошлых ответов сессии сохраняются в контексте.
+    """
+    classification = classification or classify_question(user_query)
     # Если вопрос университетский, но не указан вуз — уточняем
-    clarified_query = clarify_university_context(user_query) if is_university_question(user_query) else user_query
-    content_to_use = knowledge_manager.get_relevant_sections(clarified_query)
-    if not content_to_use or not content_to_use.strip():
-        return "База знаний пуста или недоступна. Обратитесь к администратору."
+    clarified_query = clarify_university_context(user_query, classification) if classification.is_university else user_query
+    if history is None:
+        context = await run_in_executor(retrieve_context, clarified_query)
+    else:
+        context = await run_in_executor(retrieve_context, f"{history.last_question} {clarified_query}", history.passage_ids)
+    return clarified_query, context
+
+class KnowledgeAnswer(NamedTuple):
+    """Ответ по базе знаний, признак попадания в кеш и фрагменты контекста (для истории сессии)."""
+    text: str
+    cached: bool
+    passage_ids: Tuple[str, ...] = ()
+
+async def get_ai_answer_async(user_query: str, api_key: Optional[str] = None, classification: Optional[Classification] = None, client_id: str = "anonymous", history: Optional[SessionHistory] = None) -> KnowledgeAnswer:
+    """Асинхронный AI-ответ с учетом базы знаний (и истории сессии, если передана).
+
+    AdmissionRejected пробрасывается вызывающему.
+    """
+    clarified_query, context = await prepare_university_context(user_query, classification, history)
+    if not context.text or not context.text.strip():
+        return KnowledgeAnswer(EMPTY_KNOWLEDGE_ANSWER, False)
     try:
-        loop = asyncio.get_event_loop()
-        result = await asyncio.wait_for(
-            loop.run_in_executor(
-                executor,
-                cached_ai_answer,
-                content_to_use,
-                hashlib.md5(content_to_use.encode()).hexdigest(),
-                clarified_query,
-                api_key
-            ),
-            timeout=60
+        answer, cached = await asyncio.wait_for(
+            cached_ai_answer(context.text, context.key, clarified_query, api_key, client_id, history),
+            timeout=LLM_TIMEOUT
         )
-        return result
+        return KnowledgeAnswer(answer, cached, tuple(p.id for p in context.passages))
+    except AdmissionRejected:
+        raise
     except asyncio.TimeoutError:
-        logger.error("AI answer timeout (60s)")
-        return "Извините, ответ занял слишком много времени. Попробуйте ещё раз позже."
+        logger.error(f"AI answer timeout ({LLM_TIMEOUT}s)")
+        return KnowledgeAnswer(TIMEOUT_ANSWER, False)
     except Exception as e:
         logger.error(f"AI Error: {str(e)}")
-        return f"Произошла ошибка при обработке запроса. Повторите попытку позже."
+        return KnowledgeAnswer(ERROR_ANSWER, False)
+
+async def universal_answer(question: str, api_key: Optional[str] = None, client_id: str = "anonymous", history: Optional[SessionHistory] = None) -> str:
+    """Ответ LLM без базы знаний (исключения и таймаут обрабатывает вызывающий)."""
+    prompt = history.prompt_query(question) if history else question
+    return await asyncio.wait_for(invoke_llm(prompt, api_key, client_id), timeout=LLM_TIMEOUT)
+
+async def prewarm_answer(question: str) -> bool:
+    """Ответ на частый вопрос в кеш с TTL PREWARM_TTL; False — ответ уже был в кеше."""
+    context = await run_in_executor(retrieve_context, question)
+    processed_query = preprocess_query(question)
+    cache_key = get_cache_key(processed_query, context.key)
+    existing = await in_cache_thread(response_cache.get, cache_key)
+    if existing is not None:
+        # Ответ уже сгенерирован по этой версии базы — только продлеваем срок жизни
+        await in_cache_thread(response_cache.put, cache_key, existing, PREWARM_TTL)
+        return False
+    prompt = PROMPT.format(document_content=context.text, user_query=question)
+    content = await asyncio.wait_for(invoke_llm(prompt, None, PREWARM_CLIENT_ID, "prewarm"), timeout=LLM_TIMEOUT)
+    if len(content) < 10:
+        raise ValueError("модель вернула пустой ответ")
+    await store_cached_answer(cache_key, content, processed_query, PREWARM_TTL, context.key)
+    return True
+
+prewarm_job = PrewarmJob(
+    query_log,
+    prewarm_answer,
+    is_idle=llm_scheduler.has_spare_capacity,
+    top_n=PREWARM_TOP_N,
+    debounce=float(os.getenv("PREWARM_DEBOUNCE", 30)),
+) if query_log is not None else None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Старт без блокировки: снимок с диска сразу, MongoDB — в фоне (см. /api/ready)."""
+    if int(os.getenv("WEB_CONCURRENCY", 1)) > 1:
+        logger.warning("Сессии разговора хранятся в памяти воркера: без sticky-сессий по session_id уточняющие вопросы теряют контекст")
+    if query_log is not None:
+        query_log.start()
+    # Прогрев запускается до загрузки базы, чтобы не пропустить первую смену снимка
+    if prewarm_job is not None and PREWARM_TOP_N > 0:
+        prewarm_job.start()
+    knowledge_manager.start()
+    yield
+    if prewarm_job is not None:
+        await prewarm_job.stop()
+    if query_log is not None:
+        query_log.stop()
+    knowledge_manager.stop()
 
 # FastAPI-приложение
 app = FastAPI(
@@ -324,6 +701,7 @@ app = FastAPI(
     description="AI-ассистент университета Торайгырова с интеграцией MongoDB",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
+    lifespan=lifespan,
 )
 
 # CORS для фронтенда (Vercel, локально)
@@ -346,6 +724,10 @@ class QueryRequest(BaseModel):
     question: str
     api_key: Optional[str] = None
     mode: Optional[str] = 'tou'
+    # Идентификатор разговора (создаётся клиентом); без него каждый вопрос независим.
+    # История хранится в памяти процесса: нужен один воркер uvicorn или sticky-сессии
+    # на балансировщике по session_id, иначе уточняющий вопрос теряет контекст
+    session_id: Optional[str] = Field(None, max_length=128)
 
 @app.get("/")
 async def root():
@@ -362,12 +744,24 @@ async def health():
     """Проверка состояния сервера и MongoDB"""
     try:
         knowledge_status = "connected" if knowledge_manager.collection is not None else "not_configured"
+        snapshot = knowledge_manager.snapshot
+        cache_stats = await in_cache_thread(response_cache.stats)
         return {
             "status": "ok",
             "timestamp": time.time(),
-            "cache_size": len(response_cache),
+            "cache_size": cache_stats["entries"],
+            "response_cache": cache_stats,
+            "semantic_cache": semantic_cache.stats(),
+            "llm_single_flight": llm_single_flight.stats(),
+            "llm_pool": llm_manager.pool.stats(),
+            "admission": llm_scheduler.stats(),
+            "prewarm": prewarm_job.stats() if prewarm_job is not None else None,
+            "sessions": session_store.stats(),
             "version": "3.0.0",
             "knowledge_base": knowledge_status,
+            "knowledge_source": knowledge_manager.source,
+            "knowledge_version": snapshot.version,
+            "knowledge_documents": len(snapshot.docs),
             "environment": os.getenv("NODE_ENV", "production")
         }
     except Exception as e:
@@ -376,6 +770,37 @@ async def health():
             content={"status": "error", "message": str(e)}
         )
 
+@app.get("/api/ready")
+async def ready():
+    """Готовность к трафику: база знаний загружена с диска или из MongoDB"""
+    if not knowledge_manager.ready.is_set():
+        return JSONResponse(
+            status_code=503,
+            content={"status": "warming_up"}
+        )
+    return {
+        "status": "ready",
+        "knowledge_source": knowledge_manager.source,
+        "knowledge_version": knowledge_manager.snapshot.version
+    }
+
+# Текущие значения для /api/metrics: кеш, очередь к LLM, база знаний
+for gauge in (
+    Gauge("tougpt_response_cache_entries", "Записей в кеше ответов", lambda: len(response_cache)),
+    Gauge("tougpt_semantic_cache_entries", "Записей в семантическом кеше", lambda: len(semantic_cache)),
+    Gauge("tougpt_llm_active", "Вызовов LLM в работе", lambda: llm_scheduler.active),
+    Gauge("tougpt_llm_queued", "Запросов в очереди к LLM", lambda: llm_scheduler.stats()["queued"]),
+    Gauge("tougpt_sessions", "Активных сессий разговора", lambda: len(session_store)),
+    Gauge("tougpt_knowledge_documents", "Документов в снимке базы знаний", lambda: len(knowledge_manager.snapshot.docs)),
+):
+    metrics_registry.register(gauge)
+
+@app.get("/api/metrics")
+async def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    # Датчик размера кеша читает SQLite — рендер вне event loop
+    return PlainTextResponse(await in_cache_thread(metrics_registry.render), media_type="text/plain; version=0.0.4")
+
 # --- НАЧАЛО: Заготовленные ответы и ключевые слова ---
 PREDEFINED_ANSWERS = {
     "когда начнётся приём документов?": "Приём документов начинается 20 июня и заканчивается 25 августа.",
@@ -391,61 +816,122 @@ UNIVERSITY_KEYWORDS = [
     "университет", "тоу", "toraigyrov", "tougpt", "студент", "абитуриент", "факультет", "кафедра", "ректор", "декан", "общежитие", "приём документов", "документы", "стоимость обучения", "гранты","поступление", "кампус", "универ", "tou", "toraigyrov university"
 ]
 
-def find_predefined_answer(question: str) -> Optional[str]:
-    def normalize(text: str) -> str:
-        return re.sub(r'[\s\?.,!…]+', '', text.strip().lower())
-    q_norm = normalize(question)
-    for k, v in PREDEFINED_ANSWERS.items():
-        if q_norm == normalize(k):
-            return v
-    return None
+OTHER_UNIVERSITIES = [
+    "казну", "enu", "аль-фараби", "аль фараби", "narxoz", "narhoz", "astana it", "astana international", "almaty", "агу", "агту", "karstu", "каргту", "каргу"
+]
+
+TOU_ALIASES = ["торайгырова", "tou", "toraigyrov"]
+
+# Допустимое число опечаток при поиске заготовленного ответа (0 — только точное совпадение)
+PREDEFINED_FUZZY_DISTANCE = int(os.getenv("PREDEFINED_FUZZY_DISTANCE", 0))
+
+def build_query_matcher(faq: Dict[str, str]) -> QueryMatcher:
+    # FAQ из MongoDB дополняет (и переопределяет) встроенные заготовки
+    return QueryMatcher(
+        {**PREDEFINED_ANSWERS, **faq},
+        UNIVERSITY_KEYWORDS,
+        OTHER_UNIVERSITIES,
+        TOU_ALIASES,
+        fuzzy_max_distance=PREDEFINED_FUZZY_DISTANCE,
+    )
+
+query_matcher = build_query_matcher(knowledge_manager.snapshot.faq)
+_query_matcher_faq = knowledge_manager.snapshot.faq
+
+def rebuild_query_matcher(snapshot: KnowledgeSnapshot) -> None:
+    """Перекомпиляция классификатора, если в новом снимке изменился FAQ."""
+    global query_matcher, _query_matcher_faq
+    if snapshot.faq != _query_matcher_faq:
+        query_matcher = build_query_matcher(snapshot.faq)
+        _query_matcher_faq = snapshot.faq
+        logger.info(f"Классификатор вопросов перестроен, заготовленных ответов: {len(query_matcher.predefined)}")
+
+knowledge_manager.add_listener(rebuild_query_matcher)
+
+def schedule_prewarm(snapshot: KnowledgeSnapshot) -> None:
+    """Новый снимок — новые ключи кеша: прогреваем частые вопросы заново."""
+    if prewarm_job is not None and snapshot.docs:
+        prewarm_job.trigger()
+
+knowledge_manager.add_listener(schedule_prewarm)
 
 @app.post("/api/ask")
-async def ask_ai(req: QueryRequest, x_api_key: Optional[str] = Header(None)):
+async def ask_ai(req: QueryRequest, request: Request, x_api_key: Optional[str] = Header(None)):
     """Получить ответ AI (умный ассистент с приоритетом университетских вопросов)"""
     if not req.question or not req.question.strip():
         return JSONResponse(
             status_code=400,
             content={"answer": "Вопрос не может быть пустым."}
         )
+    start_time = time.perf_counter()
     api_key = x_api_key or req.api_key
+    client_id = client_identity(request, api_key)
     question = req.question.strip()
+    classification = classify_question(question)
+    history = session_history(req.session_id, question, classification)
     # 1. Проверка на заготовленный ответ
-    predefined = find_predefined_answer(question)
+    predefined = classification.predefined
     if predefined:
+        remember_turn(req.session_id, question, predefined, "predefined")
         return JSONResponse(
             status_code=200,
             content={
                 "answer": predefined,
-                "processing_time": 0,
+                "processing_time": record_request("ask", "predefined", True, start_time),
                 "cached": True,
-                "mode": "predefined"
+                "mode": "predefined",
+                "session_id": req.session_id
             }
         )
-    # 2. Если университетский вопрос — ответ по базе знаний
-    if is_university_question(question):
-        answer = await get_ai_answer_async(question, api_key)
+    # 2. Если университетский вопрос (или продолжение разговора о университете) — ответ по базе знаний
+    if classification.is_university or (history is not None and history.last_mode == "university"):
+        try:
+            answer, cached, passage_ids = await get_ai_answer_async(question, api_key, classification, client_id, history)
+        except AdmissionRejected as e:
+            return overloaded_response(e)
+        remember_turn(req.session_id, question, answer, "university", passage_ids)
         return JSONResponse(
             status_code=200,
             content={
                 "answer": answer,
-                "processing_time": 0,
-                "cached": False,
-                "mode": "university"
+                "processing_time": record_request("ask", "university", cached, start_time),
+                "cached": cached,
+                "mode": "university",
+                "session_id": req.session_id
             }
         )
     # 3. Иначе — универсальный ответ LLM
     try:
-        llm = llm_manager.get_llm(api_key)
-        response = llm.invoke(question)
-        answer = response.content.strip() if hasattr(response, "content") else str(response).strip()
+        answer = await universal_answer(question, api_key, client_id, history)
+        remember_turn(req.session_id, question, answer, "universal")
         return JSONResponse(
             status_code=200,
             content={
                 "answer": answer,
-                "processing_time": 0,
+                "processing_time": record_request("ask", "universal", False, start_time),
                 "cached": False,
-                "mode": "universal"
+                "mode": "universal",
+                "session_id": req.session_id
+            }
+        )
+    except AdmissionRejected as e:
+        return overloaded_response(e)
+    except LLMUnavailableError as e:
+        logger.error(f"LLM unavailable: {str(e)}")
+        return JSONResponse(
+            status_code=503,
+            content={
+                "answer": "Сервис AI временно перегружен. Попробуйте ещё раз позже.",
+                "error": True
+            }
+        )
+    except asyncio.TimeoutError:
+        logger.error(f"AI answer timeout ({LLM_TIMEOUT}s)")
+        return JSONResponse(
+            status_code=504,
+            content={
+                "answer": TIMEOUT_ANSWER,
+                "error": True
             }
         )
     except Exception as e:
@@ -458,18 +944,312 @@ async def ask_ai(req: QueryRequest, x_api_key: Optional[str] = Header(None)):
             }
         )
 
+def sse_event(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    """Форматирование события Server-Sent Events."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def replay_answer_events(answer: str, mode: str, cached: bool, start_time: float) -> AsyncIterator[str]:
+    """Готовый ответ (заготовка или кеш) в виде потока из одного фрагмента."""
+    yield sse_event({"mode": mode, "cached": cached}, "meta")
+    yield sse_event({"token": answer})
+    yield sse_event({"processing_time": record_request("stream", mode, cached, start_time)}, "done")
+
+async def stream_llm_tokens(llm: Any, prompt: str) -> AsyncIterator[str]:
+    """Фрагменты ответа LLM по мере генерации (таймаут LLM_TIMEOUT на каждый фрагмент)."""
+    stream = llm.astream(prompt).__aiter__()
+    while True:
+        try:
+            chunk = await asyncio.wait_for(stream.__anext__(), timeout=LLM_TIMEOUT)
+        except StopAsyncIteration:
+            return
+        text = chunk.content if hasattr(chunk, "content") else str(chunk)
+        if text:
+            yield text
+
+class StreamPlan(NamedTuple):
+    """Подготовленный потоковый ответ: готовый текст (заготовка, кеш, сообщение) или промпт для LLM."""
+    mode: str
+    answer: Optional[str] = None
+    cached: bool = False
+    prompt: Optional[str] = None
+    cache_key: Optional[str] = None
+    processed_query: Optional[str] = None
+    context_key: Optional[str] = None
+    passage_ids: Tuple[str, ...] = ()
+
+async def plan_stream_answer(question: str, session_id: Optional[str] = None) -> StreamPlan:
+    """Маршрутизация, как в /api/ask: заготовка, кеш или промпт для LLM (до открытия потока)."""
+    classification = classify_question(question)
+    history = session_history(session_id, question, classification)
+    predefined = classification.predefined
+    if predefined:
+        remember_turn(session_id, question, predefined, "predefined")
+        return StreamPlan("predefined", predefined, True)
+    if not (classification.is_university or (history is not None and history.last_mode == "university")):
+        return StreamPlan("universal", prompt=history.prompt_query(question) if history else question)
+    mode = "university"
+    clarified_query, context = await prepare_university_context(question, classification, history)
+    if not context.text or not context.text.strip():
+        return StreamPlan(mode, EMPTY_KNOWLEDGE_ANSWER)
+    passage_ids = tuple(p.id for p in context.passages)
+    processed_query = preprocess_query(clarified_query)
+    cache_key = knowledge_cache_key(processed_query, context.key, history)
+    if history is not None:
+        processed_query = None
+    elif query_log is not None:
+        query_log.record(processed_query, clarified_query)
+    cached_response = await get_cached_answer(cache_key, processed_query, context.key)
+    if cached_response is not None:
+        remember_turn(session_id, question, cached_response, mode, passage_ids)
+        return StreamPlan(mode, cached_response, True)
+    prompt = PROMPT.format(document_content=context.text, user_query=history.prompt_query(clarified_query) if history else clarified_query)
+    return StreamPlan(mode, prompt=prompt, cache_key=cache_key, processed_query=processed_query, context_key=context.key, passage_ids=passage_ids)
+
+async def stream_ai_answer(question: str, plan: StreamPlan, api_key: Optional[str], client_id: str = "anonymous", session_id: Optional[str] = None, start_time: Optional[float] = None) -> AsyncIterator[str]:
+    """SSE-поток ответа по подготовленному плану (см. plan_stream_answer)."""
+    start_time = start_time or time.perf_counter()
+    mode = plan.mode
+    if plan.prompt is None:
+        async for event in replay_answer_events(plan.answer, mode, plan.cached, start_time):
+            yield event
+        return
+    yield sse_event({"mode": mode, "cached": False}, "meta")
+    parts = []
+    try:
+        llm = llm_manager.get_llm(api_key)
+        PROMPT_TOKENS.observe("stream", value=estimate_tokens(plan.prompt))
+        queued_at = time.perf_counter()
+        async with llm_scheduler.slot(client_id):
+            llm_started = time.perf_counter()
+            STAGE_SECONDS.observe("admission_wait", value=llm_started - queued_at)
+            async for token in stream_llm_tokens(llm, plan.prompt):
+                if not parts:
+                    STAGE_SECONDS.observe("llm_first_token", value=time.perf_counter() - llm_started)
+                parts.append(token)
+                yield sse_event({"token": token})
+            STAGE_SECONDS.observe("llm", value=time.perf_counter() - llm_started)
+        LLM_CALLS.inc("ok")
+    except AdmissionRejected as e:
+        LLM_CALLS.inc("rejected")
+        logger.warning(f"Поток отклонён планировщиком: {e}")
+        yield sse_event({"message": "Сервер перегружен запросами. Повторите попытку чуть позже.", "retry_after": e.retry_after}, "error")
+        return
+    except asyncio.TimeoutError:
+        LLM_CALLS.inc("error")
+        logger.error(f"AI stream timeout ({LLM_TIMEOUT}s)")
+        yield sse_event({"message": TIMEOUT_ANSWER}, "error")
+        return
+    except Exception as e:
+        LLM_CALLS.inc("error")
+        logger.error(f"AI stream error: {str(e)}")
+        yield sse_event({"message": ERROR_ANSWER}, "error")
+        return
+    answer = "".join(parts).strip()
+    if plan.cache_key is not None and len(answer) >= 10:
+        await store_cached_answer(plan.cache_key, answer, plan.processed_query, context_key=plan.context_key)
+    remember_turn(session_id, question, answer, mode, plan.passage_ids)
+    response_time = record_request("stream", mode, False, start_time)
+    logger.info(f"Потоковый ответ AI сгенерирован за {response_time:.2f}с для запроса: {question[:50]}...")
+    yield sse_event({"processing_time": response_time}, "done")
+
+@app.post("/api/ask/stream")
+async def ask_ai_stream(req: QueryRequest, request: Request, x_api_key: Optional[str] = Header(None)):
+    """Потоковый ответ AI (Server-Sent Events): события meta, фрагменты token, done или error"""
+    if not req.question or not req.question.strip():
+        return JSONResponse(
+            status_code=400,
+            content={"answer": "Вопрос не может быть пустым."}
+        )
+    start_time = time.perf_counter()
+    api_key = x_api_key or req.api_key
+    client_id = client_identity(request, api_key)
+    question = req.question.strip()
+    plan = await plan_stream_answer(question, req.session_id)
+    # Заготовки и кеш отвечают без очереди; при перегрузке вызов LLM — сразу 429, пока поток не открыт
+    if plan.prompt is not None:
+        try:
+            llm_scheduler.check(client_id)
+        except AdmissionRejected as e:
+            return overloaded_response(e)
+    return StreamingResponse(
+        stream_ai_answer(question, plan, api_key, client_id, req.session_id, start_time),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+class BatchQueryRequest(BaseModel):
+    """Модель запроса для /api/ask/batch"""
+    questions: List[str]
+    api_key: Optional[str] = None
+    mode: Optional[str] = 'tou'
+
+MAX_BATCH_QUESTIONS = int(os.getenv("MAX_BATCH_QUESTIONS", 50))
+# Сколько вопросов помещается в один промпт (ограничено длиной ответа модели)
+BATCH_QUESTIONS_PER_PROMPT = int(os.getenv("BATCH_QUESTIONS_PER_PROMPT", 5))
+
+def prepare_batch_items(questions: List[Tuple[int, str, Classification]]) -> List[BatchItem]:
+    """Контекст и ключ кеша для каждого университетского вопроса (выполняется в пуле потоков).
+
+    Ключ кеша — как у /api/ask (по полному контексту), а в общий промпт группы
+    идёт только доля бюджета на вопрос, иначе вопросы не помещаются вместе.
+    """
+    snapshot = knowledge_manager.snapshot
+    builder = knowledge_manager.context_builder
+    share_budget = builder.token_budget // BATCH_QUESTIONS_PER_PROMPT
+    items = []
+    for position, question, classification in questions:
+        clarified_query = clarify_university_context(question, classification)
+        with STAGE_SECONDS.time("retrieval"):
+            ranked = builder.rank(snapshot, clarified_query)
+            context = builder.from_ranked(snapshot, ranked)
+            share = builder.from_ranked(snapshot, ranked, token_budget=share_budget)
+        processed_query = preprocess_query(clarified_query)
+        if query_log is not None:
+            query_log.record(processed_query, clarified_query)
+        items.append(BatchItem(position, clarified_query, processed_query, context, get_cache_key(processed_query, context.key), share))
+    return items
+
+async def answer_batch_group(group: List[BatchItem], api_key: Optional[str], client_id: str) -> List[Optional[str]]:
+    """Один вызов LLM на группу вопросов с общим контекстом; ответы кешируются по отдельности.
+
+    Пропущенные моделью вопросы — None: на них отвечают отдельными запросами.
+    """
+    prompt = BATCH_PROMPT.format(
+        document_content=group_context(group),
+        user_queries=format_questions([item.question for item in group])
+    )
+    try:
+        content = await asyncio.wait_for(invoke_llm(prompt, api_key, client_id, "batch"), timeout=LLM_TIMEOUT)
+    except AdmissionRejected:
+        raise
+    except asyncio.TimeoutError:
+        logger.error(f"AI batch timeout ({LLM_TIMEOUT}s)")
+        return [TIMEOUT_ANSWER] * len(group)
+    except Exception as e:
+        logger.error(f"AI batch error: {str(e)}")
+        return [ERROR_ANSWER] * len(group)
+    answers = split_batch_answer(content, len(group))
+    for item, answer in zip(group, answers):
+        if answer is not None:
+            await store_cached_answer(item.cache_key, answer, item.processed_query, context_key=item.context.key)
+    return answers
+
+async def batch_fallback_answer(item: BatchItem, api_key: Optional[str], client_id: str) -> str:
+    return (await get_ai_answer_async(item.question, api_key, client_id=client_id)).text
+
+async def safe_universal_answer(question: str, api_key: Optional[str], client_id: str) -> str:
+    try:
+        return await universal_answer(question, api_key, client_id)
+    except AdmissionRejected:
+        raise
+    except asyncio.TimeoutError:
+        logger.error(f"AI answer timeout ({LLM_TIMEOUT}s)")
+        return TIMEOUT_ANSWER
+    except Exception as e:
+        logger.error(f"Server error: {str(e)}")
+        return ERROR_ANSWER
+
+def batch_result(question: str, answer: str, mode: str) -> Dict[str, Any]:
+    result = {"question": question, "answer": answer, "cached": False, "mode": mode}
+    if answer == OVERLOADED_ANSWER:
+        result["error"] = True
+    return result
+
+@app.post("/api/ask/batch")
+async def ask_ai_batch(req: BatchQueryRequest, request: Request, x_api_key: Optional[str] = Header(None)):
+    """Ответы на пакет вопросов: заготовки и кеш сразу, промахи — несколькими вопросами в одном промпте"""
+    questions = [q.strip() for q in req.questions]
+    if not questions or not all(questions):
+        return JSONResponse(
+            status_code=400,
+            content={"answer": "Вопросы не могут быть пустыми."}
+        )
+    if len(questions) > MAX_BATCH_QUESTIONS:
+        return JSONResponse(
+            status_code=400,
+            content={"answer": f"Не более {MAX_BATCH_QUESTIONS} вопросов за один запрос."}
+        )
+    api_key = x_api_key or req.api_key
+    client_id = client_identity(request, api_key)
+    start_time = time.perf_counter()
+    results: List[Optional[Dict[str, Any]]] = [None] * len(questions)
+    university: List[Tuple[int, str, Classification]] = []
+    universal: List[Tuple[int, str]] = []
+    for position, question in enumerate(questions):
+        classification = classify_question(question)
+        if classification.predefined:
+            results[position] = {"question": question, "answer": classification.predefined, "cached": True, "mode": "predefined"}
+        elif classification.is_university:
+            university.append((position, question, classification))
+        else:
+            universal.append((position, question))
+    misses: List[BatchItem] = []
+    if university:
+        for item in await run_in_executor(prepare_batch_items, university):
+            cached_response = await get_cached_answer(item.cache_key, item.processed_query, item.context.key)
+            if cached_response is not None:
+                results[item.position] = {"question": questions[item.position], "answer": cached_response, "cached": True, "mode": "university"}
+            else:
+                misses.append(item)
+    groups = group_items(misses, knowledge_manager.context_builder.token_budget, BATCH_QUESTIONS_PER_PROMPT)
+    # Все вызовы LLM пакета (и запасные ответы на пропущенные вопросы) занимают
+    # не больше мест в очереди, чем положено одному клиенту. Отказ планировщика
+    # получает только тот вопрос, которому не хватило места
+    limit = asyncio.Semaphore(ADMISSION_MAX_QUEUE_PER_CLIENT)
+    rejections: List[AdmissionRejected] = []
+    async def limited(call: Callable[[], Any], rejected: Any) -> Any:
+        async with limit:
+            try:
+                return await call()
+            except AdmissionRejected as e:
+                rejections.append(e)
+                return rejected
+    async def answer_group(group: List[BatchItem]) -> List[str]:
+        answers = await limited(lambda: answer_batch_group(group, api_key, client_id), [OVERLOADED_ANSWER] * len(group))
+        # Место группы уже освобождено: запасные вызовы не ждут сами себя
+        skipped = [n for n, answer in enumerate(answers) if answer is None]
+        fallbacks = await asyncio.gather(*[
+            limited(lambda item=group[n]: batch_fallback_answer(item, api_key, client_id), OVERLOADED_ANSWER) for n in skipped
+        ])
+        for n, fallback in zip(skipped, fallbacks):
+            answers[n] = fallback
+        return answers
+    group_answers, universal_answers = await asyncio.gather(
+        asyncio.gather(*[answer_group(group) for group in groups]),
+        asyncio.gather(*[limited(lambda question=question: safe_universal_answer(question, api_key, client_id), OVERLOADED_ANSWER) for _, question in universal])
+    )
+    answered = [answer for answers in group_answers for answer in answers] + list(universal_answers)
+    if rejections and all(answer == OVERLOADED_ANSWER for answer in answered):
+        # Ни на один вопрос LLM не ответила — как и одиночный запрос, отвечаем 429
+        return overloaded_response(rejections[0])
+    for group, answers in zip(groups, group_answers):
+        for item, answer in zip(group, answers):
+            results[item.position] = batch_result(questions[item.position], answer, "university")
+    for (position, question), answer in zip(universal, universal_answers):
+        results[position] = batch_result(question, answer, "universal")
+    processing_time = record_request("batch", "batch", not groups and not universal, start_time)
+    logger.info(f"Пакет из {len(questions)} вопросов: {len(misses)} промахов кеша в {len(groups)} промптах за {processing_time:.2f}с")
+    return JSONResponse(
+        status_code=200,
+        content={
+            "answers": results,
+            "llm_calls": len(groups) + len(universal),
+            "processing_time": processing_time
+        }
+    )
+
 @app.post("/api/clear-cache")
 async def clear_cache(api_key: Optional[str] = Header(None)):
     """Очистить кеш ответов (требует ADMIN_API_KEY)"""
-    global response_cache
     admin_key = os.getenv("ADMIN_API_KEY")
     if not admin_key or api_key != admin_key:
         return JSONResponse(
             status_code=401,
             content={"status": "Недостаточно прав для этой операции"}
         )
-    old_size = len(response_cache)
-    response_cache.clear()
+    old_size = await in_cache_thread(response_cache.clear)
+    semantic_cache.clear()
     return {"status": "Кеш очищен", "old_size": old_size, "timestamp": time.time()}
 
 if __name__ == "__main__":
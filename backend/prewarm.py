@@ -0,0 +1,151 @@
+"""Прогрев кеша ответов на частые вопросы из журнала вопросов.
+
+В приложении задача запускается сама после каждой смены снимка базы знаний.
+Отдельный запуск (например, по cron или после деплоя; полезен только с общим
+кешем RESPONSE_CACHE_BACKEND=sqlite):
+
+    python prewarm.py --top 200
+    python prewarm.py --list --top 20
+"""
+import argparse
+import asyncio
+import logging
+import sys
+from typing import Awaitable, Callable, Dict, Optional
+
+from query_log import QueryLog
+
+logger = logging.getLogger("tougpt")
+
+
+class PrewarmJob:
+    """Фоновая перегенерация ответов на top_n частых вопросов после смены снимка.
+
+    Смены снимка подряд (инкрементальные обновления) схлопываются: прогрев
+    начинается через debounce секунд после последней. Вопросы идут по одному
+    и только пока у LLM есть свободная ёмкость (is_idle), поэтому прогрев не
+    отнимает её у пользователей. warm(question) возвращает True, если ответ
+    сгенерирован, и False, если он уже был в кеше.
+    """
+
+    def __init__(
+        self,
+        query_log: QueryLog,
+        warm: Callable[[str], Awaitable[bool]],
+        is_idle: Callable[[], bool],
+        top_n: int = 200,
+        debounce: float = 30,
+        idle_poll: float = 1,
+    ):
+        self.query_log = query_log
+        self.warm = warm
+        self.is_idle = is_idle
+        self.top_n = top_n
+        self.debounce = debounce
+        self.idle_poll = idle_poll
+        self.runs = 0
+        self.last_result: Dict[str, int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._changed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Запуск в текущем event loop (из lifespan приложения)."""
+        self._loop = asyncio.get_running_loop()
+        self._changed = asyncio.Event()
+        self._task = self._loop.create_task(self._run_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def trigger(self, *_args) -> None:
+        """Снимок сменился (можно вызывать из любого потока)."""
+        if self._loop is not None and self._changed is not None:
+            self._loop.call_soon_threadsafe(self._changed.set)
+
+    async def _run_forever(self) -> None:
+        while True:
+            await self._changed.wait()
+            # Ждём, пока обновления базы знаний утихнут
+            while True:
+                self._changed.clear()
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=self.debounce)
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка прогрева кеша: {e}")
+
+    async def run_once(self) -> Dict[str, int]:
+        result = {"warmed": 0, "cached": 0, "failed": 0}
+        top = await asyncio.get_running_loop().run_in_executor(None, self.query_log.top, self.top_n)
+        for normalized, question, count in top:
+            # Новая смена снимка во время прогрева: начнём заново с новой версией
+            if self._changed is not None and self._changed.is_set():
+                break
+            while not self.is_idle():
+                await asyncio.sleep(self.idle_poll)
+            try:
+                result["warmed" if await self.warm(question) else "cached"] += 1
+            except Exception as e:
+                result["failed"] += 1
+                logger.warning(f"Не удалось прогреть ответ на «{normalized[:50]}»: {e}")
+        await asyncio.get_running_loop().run_in_executor(None, self.query_log.compact)
+        self.runs += 1
+        self.last_result = result
+        logger.info(f"Прогрев кеша: {result} (из {len(top)} частых вопросов)")
+        return result
+
+    def stats(self) -> Dict[str, object]:
+        return {"top_n": self.top_n, "runs": self.runs, "last_result": self.last_result}
+
+
+def cli() -> int:
+    parser = argparse.ArgumentParser(description="Прогрев кеша ответов на частые вопросы")
+    parser.add_argument("--top", type=int, default=None, help="сколько частых вопросов (по умолчанию PREWARM_TOP_N)")
+    parser.add_argument("--list", action="store_true", help="только показать частые вопросы")
+    parser.add_argument("--wait", type=float, default=120, help="сколько ждать загрузки базы знаний, секунды")
+    args = parser.parse_args()
+
+    # main импортируется здесь: модулю приложения нужен этот файл
+    import main
+
+    if main.query_log is None:
+        print("Журнал вопросов отключён (QUERY_LOG_PATH пуст)")
+        return 1
+    top_n = args.top or main.PREWARM_TOP_N
+    if top_n <= 0:
+        print("Укажите --top или PREWARM_TOP_N")
+        return 1
+    if args.list:
+        for normalized, question, count in main.query_log.top(top_n):
+            print(f"{count:>8}  {question}")
+        return 0
+    if main.response_cache.stats()["backend"] != "sqlite":
+        print("Прогрев из отдельного процесса имеет смысл только с общим кешем: RESPONSE_CACHE_BACKEND=sqlite")
+        return 1
+
+    async def run() -> Dict[str, int]:
+        main.knowledge_manager.start()
+        try:
+            if not await asyncio.get_running_loop().run_in_executor(None, main.knowledge_manager.wait_until_loaded, args.wait):
+                raise RuntimeError("База знаний не загрузилась")
+            main.prewarm_job.top_n = top_n
+            return await main.prewarm_job.run_once()
+        finally:
+            main.knowledge_manager.stop()
+
+    print(asyncio.run(run()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(cli())
@@ -0,0 +1,136 @@
+import logging
+import os
+import re
+import tempfile
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger("tougpt")
+
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+class QueryLog:
+    """Локальный журнал частых вопросов: только дописывание, счётчики в памяти.
+
+    Строка файла — «число<TAB>нормализованный вопрос<TAB>вопрос для LLM».
+    record() только копит записи в памяти и вызывается прямо из обработчиков
+    запросов: файл дописывает фоновый поток (start/stop) пачкой раз в
+    flush_interval секунд или сразу после flush_every разных вопросов. Без
+    потока записи дописываются при flush(), top() и compact(). При чтении
+    строки суммируются. compact()
+    переписывает файл агрегированными строками и отбрасывает редкие вопросы
+    сверх max_entries. Несколько воркеров могут писать в один файл; строки,
+    дописанные во время сжатия, теряются — на топ частых вопросов это не влияет.
+    """
+
+    def __init__(self, path: str, flush_interval: float = 5, flush_every: int = 100, max_entries: int = 50000):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_every = flush_every
+        self.max_entries = max_entries
+        self._pending: Counter = Counter()
+        self._questions: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._flush_requested = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="query-log-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Останавливает фоновый поток и дописывает накопленное."""
+        self._stop.set()
+        self._flush_requested.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._flush_requested.wait(self.flush_interval)
+            self._flush_requested.clear()
+            self.flush()
+
+    @staticmethod
+    def _clean(text: str) -> str:
+        return WHITESPACE_RE.sub(" ", text).strip()
+
+    def record(self, normalized: str, question: str) -> None:
+        """Учёт вопроса: normalized — ключ (preprocess_query), question — текст для повторной генерации."""
+        normalized = self._clean(normalized)
+        if not normalized:
+            return
+        with self._lock:
+            self._pending[normalized] += 1
+            self._questions[normalized] = self._clean(question)
+            due = len(self._pending) >= self.flush_every
+        if due:
+            # Запись в файл — в фоновом потоке, не в event loop
+            self._flush_requested.set()
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, questions = self._pending, self._questions
+            self._pending, self._questions = Counter(), {}
+        if not pending:
+            return
+        lines = "".join(f"{count}\t{normalized}\t{questions[normalized]}\n" for normalized, count in pending.items())
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError as e:
+            logger.warning(f"Не удалось записать журнал вопросов {self.path}: {e}")
+
+    def _read(self) -> Tuple[Counter, Dict[str, str], int]:
+        counts: Counter = Counter()
+        questions: Dict[str, str] = {}
+        lines = 0
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) != 3 or not parts[0].isdigit():
+                        continue
+                    counts[parts[1]] += int(parts[0])
+                    questions[parts[1]] = parts[2]
+                    lines += 1
+        except FileNotFoundError:
+            pass
+        return counts, questions, lines
+
+    def top(self, n: int) -> List[Tuple[str, str, int]]:
+        """n самых частых вопросов: (нормализованный, вопрос для LLM, число запросов)."""
+        self.flush()
+        counts, questions, _ = self._read()
+        return [(normalized, questions[normalized], count) for normalized, count in counts.most_common(n)]
+
+    def compact(self) -> Optional[int]:
+        """Сжимает файл до одной строки на вопрос; возвращает число оставшихся вопросов."""
+        self.flush()
+        counts, questions, lines = self._read()
+        if lines <= len(counts) and len(counts) <= self.max_entries:
+            return len(counts)
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".query-log-")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    for normalized, count in counts.most_common(self.max_entries):
+                        f.write(f"{count}\t{normalized}\t{questions[normalized]}\n")
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning(f"Не удалось сжать журнал вопросов {self.path}: {e}")
+            return None
+        return min(len(counts), self.max_entries)
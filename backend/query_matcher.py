@@ -0,0 +1,188 @@
+import re
+from collections import Counter, deque
+from typing import Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+NORMALIZE_RE = re.compile(r"[\s?.,!…]+")
+WORD_RE = re.compile(r"\w+")
+NUMBER_RE = re.compile(r"\d+")
+
+# Категории шаблонов автомата
+UNIVERSITY = "university"
+OTHER_UNIVERSITY = "other_university"
+TOU = "tou"
+
+
+def normalize_question(text: str) -> str:
+    """Ключ заготовленного ответа: нижний регистр без пробелов и знаков препинания."""
+    return NORMALIZE_RE.sub("", text.strip().lower().replace("ё", "е"))
+
+
+def question_words(text: str) -> Tuple[str, ...]:
+    return tuple(WORD_RE.findall(text.lower().replace("ё", "е")))
+
+
+def trigrams(key: str) -> Set[str]:
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+class AhoCorasick:
+    """Автомат Ахо–Корасик: все вхождения набора подстрок за один проход по тексту."""
+
+    def __init__(self, patterns: Iterable[Tuple[str, str]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Set[str]] = [set()]
+        for pattern, label in patterns:
+            self._insert(pattern, label)
+        self._build_failures()
+
+    def _insert(self, pattern: str, label: str) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(set())
+                self._goto[state][char] = next_state
+            state = next_state
+        self._out[state].add(label)
+
+    def _build_failures(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                candidate = self._goto[fail].get(char, 0)
+                self._fail[next_state] = candidate if candidate != next_state else 0
+                self._out[next_state] |= self._out[self._fail[next_state]]
+
+    def labels(self, text: str) -> Set[str]:
+        """Метки всех шаблонов, встречающихся в тексте."""
+        found: Set[str] = set()
+        for labels in self._iter_outputs(text):
+            found |= labels
+        return found
+
+    def _iter_outputs(self, text: str) -> Iterator[Set[str]]:
+        state = 0
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            if self._out[state]:
+                yield self._out[state]
+
+
+def bounded_levenshtein(a: str, b: str, max_distance: int) -> Optional[int]:
+    """Расстояние Левенштейна, если оно не превышает max_distance, иначе None."""
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+class Classification(NamedTuple):
+    predefined: Optional[str]
+    is_university: bool
+    mentions_other_university: bool
+    mentions_tou: bool
+
+
+class QueryMatcher:
+    """Предкомпилированная классификация вопроса за один проход.
+
+    Заготовленные ответы ищутся по нормализованному ключу в словаре (и, если
+    включено, нечётко — с ограниченным расстоянием Левенштейна), а ключевые
+    слова университета, другие вузы и упоминания ТОУ — одним автоматом.
+
+    Нечёткий поиск сравнивает только ключи, разделяющие с вопросом достаточно
+    триграмм (правка меняет не больше трёх), и принимает совпадение, лишь
+    если числа те же, а каждое слово отличается не больше чем на одну правку:
+    «корпус 2» не совпадает с «корпус 1», «общения» — с «обучения».
+    """
+
+    def __init__(
+        self,
+        predefined: Mapping[str, str],
+        university_keywords: Iterable[str],
+        other_universities: Iterable[str],
+        tou_aliases: Iterable[str],
+        fuzzy_max_distance: int = 0,
+    ):
+        self.predefined: Dict[str, str] = {normalize_question(k): v for k, v in predefined.items()}
+        self.fuzzy_max_distance = fuzzy_max_distance
+        self._words: Dict[str, Tuple[str, ...]] = {}
+        self._by_trigram: Dict[str, List[str]] = {}
+        if fuzzy_max_distance:
+            for question in predefined:
+                key = normalize_question(question)
+                self._words[key] = question_words(question)
+                for trigram in trigrams(key):
+                    self._by_trigram.setdefault(trigram, []).append(key)
+        patterns = (
+            [(kw.lower(), UNIVERSITY) for kw in university_keywords]
+            + [(name.lower(), OTHER_UNIVERSITY) for name in other_universities]
+            + [(alias.lower(), TOU) for alias in tou_aliases]
+        )
+        self.automaton = AhoCorasick(patterns)
+
+    def find_predefined(self, question: str) -> Optional[str]:
+        key = normalize_question(question)
+        answer = self.predefined.get(key)
+        if answer is not None or not self.fuzzy_max_distance:
+            return answer
+        # Допуск растёт с длиной вопроса: в коротких ключах опечатка меняет смысл
+        max_distance = min(self.fuzzy_max_distance, len(key) // 6)
+        if not max_distance:
+            return None
+        key_trigrams = trigrams(key)
+        shared: Counter = Counter()
+        for trigram in key_trigrams:
+            shared.update(self._by_trigram.get(trigram, ()))
+        min_shared = len(key_trigrams) - 3 * max_distance
+        words = question_words(question)
+        best: Optional[Tuple[int, str]] = None
+        for candidate, count in shared.items():
+            if count < min_shared or not self._similar_words(words, self._words[candidate]):
+                continue
+            distance = bounded_levenshtein(key, candidate, max_distance)
+            if distance is not None and (best is None or distance < best[0]):
+                best = (distance, candidate)
+        return self.predefined[best[1]] if best else None
+
+    @staticmethod
+    def _similar_words(words: Tuple[str, ...], candidate: Tuple[str, ...]) -> bool:
+        if len(words) != len(candidate):
+            return False
+        for word, other in zip(words, candidate):
+            if word == other:
+                continue
+            if NUMBER_RE.search(word) or NUMBER_RE.search(other) or bounded_levenshtein(word, other, 1) is None:
+                return False
+        return True
+
+    def classify(self, question: str) -> Classification:
+        return self.classify_keywords(question, self.find_predefined(question))
+
+    def classify_keywords(self, question: str, predefined: Optional[str]) -> Classification:
+        """Классификация по ключевым словам при уже найденном (или не найденном) заготовленном ответе."""
+        labels = self.automaton.labels(question.lower())
+        return Classification(
+            predefined=predefined,
+            is_university=UNIVERSITY in labels,
+            mentions_other_university=OTHER_UNIVERSITY in labels,
+            mentions_tou=TOU in labels,
+        )
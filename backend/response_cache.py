@@ -0,0 +1,339 @@
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+logger = logging.getLogger("tougpt")
+
+# Накладные расходы на запись (ключ, кортеж, узел OrderedDict), байт
+ENTRY_OVERHEAD = 200
+
+
+class ResponseCache:
+    """Потокобезопасный LRU-кеш ответов с TTL и ограничением по объёму в байтах.
+
+    get/put выполняются за O(1): OrderedDict хранит записи в порядке
+    использования, вытесняются самые давние. Ответы длиннее compress_min_bytes
+    хранятся сжатыми zlib, если это уменьшает размер.
+    """
+
+    # Операции не ждут ввода-вывода: их можно вызывать прямо из event loop
+    blocking = False
+
+    def __init__(self, max_bytes: int = 16 * 1024 * 1024, ttl: float = 300, compress_min_bytes: Optional[int] = 1024):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compress_min_bytes = compress_min_bytes
+        # ключ -> (значение, время истечения, размер записи)
+        self._entries: "OrderedDict[str, Tuple[Union[str, bytes], float, int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _encode(self, value: str) -> Union[str, bytes]:
+        raw = value.encode()
+        if self.compress_min_bytes is not None and len(raw) >= self.compress_min_bytes:
+            compressed = zlib.compress(raw)
+            if len(compressed) < len(raw):
+                return compressed
+        return value
+
+    @staticmethod
+    def _decode(stored: Union[str, bytes]) -> str:
+        return zlib.decompress(stored).decode() if isinstance(stored, bytes) else stored
+
+    @staticmethod
+    def _size(key: str, stored: Union[str, bytes]) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(stored) + ENTRY_OVERHEAD
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.time():
+                self._pop(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            stored = entry[0]
+        return self._decode(stored)
+
+    def put(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        stored = self._encode(value)
+        size = self._size(key, stored)
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._pop(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (stored, expires_at, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._pop(oldest)
+                self.evictions += 1
+
+    def _pop(self, key: str) -> None:
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self) -> int:
+        with self._lock:
+            old_size = len(self._entries)
+            self._entries.clear()
+            self._bytes = 0
+            self.generation += 1
+            return old_size
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SQLiteResponseCache:
+    """Кеш ответов в SQLite (режим WAL), общий для всех воркеров на хосте.
+
+    Тот же интерфейс, что у ResponseCache: ответы и очистка видны всем
+    процессам и переживают перезапуск. Вытеснение — по времени последнего
+    обращения (обновляется не чаще раза в touch_interval секунд, чтобы чтения
+    почти не писали в базу), объём учитывается в таблице meta.
+
+    Операции блокируют поток (blocking = True), поэтому приложение вызывает их
+    в пуле потоков. Ожидание чужой блокировки записи ограничено busy_timeout:
+    кеш — не источник истины, поэтому при конкуренции воркеров чтение
+    считается промахом, а запись пропускается.
+    """
+
+    blocking = True
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 300,
+        compress_min_bytes: Optional[int] = 1024,
+        touch_interval: float = 30,
+        busy_timeout: float = 0.1,
+        generation_check_interval: float = 1,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.compress_min_bytes = compress_min_bytes
+        self.touch_interval = touch_interval
+        self.busy_timeout = busy_timeout
+        self.generation_check_interval = generation_check_interval
+        self._generation = (0, -float("inf"))
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.busy = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        # Схема создаётся один раз при старте: здесь можно подождать дольше
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        try:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    compressed INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at);
+                CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+                INSERT OR IGNORE INTO meta (name, value) VALUES ('bytes', 0), ('generation', 0);
+            """)
+        finally:
+            conn.close()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @property
+    def generation(self) -> int:
+        """Счётчик очисток: позволяет воркерам сбрасывать свои локальные кеши.
+
+        Читается из базы не чаще раза в generation_check_interval секунд.
+        """
+        value, checked_at = self._generation
+        now = time.monotonic()
+        if now - checked_at >= self.generation_check_interval:
+            try:
+                value = self._meta("generation")
+            except sqlite3.OperationalError:
+                return value
+            self._generation = (value, now)
+        return value
+
+    def _meta(self, name: str) -> int:
+        return self._connection().execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            return self._get(key)
+        except sqlite3.OperationalError as e:
+            # База занята другим воркером дольше busy_timeout — считаем промахом
+            self.busy += 1
+            self.misses += 1
+            logger.warning(f"Кеш ответов SQLite недоступен для чтения: {e}")
+            return None
+
+    def _get(self, key: str) -> Optional[str]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT value, compressed, expires_at, accessed_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        now = time.time()
+        if row is not None and row[2] <= now:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE")
+                # Другой воркер мог обновить запись после SELECT — удаляем только истёкшую
+                freed = conn.execute(
+                    "DELETE FROM responses WHERE key = ? AND expires_at <= ? RETURNING size", (key, now)
+                ).fetchall()
+                if freed:
+                    conn.execute("UPDATE meta SET value = value - ? WHERE name = 'bytes'", (freed[0][0],))
+            self.expirations += 1
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        if now - row[3] >= self.touch_interval:
+            try:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            except sqlite3.OperationalError:
+                pass  # Время обращения нужно только для вытеснения
+        self.hits += 1
+        value, compressed = row[0], row[1]
+        return zlib.decompress(value).decode() if compressed else value.decode()
+
+    def put(self, key: str, value: str, ttl: Optional[float] = None) -> None:
+        raw = value.encode()
+        compressed = 0
+        if self.compress_min_bytes is not None and len(raw) >= self.compress_min_bytes:
+            packed = zlib.compress(raw)
+            if len(packed) < len(raw):
+                raw, compressed = packed, 1
+        size = len(key) + len(raw) + ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        conn = self._connection()
+        try:
+            self._put(conn, key, raw, compressed, expires_at, now, size)
+        except sqlite3.OperationalError as e:
+            # Запись в кеш необязательна: не ждём, пока другой воркер отпустит базу
+            self.busy += 1
+            logger.warning(f"Ответ не записан в кеш SQLite: {e}")
+
+    def _put(self, conn: sqlite3.Connection, key: str, raw: bytes, compressed: int, expires_at: float, now: float, size: int) -> None:
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._delete(conn, [key])
+            conn.execute(
+                "INSERT INTO responses (key, value, compressed, expires_at, accessed_at, size) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, raw, compressed, expires_at, now, size),
+            )
+            conn.execute("UPDATE meta SET value = value + ? WHERE name = 'bytes'", (size,))
+            total = self._meta("bytes")
+            if total > self.max_bytes:
+                self._evict(conn, total - self.max_bytes)
+
+    def _delete(self, conn: sqlite3.Connection, keys: List[str]) -> int:
+        freed = 0
+        for key in keys:
+            row = conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                freed += row[0]
+        if freed:
+            conn.execute("UPDATE meta SET value = value - ? WHERE name = 'bytes'", (freed,))
+        return freed
+
+    def _evict(self, conn: sqlite3.Connection, excess: int) -> None:
+        victims = []
+        freed = 0
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            victims.append(key)
+            freed += size
+            if freed >= excess:
+                break
+        self._delete(conn, victims)
+        self.evictions += len(victims)
+
+    def clear(self) -> int:
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            old_size = conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            conn.execute("DELETE FROM responses")
+            conn.execute("UPDATE meta SET value = 0 WHERE name = 'bytes'")
+            conn.execute("UPDATE meta SET value = value + 1 WHERE name = 'generation'")
+        # Своя очистка должна быть видна сразу, без ожидания generation_check_interval
+        self._generation = (self._generation[0], -float("inf"))
+        return old_size
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "entries": len(self),
+            "bytes": self._meta("bytes"),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "busy": self.busy,
+        }
+
+
+def create_response_cache(backend: str, path: str, max_bytes: int, ttl: float) -> Union[ResponseCache, SQLiteResponseCache]:
+    """Кеш ответов выбранного типа: memory (в процессе) или sqlite (общий для воркеров)."""
+    if backend == "sqlite":
+        return SQLiteResponseCache(path, max_bytes=max_bytes, ttl=ttl)
+    if backend != "memory":
+        raise ValueError(f"Неизвестный тип кеша ответов: {backend}")
+    return ResponseCache(max_bytes=max_bytes, ttl=ttl)
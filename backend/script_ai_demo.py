@@ -14,3 +14,60 @@ PROMPT = """
 
 Ответ:
 """
+
+BATCH_PROMPT = """
+Ты — AI-ассистент университета Торайгырова.
+1. Будь лаконичным, но информативным.
+2. Используй маркированные списки для перечислений.
+3. Форматируй ответ для удобства чтения.
+
+Ниже пронумерованный список независимых вопросов. Ответь на каждый по отдельности, в порядке номеров.
+Начинай ответ на каждый вопрос с отдельной строки вида «### N», где N — номер вопроса, и не пропускай номера.
+
+База знаний:
+{document_content}
+
+Вопросы:
+{user_queries}
+
+Ответы:
+"""
+
+# Ручная проверка промпта: python script_ai_demo.py
+if __name__ == "__main__":
+    import os
+    from dotenv import load_dotenv
+
+    load_dotenv()
+
+    # 1. Заглушка для базы знаний
+    document_content = """
+    Документы принимаются с 20 июня по 25 августа.
+    Стоимость обучения — 497 000 тенге в год.
+    Общежитие находится по адресу: Павлодар, ул. Ломова, 64/1.
+    """
+
+    # 2. Ввод пользователя
+    user_query = """
+    Когда начнётся приём документов?
+    Какова стоимость обучения в университете?
+    Где находится общежитие?
+    """
+
+    # 3. Генерация промпта
+    final_prompt = PROMPT.format(
+        document_content=document_content,
+        user_query=user_query
+    )
+    print(final_prompt)
+
+    # 4. Отправка в модель
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        print("Нет API-ключа, пропускаем ручной запуск")
+    else:
+        from main import llm_manager
+
+        model = llm_manager.get_llm(api_key)
+        response = model.invoke(final_prompt)
+        print(response.content.strip() if hasattr(response, "content") else str(response).strip())
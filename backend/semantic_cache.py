@@ -0,0 +1,187 @@
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import Dict, FrozenSet, Iterable, NamedTuple, Optional, Set, Tuple
+
+from knowledge_index import tokenize
+
+NUMBER_RE = re.compile(r"\d+")
+
+# Термы совпадают и тогда, когда один — начало другого («сто[ит]» и «стоим[ость]»),
+# если короткий не короче MIN_PREFIX_LEN и длинный длиннее не больше чем на MAX_EXTRA_CHARS
+MIN_PREFIX_LEN = 3
+MAX_EXTRA_CHARS = 3
+
+
+def numbers_in(text: str) -> FrozenSet[str]:
+    """Числа в вопросе: «корпус 1» и «корпус 2» близки по словам, но это разные вопросы."""
+    return frozenset(NUMBER_RE.findall(text))
+
+
+def term_key(term: str) -> str:
+    """Ключ индекса кандидатов: совпадающие термы (в том числе по началу) имеют общий ключ."""
+    return term[:MIN_PREFIX_LEN]
+
+
+def terms_match(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    short, long = (a, b) if len(a) <= len(b) else (b, a)
+    return len(short) >= MIN_PREFIX_LEN and len(long) - len(short) <= MAX_EXTRA_CHARS and long.startswith(short)
+
+
+class Entry(NamedTuple):
+    terms: FrozenSet[str]
+    numbers: FrozenSet[str]
+    answer: str
+    created_at: float
+
+
+class SemanticCache:
+    """Второй уровень кеша ответов: ответ на вопрос, сказанный другими словами.
+
+    Вопрос сводится к набору значимых термов (стемминг BM25-индекса без
+    стоп-слов и без ignore_terms — например, названия университета, которое
+    подразумевается во всех вопросах). Близость двух вопросов — доля веса
+    термов обоих вопросов, нашедших пару в другом (тот же терм или его
+    начало), где вес терма — IDF по вопросам в кеше: «сколько стоит обучение?»
+    и «какая стоимость обучения в ТОУ» совпадают полностью, а «очной» и
+    «заочной» или «информатика» и «математика» не совпадают, и редкий терм
+    без пары опускает близость ниже порога. Числа вопросов должны совпадать.
+
+    Сравниваются только вопросы к одной версии базы знаний. Кандидаты — записи,
+    в которых есть пара для двух самых редких термов вопроса (пересечение
+    списков инвертированного индекса, не больше max_candidates самых свежих),
+    поэтому поиск не просматривает весь кеш.
+    Хранится не больше capacity записей, старые и устаревшие вытесняются первыми.
+    """
+
+    def __init__(self, threshold: float = 0.9, capacity: int = 10000, ttl: float = 300, ignore_terms: Iterable[str] = (), max_candidates: int = 64):
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self.max_candidates = max_candidates
+        self.ignore_terms = frozenset(term for word in ignore_terms for term in tokenize(word))
+        self._entries: "OrderedDict[int, Tuple[str, Entry]]" = OrderedDict()
+        # Версия базы знаний -> ключ терма -> записи с таким термом
+        self._postings: Dict[str, Dict[str, Set[int]]] = {}
+        self._document_frequency: Counter = Counter()
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._hit_similarity_sum = 0.0
+        self.last_similarity = 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def terms(self, question: str) -> FrozenSet[str]:
+        return frozenset(term for term in tokenize(question) if term not in self.ignore_terms)
+
+    def _idf(self, term: str) -> float:
+        return math.log((len(self._entries) + 1) / (self._document_frequency[term] + 1)) + 1.0
+
+    def similarity(self, terms: FrozenSet[str], other: FrozenSet[str], weights: Optional[Dict[str, float]] = None) -> float:
+        """Доля IDF-веса термов обоих вопросов, у которых есть пара в другом вопросе.
+
+        weights — IDF уже встречавшихся термов (общий для всех кандидатов одного поиска).
+        """
+        weights = {} if weights is None else weights
+        total = covered = 0.0
+        for side, opposite in ((terms, other), (other, terms)):
+            for term in side:
+                weight = weights.get(term)
+                if weight is None:
+                    weight = weights[term] = self._idf(term)
+                total += weight
+                # Пару по началу терма ищем только для термов без точной пары
+                if term in opposite or any(terms_match(term, candidate) for candidate in opposite - side):
+                    covered += weight
+        return covered / total if total else 0.0
+
+    def get(self, question: str, version: str) -> Optional[str]:
+        """Ответ на достаточно близкий вопрос к той же версии базы знаний или None."""
+        terms = self.terms(question)
+        numbers = numbers_in(question)
+        deadline = time.time() - self.ttl
+        best_similarity = 0.0
+        best_answer = None
+        with self._lock:
+            postings = self._postings.get(version, {})
+            keys = sorted({term_key(term) for term in terms}, key=lambda key: len(postings.get(key, ())))
+            candidates: Set[int] = postings.get(keys[0], set()) if keys else set()
+            if len(keys) > 1:
+                candidates = candidates & postings.get(keys[1], set())
+            weights: Dict[str, float] = {}
+            for entry_id in sorted(candidates, reverse=True)[:self.max_candidates]:
+                entry = self._entries[entry_id][1]
+                if entry.created_at < deadline or entry.numbers != numbers:
+                    continue
+                similarity = self.similarity(terms, entry.terms, weights)
+                if similarity > best_similarity:
+                    best_similarity, best_answer = similarity, entry.answer
+            self.last_similarity = best_similarity
+            if best_answer is None or best_similarity < self.threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._hit_similarity_sum += best_similarity
+            return best_answer
+
+    def put(self, question: str, version: str, answer: str) -> None:
+        entry = Entry(self.terms(question), numbers_in(question), answer, time.time())
+        if not entry.terms:
+            return
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (version, entry)
+            postings = self._postings.setdefault(version, {})
+            for key in {term_key(term) for term in entry.terms}:
+                postings.setdefault(key, set()).add(entry_id)
+            self._document_frequency.update(entry.terms)
+            deadline = time.time() - self.ttl
+            while self._entries:
+                oldest_id, (_, oldest) = next(iter(self._entries.items()))
+                if len(self._entries) <= self.capacity and oldest.created_at >= deadline:
+                    break
+                self._evict(oldest_id)
+
+    def _evict(self, entry_id: int) -> None:
+        version, entry = self._entries.pop(entry_id)
+        postings = self._postings[version]
+        for key in {term_key(term) for term in entry.terms}:
+            ids = postings[key]
+            ids.discard(entry_id)
+            if not ids:
+                del postings[key]
+        if not postings:
+            del self._postings[version]
+        self._document_frequency.subtract(entry.terms)
+        for term in entry.terms:
+            if self._document_frequency[term] <= 0:
+                del self._document_frequency[term]
+
+    def clear(self) -> int:
+        with self._lock:
+            old_size = len(self._entries)
+            self._entries.clear()
+            self._postings.clear()
+            self._document_frequency.clear()
+            return old_size
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "versions": len(self._postings),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "avg_hit_similarity": round(self._hit_similarity_sum / self.hits, 4) if self.hits else 0.0,
+            "last_similarity": round(self.last_similarity, 4),
+            "threshold": self.threshold,
+        }
@@ -0,0 +1,221 @@
+import hashlib
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from knowledge_snapshot import estimate_tokens
+
+WORD_RE = re.compile(r"\w+")
+WHITESPACE_RE = re.compile(r"\s+")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?…])\s")
+
+# Вопрос понятен только вместе с предыдущими репликами, если он начинается
+# с союза («а сколько стоит общежитие?») или ссылается на сказанное ранее.
+# Указательные слова из устойчивых оборотов («в том числе», «те же», «им. ...»)
+# сюда не входят: они встречаются и в самостоятельных вопросах
+FOLLOW_UP_STARTS = {"а", "и", "но", "тогда", "ещё", "еще", "также", "тоже", "кстати"}
+FOLLOW_UP_WORDS = {
+    "он", "она", "оно", "они", "него", "неё", "нее", "нему", "ней", "ним", "них", "нём", "нем",
+    "там", "туда", "оттуда", "этот", "эта", "эти", "этих",
+}
+# Короткий вопрос без темы («сколько стоит?», «где это?») тоже считаем
+# продолжением, а короткий запрос по ключевым словам («гранты тоу») — нет
+MAX_FOLLOW_UP_WORDS = 3
+GENERIC_WORDS = {
+    "сколько", "стоит", "стоимость", "цена", "где", "когда", "как", "какой", "какая", "какие", "каких",
+    "почему", "зачем", "кто", "что", "это", "можно", "нужно", "надо", "есть", "ли",
+    "подробнее", "точнее", "сроки", "срок", "адрес", "телефон", "да", "нет",
+}
+
+
+def is_follow_up(question: str, has_topic: bool = False) -> bool:
+    """Похоже ли, что вопрос продолжает разговор, а не задан сам по себе.
+
+    has_topic — в вопросе есть собственная тема (ключевые слова университета),
+    тогда короткий вопрос считается самостоятельным.
+    """
+    words = WORD_RE.findall(question.lower())
+    if not words:
+        return False
+    if words[0] in FOLLOW_UP_STARTS or any(word in FOLLOW_UP_WORDS for word in words):
+        return True
+    return not has_topic and len(words) <= MAX_FOLLOW_UP_WORDS and all(word in GENERIC_WORDS for word in words)
+
+
+def clip(text: str, max_chars: int) -> str:
+    """Текст в одну строку, обрезанный по границе слова до max_chars символов."""
+    text = WHITESPACE_RE.sub(" ", text).strip()
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + "…"
+
+
+def first_sentence(text: str) -> str:
+    return SENTENCE_END_RE.split(WHITESPACE_RE.sub(" ", text).strip(), 1)[0]
+
+
+class Turn(NamedTuple):
+    """Реплика, хранимая дословно (вопрос и ответ обрезаны до answer_chars)."""
+    question: str
+    answer: str
+    mode: str
+    passage_ids: Tuple[str, ...]
+
+
+class SessionHistory(NamedTuple):
+    """История для промпта: текст в пределах бюджета токенов, фрагменты базы знаний
+    из прошлых ответов и отпечаток текста для ключа кеша."""
+    text: str
+    passage_ids: Tuple[str, ...]
+    digest: str
+    last_question: str
+    last_mode: str
+
+    def prompt_query(self, question: str) -> str:
+        """Вопрос вместе с историей разговора — подставляется в промпт вместо вопроса."""
+        return f"{question}\n\nПредыдущий разговор (для понимания вопроса, отвечай только на вопрос выше):\n{self.text}"
+
+
+class Session:
+    __slots__ = ("turns", "summaries", "passage_ids", "last_active")
+
+    def __init__(self, recent_turns: int, max_summaries: int):
+        # Лишняя реплика сверх recent_turns сразу сжимается в summaries
+        self.turns: Deque[Turn] = deque()
+        self.summaries: Deque[str] = deque(maxlen=max_summaries)
+        self.passage_ids: List[str] = []
+        self.last_active = time.monotonic()
+
+
+class SessionStore:
+    """Истории разговоров по идентификатору сессии с ограничением памяти.
+
+    Последние recent_turns реплик хранятся дословно, более старые сжимаются в
+    короткие выжимки (вопрос и первое предложение ответа, не больше
+    max_summaries), а фрагменты базы знаний из их ответов запоминаются по id
+    (не больше max_passages). Текст истории для промпта укладывается в
+    token_budget: старые выжимки отбрасываются первыми, поэтому промпт не
+    растёт, сколько бы ни длился разговор. Сессии без активности дольше
+    idle_ttl и сверх max_sessions (самые давние) удаляются. Работает в одном
+    event loop, блокировки не нужны.
+
+    Хранилище локально для процесса: при нескольких воркерах (uvicorn
+    --workers N) все запросы одной сессии должны обслуживаться одним
+    воркером, иначе история не найдётся и вопрос будет отвечен без неё.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 5000,
+        idle_ttl: float = 1800,
+        token_budget: int = 500,
+        recent_turns: int = 2,
+        max_summaries: int = 6,
+        max_passages: int = 6,
+        passages_per_turn: int = 2,
+        answer_chars: int = 600,
+        summary_chars: int = 200,
+    ):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.token_budget = token_budget
+        self.recent_turns = max(1, recent_turns)
+        self.max_summaries = max_summaries
+        self.max_passages = max_passages
+        self.passages_per_turn = passages_per_turn
+        self.answer_chars = answer_chars
+        self.summary_chars = summary_chars
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def _evict_idle(self, now: float) -> None:
+        # Сессии упорядочены по последней активности: давние — в начале
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_active < self.idle_ttl:
+                break
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def history(self, session_id: str) -> Optional[SessionHistory]:
+        """История сессии для следующего вопроса; None — сессии нет или она пуста."""
+        self._evict_idle(time.monotonic())
+        session = self._sessions.get(session_id)
+        if session is None or not session.turns:
+            return None
+        text = self._render(session)
+        last = session.turns[-1]
+        return SessionHistory(
+            text,
+            tuple(session.passage_ids),
+            hashlib.md5(text.encode()).hexdigest()[:16],
+            last.question,
+            last.mode,
+        )
+
+    def append(self, session_id: str, question: str, answer: str, mode: str, passage_ids: Sequence[str] = ()) -> None:
+        """Запоминает реплику; лишние старые реплики сжимаются в выжимки."""
+        now = time.monotonic()
+        self._evict_idle(now)
+        session = self._sessions.pop(session_id, None) or Session(self.recent_turns, self.max_summaries)
+        session.last_active = now
+        self._sessions[session_id] = session
+        turn_passages = tuple(passage_ids[:self.passages_per_turn])
+        session.turns.append(Turn(clip(question, self.answer_chars), clip(answer, self.answer_chars), mode, turn_passages))
+        while len(session.turns) > self.recent_turns:
+            old = session.turns.popleft()
+            session.summaries.append(clip(f"{old.question} — {first_sentence(old.answer)}", self.summary_chars))
+        # Свежие фрагменты впереди: при сборке контекста они получают бюджет первыми
+        retained = list(turn_passages) + [passage_id for passage_id in session.passage_ids if passage_id not in turn_passages]
+        session.passage_ids = retained[:self.max_passages]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+            self.evicted += 1
+
+    def _render(self, session: Session) -> str:
+        """Текст истории в пределах token_budget: последние реплики важнее старых выжимок."""
+        remaining = self.token_budget
+        recent: List[str] = []
+        for turn in reversed(session.turns):
+            block = f"Пользователь: {turn.question}\nАссистент: {turn.answer}"
+            tokens = estimate_tokens(block)
+            if tokens > remaining:
+                if not recent:
+                    # Последняя реплика нужна всегда — обрезаем её под бюджет
+                    recent.append(clip(block, remaining * 3))
+                break
+            recent.append(block)
+            remaining -= tokens
+        summaries: List[str] = []
+        if len(recent) == len(session.turns):
+            for summary in reversed(session.summaries):
+                line = f"- {summary}"
+                tokens = estimate_tokens(line)
+                if tokens > remaining:
+                    break
+                summaries.append(line)
+                remaining -= tokens
+        parts = []
+        if summaries:
+            parts.append("Ранее обсуждали:\n" + "\n".join(reversed(summaries)))
+        parts.append("\n".join(reversed(recent)))
+        return "\n".join(parts)
+
+    def clear(self, session_id: Optional[str] = None) -> None:
+        if session_id is None:
+            self._sessions.clear()
+        else:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "sessions": len(self._sessions),
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "history_token_budget": self.token_budget,
+            "evicted": self.evicted,
+        }
@@ -0,0 +1,53 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Tuple, Type
+
+
+class SingleFlight:
+    """Объединение одинаковых одновременных запросов: по ключу выполняется одна корутина.
+
+    Первый вызов с ключом запускает задачу, остальные ждут её результат (или
+    исключение). Отмена одного ожидающего не отменяет общую задачу.
+    Исключения из retry_on относятся только к вызвавшему (например, отказ
+    в допуске по его квоте): ожидающие их не получают, а повторяют вызов
+    сами — первый из них становится новым ведущим со своей func.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.leaders = 0
+        self.deduplicated = 0
+        self.retried = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[Any]], retry_on: Tuple[Type[BaseException], ...] = ()) -> Any:
+        while True:
+            future = self._inflight.get(key)
+            # Завершённая задача ещё может быть в словаре: колбэк удаления выполняется позже
+            if future is None or future.done():
+                break
+            self.deduplicated += 1
+            try:
+                return await asyncio.shield(future)
+            except retry_on:
+                self.retried += 1
+        self.leaders += 1
+        future = asyncio.ensure_future(func())
+        self._inflight[key] = future
+        future.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(future)
+
+    def _forget(self, key: str, future: asyncio.Future) -> None:
+        # По ключу уже может выполняться задача нового ведущего
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "in_flight": self.in_flight,
+            "leaders": self.leaders,
+            "deduplicated": self.deduplicated,
+            "retried": self.retried,
+        }
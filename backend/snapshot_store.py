@@ -0,0 +1,53 @@
+import logging
+import mmap
+import os
+import pickle
+import tempfile
+from typing import Optional
+
+from knowledge_snapshot import KnowledgeSnapshot
+
+logger = logging.getLogger("tougpt")
+
+# Версия формата файла: при изменении структуры снимка старые файлы игнорируются
+SNAPSHOT_FORMAT = 2
+
+
+class SnapshotStore:
+    """Локальный файл с последним удачным снимком базы знаний (вместе с индексом).
+
+    Снимок сохраняется pickle (протокол 5) атомарной заменой файла и читается
+    через mmap, без промежуточного чтения всего файла в память.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def load(self) -> Optional[KnowledgeSnapshot]:
+        try:
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                payload = pickle.loads(data)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать снимок базы знаний {self.path}: {e}")
+            return None
+        if not isinstance(payload, dict) or payload.get("format") != SNAPSHOT_FORMAT:
+            logger.warning(f"Снимок базы знаний {self.path} в устаревшем формате, пропускаем")
+            return None
+        return payload["snapshot"]
+
+    def save(self, snapshot: KnowledgeSnapshot) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".snapshot-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump({"format": SNAPSHOT_FORMAT, "snapshot": snapshot}, f, protocol=5)
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as e:
+            logger.error(f"Не удалось сохранить снимок базы знаний {self.path}: {e}")
@@ -0,0 +1,4 @@
+"""Тесты бэкенда на фейках из benchmarks, без сети, MongoDB и ключей Gemini.
+
+Запуск из каталога backend: python -m pytest tests
+"""
@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionRejected, FairScheduler
+from single_flight import SingleFlight
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_round_robin_between_clients():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=1, max_queue=10, max_queue_per_client=10)
+        order = []
+
+        async def call(client_id, n):
+            async with scheduler.slot(client_id):
+                order.append(f"{client_id}{n}")
+                await asyncio.sleep(0.01)
+
+        blocker = asyncio.ensure_future(call("x", 0))
+        await asyncio.sleep(0)
+        tasks = [asyncio.ensure_future(call("a", n)) for n in range(3)]
+        tasks.append(asyncio.ensure_future(call("b", 0)))
+        await asyncio.gather(blocker, *tasks)
+        return order, scheduler
+
+    order, scheduler = run(scenario())
+    # Второй клиент не ждёт, пока обслужат все запросы первого
+    assert order == ["x0", "a0", "b0", "a1", "a2"]
+    assert scheduler.active == 0 and scheduler.stats()["queued"] == 0
+
+
+def test_per_client_queue_limit_rejects_only_that_client():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=1, max_queue=10, max_queue_per_client=1)
+        gate = asyncio.Event()
+
+        async def call(client_id):
+            async with scheduler.slot(client_id):
+                await gate.wait()
+
+        running = [asyncio.ensure_future(call("a")), asyncio.ensure_future(call("a")), asyncio.ensure_future(call("b"))]
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await call("a")
+        gate.set()
+        await asyncio.gather(*running)
+        return rejected.value, scheduler
+
+    rejected, scheduler = run(scenario())
+    assert rejected.retry_after >= 1
+    assert scheduler.stats()["rejected"] == 1
+    assert scheduler.admitted == 3
+
+
+def test_queue_wait_timeout_and_cancelled_waiter_free_their_place():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=1, max_queue=10, max_queue_per_client=10, max_wait=0.05)
+        gate = asyncio.Event()
+
+        async def call(client_id):
+            async with scheduler.slot(client_id):
+                await gate.wait()
+
+        holder = asyncio.ensure_future(call("a"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            await call("b")
+        cancelled = asyncio.ensure_future(call("c"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.gather(cancelled, return_exceptions=True)
+        gate.set()
+        await holder
+        return scheduler
+
+    scheduler = run(scenario())
+    assert scheduler.timed_out == 1
+    assert scheduler.active == 0 and scheduler.stats()["queued"] == 0
+
+
+def test_single_flight_deduplicates_concurrent_calls():
+    async def scenario():
+        flight = SingleFlight()
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "ответ"
+
+        results = await asyncio.gather(*(flight.do("ключ", work) for _ in range(5)))
+        return results, calls, flight
+
+    results, calls, flight = run(scenario())
+    assert results == ["ответ"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 0, "leaders": 1, "deduplicated": 4, "retried": 0}
+
+
+def test_follower_is_not_rejected_for_leader_quota():
+    """Отказ ведущему клиенту не достаётся ожидающему: тот повторяет вызов со своей квотой."""
+    async def scenario():
+        scheduler = FairScheduler(max_concurrency=1, max_queue=10, max_queue_per_client=1)
+        flight = SingleFlight()
+        gate = asyncio.Event()
+
+        async def occupy(client_id):
+            async with scheduler.slot(client_id):
+                await gate.wait()
+
+        async def answer(client_id):
+            # Подготовка промпта: ожидающий успевает присоединиться к ведущему
+            await asyncio.sleep(0.01)
+            async with scheduler.slot(client_id):
+                return f"ответ для {client_id}"
+
+        # Клиент 1.1.1.1 исчерпал свою очередь, место в LLM занято
+        busy = [asyncio.ensure_future(occupy("1.1.1.1")), asyncio.ensure_future(occupy("1.1.1.1"))]
+        await asyncio.sleep(0)
+        leader = asyncio.ensure_future(flight.do("вопрос", lambda: answer("1.1.1.1"), retry_on=(AdmissionRejected,)))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flight.do("вопрос", lambda: answer("2.2.2.2"), retry_on=(AdmissionRejected,)))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            await leader
+        await asyncio.sleep(0.02)
+        gate.set()
+        result = await follower
+        await asyncio.gather(*busy)
+        return result, flight
+
+    result, flight = run(scenario())
+    assert result == "ответ для 2.2.2.2"
+    assert flight.retried == 1 and flight.leaders == 2
+
+
+def test_single_flight_shares_other_errors():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("сбой")
+
+        return await asyncio.gather(*(flight.do("ключ", fail, retry_on=(AdmissionRejected,)) for _ in range(3)), return_exceptions=True)
+
+    errors = run(scenario())
+    assert all(isinstance(error, ValueError) for error in errors)
@@ -0,0 +1,44 @@
+from batch_answers import BatchItem, format_questions, group_context, group_items, split_batch_answer
+from context_builder import Context
+from knowledge_snapshot import Passage
+
+
+def passage(passage_id, tokens=100):
+    return Passage(passage_id, f"Текст фрагмента {passage_id}", tokens, passage_id)
+
+
+def item(position, passage_ids, tokens=100):
+    passages = [passage(passage_id, tokens) for passage_id in passage_ids]
+    context = Context("\n\n".join(p.text for p in passages), passages, f"v:{position}")
+    return BatchItem(position, f"вопрос {position}", f"вопрос {position}", context, f"key-{position}", context)
+
+
+def test_split_batch_answer_by_headers():
+    text = "Вступление\n### 1\nПервый ответ\n\n### 3.\nТретий ответ\n### 2)\nВторой\n### 3\nповтор\n### 9\nлишний"
+    assert split_batch_answer(text, 3) == ["Первый ответ", "Второй", "Третий ответ"]
+
+
+def test_split_batch_answer_missing_and_empty():
+    assert split_batch_answer("### 1\n\n### 2\nОтвет", 3) == [None, "Ответ", None]
+    assert split_batch_answer("Ответ без заголовков", 2) == [None, None]
+
+
+def test_format_questions_numbers_from_one():
+    assert format_questions(["а", "б"]) == "1. а\n2. б"
+
+
+def test_group_items_shares_passages_within_budget():
+    items = [item(0, ["a", "b"]), item(1, ["a", "c"]), item(2, ["d", "e"]), item(3, ["f", "g"])]
+    groups = group_items(items, token_budget=400, max_per_group=5)
+    assert [[i.position for i in group] for group in groups] == [[0, 1], [2, 3]]
+    assert group_context(groups[0]).count("Текст фрагмента a") == 1
+
+
+def test_group_items_respects_group_size():
+    items = [item(n, ["a"]) for n in range(7)]
+    assert [len(group) for group in group_items(items, token_budget=3000, max_per_group=3)] == [3, 3, 1]
+
+
+def test_group_items_oversized_item_gets_own_group():
+    items = [item(0, ["a"]), item(1, ["b"], tokens=5000)]
+    assert len(group_items(items, token_budget=1000, max_per_group=5)) == 2
@@ -0,0 +1,26 @@
+import pytest
+
+from knowledge_index import InvertedIndex, tokenize
+
+PARADIGMS = [
+    "университет университета университету университетом университете университеты университетов университетах",
+    "факультет факультета факультету факультетом факультете факультеты факультетов",
+    "общежитие общежития общежитию общежитием общежитии общежитиях общежитиям общежитиями",
+    "стипендия стипендии стипендию стипендией стипендиям стипендиях стипендиями",
+    "поступление поступления поступлению поступлением поступлении поступлениях поступлениям",
+    "стоимость стоимости стоимостью стоимостей",
+]
+
+
+@pytest.mark.parametrize("forms", PARADIGMS)
+def test_noun_paradigm_collapses_to_one_term(forms):
+    assert len(set(tokenize(forms))) == 1
+
+
+def test_stop_words_are_dropped():
+    assert tokenize("Сколько стоит обучение в ТОУ?") == ["сто", "обуч", "тоу"]
+
+
+def test_search_matches_other_case():
+    index = InvertedIndex({"dorm": "Общежитие предоставляется всем студентам", "fee": "Стоимость обучения"})
+    assert index.search("места в общежитии", 1)[0][0] == "dorm"
@@ -0,0 +1,109 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from benchmarks.fakes import FakeCollection, synthetic_documents
+from knowledge_refresher import KnowledgeRefresher
+from knowledge_snapshot import KnowledgeSnapshot
+
+
+class SnapshotManager:
+    """Минимальный менеджер базы знаний: снимок коллекции, apply_changes и reload, как у MongoDBKnowledgeManager."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.snapshot = KnowledgeSnapshot.from_documents(collection.find({}))
+        self.reloads = 0
+
+    def apply_changes(self, upserts=(), deleted_ids=()):
+        self.snapshot = self.snapshot.with_changes(upserts, deleted_ids)
+
+    def reload(self):
+        self.reloads += 1
+        self.snapshot = KnowledgeSnapshot.from_documents(self.collection.find({}))
+
+
+def full_snapshot(docs):
+    return KnowledgeSnapshot.from_documents(FakeCollection(docs).find({}))
+
+
+@pytest.fixture
+def docs():
+    return synthetic_documents(20, vocabulary_size=500)
+
+
+@pytest.fixture
+def manager(docs):
+    return SnapshotManager(FakeCollection(docs))
+
+
+def later(doc, seconds=3600):
+    return doc["updated_at"] + timedelta(seconds=seconds)
+
+
+def test_fake_find_supports_or_and_gt(docs):
+    collection = FakeCollection(docs)
+    found = list(collection.find({"$or": [{"_id": {"$gt": 17}}, {"updated_at": {"$gt": later(docs[0], 0)}}]}))
+    assert [doc["_id"] for doc in found] == list(range(1, 20))
+    with pytest.raises(NotImplementedError):
+        list(collection.find({"$where": "true"}))
+
+
+def test_poll_once_without_changes(manager):
+    assert KnowledgeRefresher(manager).poll_once() == 0
+
+
+def test_poll_once_picks_up_inserts_and_updates(docs, manager):
+    docs.append({"_id": 20, "title": "Общежитие", "content": "Места в общежитии", "updated_at": later(docs[-1])})
+    docs[3] = dict(docs[3], content="Новый текст раздела", updated_at=later(docs[-1], 7200))
+    refresher = KnowledgeRefresher(manager)
+    assert refresher.poll_once() == 2
+    assert manager.snapshot.docs[20]["title"] == "Общежитие"
+    assert manager.snapshot.docs[3]["content"] == "Новый текст раздела"
+    assert manager.snapshot.version == full_snapshot(docs).version
+    assert refresher.poll_once() == 0
+
+
+def test_change_events_match_full_reload(docs, manager):
+    refresher = KnowledgeRefresher(manager)
+    inserted = {"_id": 20, "title": "Стипендия", "content": "Размер стипендии", "updated_at": later(docs[-1])}
+    updated = dict(docs[5], content="Обновлённый раздел")
+    refresher.apply_change_event({"operationType": "insert", "documentKey": {"_id": 20}, "fullDocument": inserted})
+    refresher.apply_change_event({"operationType": "update", "documentKey": {"_id": 5}, "fullDocument": updated})
+    refresher.apply_change_event({"operationType": "delete", "documentKey": {"_id": 7}})
+    # Документ удалили до updateLookup — событие обновления без fullDocument
+    refresher.apply_change_event({"operationType": "update", "documentKey": {"_id": 8}, "fullDocument": None})
+    docs[5] = updated
+    expected = [doc for doc in docs if doc["_id"] not in (7, 8)] + [inserted]
+    full = full_snapshot(expected)
+    assert manager.snapshot.version == full.version
+    assert set(manager.snapshot.passages) == set(full.passages)
+    assert manager.snapshot.index.search("размер стипендии", 1) == full.index.search("размер стипендии", 1)
+    assert manager.reloads == 0
+    refresher.apply_change_event({"operationType": "drop"})
+    assert manager.reloads == 1
+
+
+def test_resync_reloads_deletions(docs, manager):
+    del docs[0]
+    refresher = KnowledgeRefresher(manager)
+    refresher._resume_token = "stale"
+    refresher._resync()
+    assert refresher._resume_token is None
+    assert 0 not in manager.snapshot.docs
+    assert manager.snapshot.version == full_snapshot(docs).version
+
+
+def test_falls_back_to_polling_on_standalone(docs, manager):
+    refresher = KnowledgeRefresher(manager, poll_interval=0.01)
+    refresher.start()
+    try:
+        docs.append({"_id": 20, "title": "Кампус", "content": "Карта кампуса", "updated_at": datetime(2030, 1, 1)})
+        deadline = time.time() + 5
+        while 20 not in manager.snapshot.docs and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        refresher.stop(timeout=2)
+    assert not refresher._use_change_stream
+    assert 20 in manager.snapshot.docs
@@ -0,0 +1,130 @@
+import asyncio
+import time
+
+import pytest
+
+from benchmarks.fakes import FakeMessage
+from llm_pool import CircuitBreaker, LLMPool, LLMUnavailableError, error_status, is_failover_error
+
+
+class StatusError(Exception):
+    def __init__(self, code):
+        super().__init__(f"ошибка {code}")
+        self.code = code
+
+
+class ScriptedLLM:
+    """Клиент, который выполняет заранее заданные шаги: ответ, исключение или «зависание»."""
+
+    def __init__(self, *steps):
+        self.steps = list(steps)
+        self.calls = 0
+
+    async def _step(self):
+        self.calls += 1
+        step = self.steps.pop(0) if self.steps else "ok"
+        if step == "hang":
+            await asyncio.sleep(3600)
+        if isinstance(step, BaseException):
+            raise step
+        return step
+
+    async def ainvoke(self, prompt):
+        return FakeMessage(await self._step())
+
+    async def astream(self, prompt):
+        text = await self._step()
+        for word in text.split():
+            yield FakeMessage(word)
+            await asyncio.sleep(0)
+
+
+def make_pool(clients, **options):
+    options = {"failure_threshold": 1, "reset_timeout": 0.05, "max_queue_wait": 0.2, "rate_per_minute": 6000, **options}
+    return LLMPool(list(clients), ["model"], lambda api_key, model: clients[api_key], **options)
+
+
+def open_breaker(pool):
+    """Первый запрос получает 429 и открывает предохранитель единственного слота."""
+    with pytest.raises(LLMUnavailableError):
+        asyncio.run(pool.ainvoke("вопрос"))
+    breaker = pool.slots_for()[0].breaker
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.06)
+    return breaker
+
+
+def test_breaker_release_trial_is_neither_success_nor_failure():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+    breaker.release_trial()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+
+
+def test_trial_with_request_error_is_released():
+    client = ScriptedLLM(StatusError(429), StatusError(400), "ok")
+    pool = make_pool({"key-1": client})
+    breaker = open_breaker(pool)
+    # 400 — ошибка запроса: пробрасывается без переключения, но пробный запрос освобождается
+    with pytest.raises(StatusError):
+        asyncio.run(pool.ainvoke("вопрос"))
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert asyncio.run(pool.ainvoke("вопрос")).content == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cancelled_trial_is_released():
+    client = ScriptedLLM(StatusError(429), "hang", "ok")
+    pool = make_pool({"key-1": client})
+    breaker = open_breaker(pool)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(asyncio.wait_for(pool.ainvoke("вопрос"), timeout=0.05))
+    assert pool.slots_for()[0].in_flight == 0
+    assert asyncio.run(pool.ainvoke("вопрос")).content == "ok"
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_stream_closed_during_trial_is_released():
+    client = ScriptedLLM(StatusError(429), "первый второй третий", "ok")
+    pool = make_pool({"key-1": client})
+    breaker = open_breaker(pool)
+
+    async def read_first_chunk():
+        stream = pool.astream("вопрос")
+        chunk = await stream.__anext__()
+        await stream.aclose()
+        return chunk.content
+
+    assert asyncio.run(read_first_chunk()) == "первый"
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert asyncio.run(pool.ainvoke("вопрос")).content == "ok"
+
+
+def test_rate_limit_fails_over_to_another_key():
+    first, second = ScriptedLLM(StatusError(429)), ScriptedLLM("ok")
+    pool = make_pool({"key-1": first, "key-2": second})
+    assert asyncio.run(pool.ainvoke("вопрос")).content == "ok"
+    assert (first.calls, second.calls) == (1, 1)
+
+
+def test_request_error_does_not_fail_over():
+    first, second = ScriptedLLM(StatusError(400)), ScriptedLLM(StatusError(400))
+    pool = make_pool({"key-1": first, "key-2": second})
+    with pytest.raises(StatusError):
+        asyncio.run(pool.ainvoke("вопрос"))
+    assert first.calls + second.calls == 1
+    assert all(slot.breaker.state == CircuitBreaker.CLOSED for slot in pool.slots_for())
+
+
+def test_error_status_ignores_numbers_in_message():
+    assert error_status(Exception("ответ длиннее 5000 токенов")) is None
+    wrapped = RuntimeError("обёртка")
+    wrapped.__cause__ = StatusError(503)
+    assert error_status(wrapped) == 503
+    assert is_failover_error(wrapped)
+    assert is_failover_error(asyncio.TimeoutError())
+    assert not is_failover_error(StatusError(400))
@@ -0,0 +1,62 @@
+import time
+
+from query_log import QueryLog
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_record_does_not_write_file(tmp_path):
+    path = tmp_path / "log.tsv"
+    log = QueryLog(str(path), flush_every=2)
+    for n in range(5):
+        log.record(f"вопрос {n}", f"Вопрос {n}?")
+    # Без фонового потока record только копит записи
+    assert not path.exists()
+    log.flush()
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 5
+
+
+def test_background_thread_flushes_after_flush_every(tmp_path):
+    path = tmp_path / "log.tsv"
+    log = QueryLog(str(path), flush_interval=60, flush_every=3)
+    log.start()
+    try:
+        log.record("один", "Один?")
+        log.record("два", "Два?")
+        time.sleep(0.05)
+        assert not path.exists()
+        log.record("три", "Три?")
+        assert wait_for(path.exists)
+    finally:
+        log.stop(timeout=2)
+
+
+def test_background_thread_flushes_by_interval_and_on_stop(tmp_path):
+    path = tmp_path / "log.tsv"
+    log = QueryLog(str(path), flush_interval=0.05)
+    log.start()
+    log.record("один", "Один?")
+    assert wait_for(path.exists)
+    log.record("два", "Два?")
+    log.stop(timeout=2)
+    assert [line.split("\t")[1] for line in path.read_text(encoding="utf-8").splitlines()] == ["один", "два"]
+
+
+def test_top_sums_lines_and_compact_keeps_most_frequent(tmp_path):
+    path = tmp_path / "log.tsv"
+    log = QueryLog(str(path), max_entries=2)
+    for normalized, times in (("стоимость обучения", 3), ("общежитие", 2), ("гранты", 1)):
+        for _ in range(times):
+            log.record(normalized, f"  {normalized}\tтекст? ")
+            log.flush()
+    assert log.top(2) == [("стоимость обучения", "стоимость обучения текст?", 3), ("общежитие", "общежитие текст?", 2)]
+    assert log.compact() == 2
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 2
+    assert log.top(5)[0][2] == 3
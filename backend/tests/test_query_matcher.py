@@ -0,0 +1,64 @@
+import pytest
+
+from query_matcher import AhoCorasick, QueryMatcher, bounded_levenshtein, normalize_question
+
+PREDEFINED = {
+    "Где находится корпус 1?": "Корпус 1 — ул. Ломова, 64.",
+    "Где находится корпус 2?": "Корпус 2 — ул. Ломова, 66.",
+    "Какие документы нужны для обучения?": "Удостоверение личности и аттестат.",
+}
+
+
+def make_matcher(fuzzy_max_distance=0):
+    return QueryMatcher(
+        PREDEFINED,
+        university_keywords=["общежитие", "грант", "поступлен"],
+        other_universities=["назарбаев", "кбту"],
+        tou_aliases=["тоу", "торайгыров"],
+        fuzzy_max_distance=fuzzy_max_distance,
+    )
+
+
+def test_normalize_question():
+    assert normalize_question("  Где находится Корпус 1?! ") == "гденаходитсякорпус1"
+    assert normalize_question("Ещё") == normalize_question("еще")
+
+
+def test_aho_corasick_finds_overlapping_patterns():
+    automaton = AhoCorasick([("he", "a"), ("she", "b"), ("hers", "c"), ("x", "d")])
+    assert automaton.labels("ushers") == {"a", "b", "c"}
+    assert automaton.labels("") == set()
+
+
+@pytest.mark.parametrize("a, b, max_distance, expected", [
+    ("обучение", "обучение", 1, 0),
+    ("обучение", "обученее", 1, 1),
+    ("обучения", "общения", 1, None),
+    ("корпус", "корпуса", 1, 1),
+    ("abc", "abcdef", 2, None),
+])
+def test_bounded_levenshtein(a, b, max_distance, expected):
+    assert bounded_levenshtein(a, b, max_distance) == expected
+
+
+def test_exact_predefined_only_by_default():
+    matcher = make_matcher()
+    assert matcher.find_predefined("где находится КОРПУС 1") == "Корпус 1 — ул. Ломова, 64."
+    assert matcher.find_predefined("Где находиться корпус 1?") is None
+
+
+def test_fuzzy_predefined_tolerates_typos_but_not_other_numbers_or_words():
+    matcher = make_matcher(fuzzy_max_distance=2)
+    assert matcher.find_predefined("Где находиться корпус 2?") == "Корпус 2 — ул. Ломова, 66."
+    assert matcher.find_predefined("Где находится корпус 3?") is None
+    assert matcher.find_predefined("Какие документы нужны для общения?") is None
+    assert matcher.find_predefined("Какие документы нужны для обученя?") == "Удостоверение личности и аттестат."
+
+
+def test_classify_in_one_pass():
+    matcher = make_matcher()
+    result = matcher.classify("Есть ли общежитие в ТОУ, как в КБТУ?")
+    assert (result.predefined, result.is_university, result.mentions_tou, result.mentions_other_university) == (None, True, True, True)
+    result = matcher.classify("Как приготовить плов?")
+    assert not (result.is_university or result.mentions_tou or result.mentions_other_university)
+    assert matcher.classify("Где находится корпус 1").predefined == "Корпус 1 — ул. Ломова, 64."
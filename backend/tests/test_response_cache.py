@@ -0,0 +1,119 @@
+import sqlite3
+import time
+
+import pytest
+
+from response_cache import ENTRY_OVERHEAD, ResponseCache, SQLiteResponseCache, create_response_cache
+
+
+def test_memory_cache_lru_eviction_by_bytes():
+    cache = ResponseCache(max_bytes=10**6)
+    size = ResponseCache._size("k0", "x" * 100)
+    cache.max_bytes = size * 3
+    for n in range(3):
+        cache.put(f"k{n}", "x" * 100)
+    # k0 использован недавно, поэтому вытесняется k1
+    assert cache.get("k0") is not None
+    cache.put("k3", "x" * 100)
+    assert cache.get("k1") is None
+    assert [cache.get(key) is not None for key in ("k0", "k2", "k3")] == [True, True, True]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= cache.max_bytes
+
+
+def test_memory_cache_ttl_and_per_entry_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("response_cache.time.time", lambda: now[0])
+    cache = ResponseCache(ttl=10)
+    cache.put("short", "ответ")
+    cache.put("long", "ответ", ttl=100)
+    now[0] += 11
+    assert cache.get("short") is None
+    assert cache.get("long") == "ответ"
+    assert cache.stats()["expirations"] == 1
+
+
+def test_memory_cache_compresses_long_answers_transparently():
+    cache = ResponseCache(compress_min_bytes=1024)
+    answer = "Стоимость обучения составляет 500 000 тенге. " * 100
+    cache.put("k", answer)
+    assert isinstance(cache._entries["k"][0], bytes)
+    assert cache.get("k") == answer
+    cache.put("short", "короткий")
+    assert cache._entries["short"][0] == "короткий"
+
+
+def test_memory_cache_skips_oversized_and_replaces_existing():
+    cache = ResponseCache(max_bytes=1000, compress_min_bytes=None)
+    cache.put("k", "старый")
+    cache.put("k", "новый")
+    assert cache.get("k") == "новый" and len(cache) == 1
+    cache.put("big", "x" * 5000)
+    assert cache.get("big") is None
+
+
+def test_memory_cache_clear_bumps_generation():
+    cache = ResponseCache()
+    cache.put("k", "ответ")
+    assert cache.clear() == 1
+    assert cache.generation == 1 and len(cache) == 0 and cache.stats()["bytes"] == 0
+
+
+def test_create_response_cache_rejects_unknown_backend(tmp_path):
+    assert isinstance(create_response_cache("memory", str(tmp_path / "c.sqlite3"), 1024, 60), ResponseCache)
+    with pytest.raises(ValueError):
+        create_response_cache("redis", str(tmp_path / "c.sqlite3"), 1024, 60)
+
+
+def test_sqlite_cache_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    first = create_response_cache("sqlite", path, 10**6, 60)
+    second = create_response_cache("sqlite", path, 10**6, 60)
+    answer = "Общежитие стоит 10 000 тенге в месяц. " * 50
+    first.put("k", answer)
+    assert second.get("k") == answer
+    assert len(second) == 1
+    # Очистка в одном воркере видна другому через счётчик поколений
+    generation = second.generation
+    assert first.clear() == 1
+    second.generation_check_interval = 0
+    assert second.generation == generation + 1
+    assert second.get("k") is None
+
+
+def test_sqlite_cache_expiry_and_eviction(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("response_cache.time.time", lambda: now[0])
+    cache = SQLiteResponseCache(str(tmp_path / "cache.sqlite3"), max_bytes=10**6, ttl=10, compress_min_bytes=None)
+    cache.put("short", "ответ")
+    cache.put("long", "ответ", ttl=100)
+    now[0] += 11
+    assert cache.get("short") is None and cache.get("long") == "ответ"
+    assert cache.stats()["expirations"] == 1
+    size = len("k0") + len("x" * 100) + ENTRY_OVERHEAD
+    cache.clear()
+    cache.max_bytes = size * 3
+    for n in range(4):
+        now[0] += 1
+        cache.put(f"k{n}", "x" * 100)
+    assert cache.get("k0") is None
+    assert all(cache.get(f"k{n}") is not None for n in range(1, 4))
+    assert cache.stats()["bytes"] == size * 3
+
+
+def test_sqlite_cache_does_not_wait_for_a_locked_database(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SQLiteResponseCache(path, busy_timeout=0.05)
+    cache.put("k", "ответ")
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN EXCLUSIVE")
+    try:
+        started = time.monotonic()
+        cache.put("new", "ответ")
+        assert time.monotonic() - started < 1
+        assert cache.stats()["busy"] >= 1
+    finally:
+        other.execute("ROLLBACK")
+        other.close()
+    assert cache.get("new") is None
+    assert cache.get("k") == "ответ"
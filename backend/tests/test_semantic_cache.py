@@ -0,0 +1,51 @@
+import pytest
+
+from semantic_cache import SemanticCache
+
+UNIVERSITY_NAMES = ("университет", "тоу", "торайгырова")
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache(ignore_terms=UNIVERSITY_NAMES)
+    # Посторонние вопросы задают частоты термов для IDF
+    for n in range(30):
+        cache.put(f"расписание занятий группы {n} по предмету", "v1", "расписание")
+    return cache
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Сколько стоит обучение?", "какая стоимость обучения в ТОУ"),
+    ("Сколько стоит обучение?", "сколько стоит обучение в тоу?"),
+    ("сколько стоит обучение в университете?", "стоимость обучения в университете сколько"),
+])
+def test_paraphrase_hits(cache, cached, asked):
+    cache.put(cached, "v1", "ответ")
+    assert cache.get(asked, "v1") == "ответ"
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("сколько стоит обучение на очной форме факультета энергетики", "сколько стоит обучение на заочной форме факультета энергетики"),
+    ("поступить в магистратуру по специальности информатика", "поступить в магистратуру по специальности математика"),
+    ("Когда приём у студентов кафедры энергетика?", "Когда студент у студентов кафедры энергетика?"),
+    ("где находится корпус 1", "где находится корпус 2"),
+])
+def test_different_question_misses(cache, cached, asked):
+    cache.put(cached, "v1", "ответ")
+    assert cache.get(asked, "v1") is None
+
+
+def test_other_knowledge_version_misses(cache):
+    cache.put("Сколько стоит обучение?", "v1", "ответ")
+    assert cache.get("Сколько стоит обучение?", "v2") is None
+
+
+def test_eviction_keeps_index_consistent():
+    cache = SemanticCache(capacity=3)
+    for n in range(5):
+        cache.put(f"вопрос про общежитие номер {n}", "v1", str(n))
+    assert len(cache) == 3
+    assert cache.get("вопрос про общежитие номер 0", "v1") is None
+    assert cache.get("вопрос про общежитие номер 4", "v1") == "4"
+    cache.clear()
+    assert len(cache) == 0 and cache.stats()["versions"] == 0
@@ -0,0 +1,64 @@
+import pytest
+
+from sessions import SessionStore, clip, is_follow_up
+
+
+@pytest.mark.parametrize("question, has_topic, expected", [
+    ("а сколько стоит общежитие?", True, True),
+    ("где он находится?", False, True),
+    ("сколько стоит?", False, True),
+    ("гранты тоу", True, False),
+    ("Какие документы нужны для поступления в магистратуру?", True, False),
+    ("в том числе для иностранцев", False, False),
+    ("", False, False),
+])
+def test_is_follow_up(question, has_topic, expected):
+    assert is_follow_up(question, has_topic) is expected
+
+
+def test_clip_cuts_on_word_boundary():
+    assert clip("один  два\nтри", 100) == "один два три"
+    assert clip("один два три", 9) == "один два…"
+
+
+def test_history_keeps_recent_turns_and_summarizes_older():
+    store = SessionStore(recent_turns=2, token_budget=1000)
+    assert store.history("s") is None
+    store.append("s", "Сколько стоит обучение?", "Обучение стоит 500 000 тенге. Оплата по семестрам.", "university", ["p1", "p2", "p3"])
+    store.append("s", "А общежитие?", "Общежитие стоит 10 000 тенге.", "university", ["p4"])
+    store.append("s", "Где оно?", "На улице Ломова.", "university", ["p5"])
+    history = store.history("s")
+    assert history.text.startswith("Ранее обсуждали:\n- Сколько стоит обучение? — Обучение стоит 500 000 тенге.")
+    assert "Оплата по семестрам" not in history.text
+    assert history.text.endswith("Пользователь: Где оно?\nАссистент: На улице Ломова.")
+    # Фрагменты последних ответов впереди, из каждого ответа — не больше passages_per_turn
+    assert history.passage_ids == ("p5", "p4", "p1", "p2")
+    assert (history.last_question, history.last_mode) == ("Где оно?", "university")
+
+
+def test_history_fits_token_budget_and_digest_changes():
+    store = SessionStore(recent_turns=2, token_budget=40, answer_chars=2000)
+    store.append("s", "Первый вопрос", "Короткий ответ.", "universal")
+    first = store.history("s")
+    store.append("s", "Второй вопрос", "Очень длинный ответ " * 100, "universal")
+    second = store.history("s")
+    assert second.digest != first.digest
+    # Последняя реплика нужна всегда и обрезается под бюджет, предыдущие не помещаются
+    assert "Первый вопрос" not in second.text
+    assert second.text.startswith("Пользователь: Второй вопрос") and len(second.text) <= 40 * 3 + 1
+
+
+def test_sessions_evicted_by_count_and_idle_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("sessions.time.monotonic", lambda: now[0])
+    store = SessionStore(max_sessions=2, idle_ttl=60)
+    for session_id in ("a", "b", "c"):
+        store.append(session_id, "вопрос", "ответ", "universal")
+    assert len(store) == 2 and store.history("a") is None
+    now[0] += 30
+    store.append("b", "ещё вопрос", "ответ", "universal")
+    now[0] += 40
+    # «c» простаивает 70 с, «b» — 40 с
+    assert store.history("c") is None
+    assert store.history("b") is not None
+    assert store.stats()["evicted"] == 2